@@ -1,12 +1,8 @@
 #!/usr/bin/env bash
 # Bash script to build tests
 
-# build test vector files
-python3 gen_tv/gen_pc_tv.py
-python3 gen_tv/gen_ram_tv.py
-python3 gen_tv/gen_rom_tv.py
-python3 gen_tv/gen_alu_tv.py
-python3 gen_tv/gen_cpu_tv.py
+# build test vector files, in parallel and only those that are out of date (see gen_tv/build_tvs.py)
+python3 gen_tv/build_tvs.py "$@"
 
 # build test benches
 iverilog -o bin/PC_test PC_tb.v ../src/PC.v
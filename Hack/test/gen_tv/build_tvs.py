@@ -0,0 +1,142 @@
+"""
+script for (re)building all the testvector files, used by build.sh
+
+Runs the gen_*_tv.py scripts in parallel processes, skipping those whose outputs are up to date: a
+content hash of each script, the simulator sources it depends on and its arguments is kept in
+CACHE_FILE, and a script is only rerun when that hash changes or one of its outputs is missing.
+A script that fails doesn't stop the others: the hashes of the ones that succeeded are still cached,
+and the failures are listed at the end with an exit status of 1.
+
+Usage (from the directory above this one, like the scripts themselves):
+    python3 gen_tv/build_tvs.py [--seed SEED] [--force] [--jobs JOBS]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+GEN_TV_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = "tvs/.build_cache.json"  # expects to be run from directory above this
+
+# script: (simulator sources it depends on, outputs, whether it takes a --seed)
+GENERATORS = {
+    "gen_pc_tv.py": (
+        ["simulators/__init__.py", "simulators/packed.py", "simulators/pc.py"],
+        ["tvs/PC.tv"],
+        False,
+    ),
+    "gen_ram_tv.py": (
+        ["simulators/__init__.py", "simulators/packed.py", "simulators/ram.py"],
+        ["tvs/RAM.tv"],
+        False,
+    ),
+    "gen_rom_tv.py": (
+        [
+            "simulators/__init__.py",
+            "simulators/packed.py",
+            "simulators/rom.py",
+            "simulators/ram.py",
+        ],
+        ["tvs/ROM.tv", "tvs/ROM_input.tv"],
+        False,
+    ),
+    "gen_alu_tv.py": (
+        ["simulators/__init__.py", "simulators/packed.py", "simulators/alu.py"],
+        ["tvs/ALU.tv"],
+        True,
+    ),
+    "gen_cpu_tv.py": (
+        [
+            "simulators/__init__.py",
+            "simulators/packed.py",
+            "simulators/cpu.py",
+            "simulators/alu.py",
+            "simulators/pc.py",
+        ],
+        ["tvs/CPU.tv"],
+        True,
+    ),
+}
+
+
+def content_hash(script: str, sources: List[str], args: List[str]) -> str:
+    """
+    hash of everything that determines the output of script
+    """
+    sha = hashlib.sha256()
+    for filename in [script] + sources:
+        sha.update(filename.encode())
+        with open(os.path.join(GEN_TV_DIR, filename), "rb") as f:
+            sha.update(f.read())
+    sha.update(json.dumps(args).encode())
+    return sha.hexdigest()
+
+
+def run(script: str, args: List[str]) -> float:
+    """
+    runs script with args, returns the time it took
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(GEN_TV_DIR, script)] + args, check=True)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="builds the testvector files that are out of date"
+    )
+    arg_parser.add_argument(
+        "--seed", type=int, default=None, help="seed for the scripts that take one"
+    )
+    arg_parser.add_argument("--force", action="store_true", help="rebuild everything")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="scripts to run at once"
+    )
+    args = arg_parser.parse_args()
+
+    cache: Dict[str, str] = {}
+    if os.path.exists(CACHE_FILE) and not args.force:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+
+    todo: Dict[str, List[str]] = {}
+    hashes: Dict[str, str] = {}
+    for script, (sources, outputs, seeded) in GENERATORS.items():
+        script_args = ["--seed", str(args.seed)] if seeded and args.seed is not None else []
+        hashes[script] = content_hash(script, sources, script_args)
+        outputs_exist = all(os.path.exists(output) for output in outputs)
+        if cache.get(script) == hashes[script] and outputs_exist:
+            print(f"{script}: up to date")
+        else:
+            todo[script] = script_args
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures: Dict[str, Future] = {
+            script: pool.submit(run, script, script_args) for script, script_args in todo.items()
+        }
+    built = 0
+    failed: List[str] = []
+    for script, future in futures.items():
+        try:
+            seconds = future.result()
+        except subprocess.CalledProcessError as e:
+            print(f"{script}: failed with exit status {e.returncode}")
+            # its outputs may be partly written, so it can't count as up to date on the next run
+            cache.pop(script, None)
+            failed.append(script)
+            continue
+        print(f"{script}: built in {seconds:.2f}s")
+        cache[script] = hashes[script]
+        built += 1
+    print(f"{built} of {len(GENERATORS)} built in {time.perf_counter() - start:.2f}s")
+
+    with open(CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2)
+    if failed:
+        sys.exit("failed: " + ", ".join(failed))
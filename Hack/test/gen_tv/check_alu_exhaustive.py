@@ -0,0 +1,97 @@
+"""
+script for checking the shards written by gen_alu_exhaustive.py
+
+Streams through every shard listed in the manifest (memory mapped, one function and a few x values
+at a time) and compares the stored out values against an independent model of the ALU: the function
+table on page 56 of the book, i.e. x+y for 000010, rather than ALUSimulator's emulation of the
+zx/nx/zy/ny/f/no control bits.
+Reports mismatches, coverage and throughput.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from typing import Callable, Dict
+
+OUTPUT_DIR = "tvs/alu_exhaustive"  # expects to be run from directory above this
+BATCH_X = 64  # x values checked at once
+
+# f(x, y) for each function, on int64 arrays holding the signed 16-bit inputs
+FUNCTIONS: Dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "101010": lambda x, y: np.zeros_like(x),  # f(x,y) = 0
+    "111111": lambda x, y: np.ones_like(x),  # f(x,y) = 1
+    "111010": lambda x, y: -np.ones_like(x),  # f(x,y) = -1
+    "001100": lambda x, y: x,  # f(x,y) = x
+    "110000": lambda x, y: y,  # f(x,y) = y
+    "001101": lambda x, y: ~x,  # f(x,y) = !x
+    "110001": lambda x, y: ~y,  # f(x,y) = !y
+    "001111": lambda x, y: -x,  # f(x,y) = -x
+    "110011": lambda x, y: -y,  # f(x,y) = -y
+    "011111": lambda x, y: x + 1,  # f(x,y) = x+1
+    "110111": lambda x, y: y + 1,  # f(x,y) = y+1
+    "001110": lambda x, y: x - 1,  # f(x,y) = x-1
+    "110010": lambda x, y: y - 1,  # f(x,y) = y-1
+    "000010": lambda x, y: x + y,  # f(x,y) = x+y
+    "010011": lambda x, y: x - y,  # f(x,y) = x-y
+    "000111": lambda x, y: y - x,  # f(x,y) = y-x
+    "000000": lambda x, y: x & y,  # f(x,y) = x&y
+    "010101": lambda x, y: x | y,  # f(x,y) = x|y
+}
+
+
+def to_int16(vals: np.ndarray) -> np.ndarray:
+    """
+    wraps vals into the signed 16-bit range, like the ALU's overflow
+    """
+    return (((vals + 0x8000) & 0xFFFF) - 0x8000).astype(np.int16)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="checks the shards written by gen_alu_exhaustive.py"
+    )
+    arg_parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = arg_parser.parse_args()
+
+    with open(os.path.join(args.output_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    funcs = manifest["funcs"]
+    y_count = manifest["y_count"]
+    y = np.arange(y_count, dtype=np.int64).astype(np.int16).astype(np.int64)
+
+    start = time.perf_counter()
+    vectors = 0
+    mismatches = 0
+    covered_x = 0
+    for shard in manifest["shards"]:
+        x_count = shard["x_stop"] - shard["x_start"]
+        covered_x += x_count
+        outs = np.memmap(os.path.join(args.output_dir, shard["file"]),
+                         dtype=manifest["dtype"],
+                         mode="r",
+                         shape=(len(funcs), x_count, y_count))
+        for f_index, func in enumerate(funcs):
+            for batch in range(0, x_count, BATCH_X):
+                stored = outs[f_index, batch:batch + BATCH_X]
+                x_bits = np.arange(shard["x_start"] + batch, shard["x_start"] + batch + len(stored))
+                x = x_bits.astype(np.int16).astype(np.int64)[:, None]
+                expected = np.broadcast_to(to_int16(FUNCTIONS[func](x, y[None, :])), stored.shape)
+                bad = np.argwhere(stored != expected)
+                for x_i, y_i in bad[:10 - min(mismatches, 10)]:
+                    print(
+                        f"mismatch: func={func} x={x[x_i, 0]} y={y[y_i]} "
+                        f"stored={stored[x_i, y_i]} expected={expected[x_i, y_i]}"
+                    )
+                mismatches += len(bad)
+                vectors += stored.size
+    seconds = time.perf_counter() - start
+
+    print(f"{vectors} vectors checked, {mismatches} mismatches")
+    print(
+        f"coverage: {covered_x} of {y_count} x values, "
+        f"{100 * covered_x / y_count:.3f}% of the input space of each of {len(funcs)} functions"
+    )
+    print(f"{vectors / seconds:,.0f} vectors/s")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,189 @@
+"""
+script for checking testvector files against the simulators, without iverilog
+
+Memory maps each file (text or packed, see simulators.packed), decodes it BATCH lines at a time into
+arrays of its fields and compares the outputs stored in it against the simulator of the device:
+- ALU: ALUSimulator.simulate_batch, one batch per function
+- CPU: CPUSimulator.simulate_batch, each step starting from the registers stored on the line before
+  it, so a mismatch is reported on the line where it happens rather than on every line after it
+- PC, RAM: stepping through the simulator like the testbench does
+- ROM: stepping through the simulator, after loading it with ROM_input.tv (or .tvb) next to the file
+Reports the first mismatches of each file, and exits with 1 if there were any.
+
+Usage (from the directory above this one, like the gen_*_tv.py scripts):
+    python3 gen_tv/check_tv.py [FILE ...]
+checks every file in tvs/ that has a simulator by default.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+from typing import Dict, Iterator, Tuple, Union
+from convert_tv import LAYOUTS
+from simulators.packed import PackedTV, TextTV
+from simulators.alu import ALUSimulator, UnkownALUFunction
+from simulators.cpu import CPUSimulator
+from simulators.pc import PCSimulator
+from simulators.ram import RAMSimulator
+from simulators.rom import ROMSimulator
+
+TVS_DIR = "tvs"  # expects to be run from directory above this
+BATCH = 1 << 16  # lines decoded at once
+MAX_REPORTED = 10  # mismatches printed per file
+
+CHECKED = ["ALU", "CPU", "PC", "RAM", "ROM"]  # names of the files with a simulator
+
+Mismatch = Tuple[int, str]  # (line number, description)
+
+
+def open_tv(filename: str) -> Union[PackedTV, TextTV]:
+    if filename.endswith(".tvb"):
+        return PackedTV(filename)
+    return TextTV(filename, LAYOUTS[os.path.splitext(os.path.basename(filename))[0]][0])
+
+
+def compare(start: int, stored: Dict[str, np.ndarray], expected: Dict[str, np.ndarray],
+            rows: np.ndarray = None) -> Iterator[Mismatch]:
+    """
+    compares the stored fields of the lines start + rows against the expected values of the same
+    fields
+    """
+    if rows is None:
+        rows = np.arange(len(next(iter(expected.values()))))
+    bad = np.zeros(len(rows), dtype=bool)
+    for name, values in expected.items():
+        bad |= stored[name][rows] != values
+    for i in np.flatnonzero(bad):
+        diffs = [
+            f"{name}={stored[name][rows[i]]} expected {values[i]}"
+            for name, values in expected.items()
+            if stored[name][rows[i]] != values[i]
+        ]
+        yield start + rows[i] + 1, ", ".join(diffs)
+
+
+def check_alu(tv: Union[PackedTV, TextTV]) -> Iterator[Mismatch]:
+    alusim = ALUSimulator()
+    for start in range(0, len(tv), BATCH):
+        fields = tv.fields(start, start + BATCH)
+        funcs = np.zeros_like(fields["x"])
+        for bit in ["zx", "nx", "zy", "ny", "f", "no"]:
+            funcs = (funcs << 1) | fields[bit]
+        for func in np.unique(funcs):
+            rows = np.flatnonzero(funcs == func)
+            func_s = format(func, "06b")
+            if func_s not in alusim.funcs:
+                for row in rows:
+                    yield start + row + 1, f"unknown function {func_s}"
+                continue
+            out, zr, ng = alusim.simulate_batch(fields["x"][rows], fields["y"][rows], func_s)
+            expected = {"out": out.astype(np.int64) & 0xFFFF, "zr": zr, "ng": ng}
+            yield from compare(start, fields, expected, rows)
+
+
+def check_cpu(tv: Union[PackedTV, TextTV]) -> Iterator[Mismatch]:
+    cpusim = CPUSimulator()
+    registers = (0, 0, 0)  # A, D, pc before the first step, like a new CPUSimulator
+    for start in range(0, len(tv), BATCH):
+        fields = tv.fields(start, start + BATCH)
+        A, D, pc = (
+            np.concatenate([[before], fields[name][:-1]])
+            for before, name in zip(registers, ["A", "D", "pc"])
+        )
+        registers = (fields["A"][-1], fields["D"][-1], fields["pc"][-1])
+        try:
+            outputs = cpusim.simulate_batch(
+                fields["inM"], fields["instruction"], fields["reset"], A, D, pc
+            )
+        except UnkownALUFunction as e:
+            yield start + 1, f"{e} in lines {start + 1}-{start + len(A)}"
+            continue
+        expected = dict(zip(["outM", "writeM", "addressM", "pc", "alu_out", "A", "D"], outputs))
+        yield from compare(start, fields, expected)
+
+
+def check_pc(tv: Union[PackedTV, TextTV]) -> Iterator[Mismatch]:
+    pcsim = PCSimulator()
+    for start in range(0, len(tv), BATCH):
+        fields = tv.fields(start, start + BATCH)
+        out = [
+            pcsim.simulate_step(in_, reset, load, inc) & 0xFFFF
+            for in_, reset, load, inc in zip(
+                *(fields[name].tolist() for name in ["in", "reset", "load", "inc"])
+            )
+        ]
+        yield from compare(start, fields, {"out": np.array(out)})
+
+
+def check_memory(tv: Union[PackedTV, TextTV], step) -> Iterator[Mismatch]:
+    """
+    compares the out field against step(fields, row), None meaning unknown (all x)
+    """
+    for start in range(0, len(tv), BATCH):
+        fields = tv.fields(start, start + BATCH)
+        unknown = tv.fields_unknown(start, start + BATCH)["out"]
+        for row, (out, x) in enumerate(zip(fields["out"].tolist(), unknown.tolist())):
+            expected = step(fields, row)
+            if expected is None and x != 0xFFFF:
+                yield start + row + 1, f"out={out} expected x"
+            elif expected is not None and (x != 0 or out != expected & 0xFFFF):
+                yield start + row + 1, f"out={out if x == 0 else 'x'} expected {expected & 0xFFFF}"
+
+
+def check_ram(tv: Union[PackedTV, TextTV]) -> Iterator[Mismatch]:
+    ramsim = RAMSimulator()
+    yield from check_memory(
+        tv, lambda fields, row: ramsim.simulate_step(
+            int(fields["address"][row]), int(fields["in"][row]), bool(fields["load"][row])))
+
+
+def check_rom(
+    tv: Union[PackedTV, TextTV], rom_input: Union[PackedTV, TextTV]
+) -> Iterator[Mismatch]:
+    romsim = ROMSimulator()
+    for address, value in enumerate(rom_input.fields()["out"].tolist()):
+        romsim.load(address, value)
+    yield from check_memory(
+        tv, lambda fields, row: romsim.simulate_step(int(fields["address"][row]))
+    )
+
+
+def check(filename: str) -> Iterator[Mismatch]:
+    tv = open_tv(filename)
+    name, extension = os.path.splitext(os.path.basename(filename))
+    if name == "ROM":
+        rom_input = open_tv(os.path.join(os.path.dirname(filename), "ROM_input" + extension))
+        return check_rom(tv, rom_input)
+    return {"ALU": check_alu, "CPU": check_cpu, "PC": check_pc, "RAM": check_ram}[name](tv)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="checks testvector files against the simulators"
+    )
+    arg_parser.add_argument(
+        "files", nargs="*", help="defaults to every file in " + TVS_DIR + " with a simulator"
+    )
+    args = arg_parser.parse_args()
+
+    files = args.files or sorted(
+        filename for filename in glob.glob(os.path.join(TVS_DIR, "*.tv"))
+        if os.path.splitext(os.path.basename(filename))[0] in CHECKED)
+
+    failed = False
+    for filename in files:
+        if os.path.splitext(os.path.basename(filename))[0] not in CHECKED:
+            print(f"{filename}: no simulator to check it against")
+            continue
+        start = time.perf_counter()
+        mismatches = 0
+        for line, description in check(filename):
+            if mismatches < MAX_REPORTED:
+                print(f"{filename}:{line}: {description}")
+            mismatches += 1
+        failed |= mismatches > 0
+        print(f"{filename}: {len(open_tv(filename))} vectors, {mismatches} mismatches "
+              f"in {time.perf_counter() - start:.2f}s")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,65 @@
+"""
+script for converting testvector files between text ($readmemb) and packed (*.tvb, see
+simulators.packed)
+
+The gen_*_tv.py scripts write packed files with --packed; unpack them for the testbenches, which
+only read text:
+    python3 gen_tv/convert_tv.py unpack tvs/CPU.tvb
+writes tvs/CPU.tv. pack goes the other way, finding the layout from the name of the file:
+    python3 gen_tv/convert_tv.py pack tvs/CPU.tv
+"""
+import os
+import argparse
+from simulators.packed import PackedTV, PackedTVWriter
+from simulators.alu import ALUSimulator
+from simulators.cpu import CPUSimulator
+from simulators.pc import PCSimulator
+from simulators.ram import RAMSimulator
+from simulators.rom import ROMSimulator
+
+BATCH = 1 << 16  # lines converted at once
+
+# file name (without extension): (layout, has_x)
+LAYOUTS = {
+    "ALU": (ALUSimulator.LAYOUT, ALUSimulator.HAS_X),
+    "CPU": (CPUSimulator.LAYOUT, CPUSimulator.HAS_X),
+    "PC": (PCSimulator.LAYOUT, PCSimulator.HAS_X),
+    "RAM": (RAMSimulator.LAYOUT, RAMSimulator.HAS_X),
+    "ROM": (ROMSimulator.LAYOUT, ROMSimulator.HAS_X),
+    "ROM_input": (ROMSimulator.LOAD_LAYOUT, ROMSimulator.HAS_X),
+}
+
+
+def unpack(packed_file: str, text_file: str):
+    tv = PackedTV(packed_file)
+    with open(text_file, "w") as f:
+        for start in range(0, len(tv), BATCH):
+            f.write(tv.to_text(start, start + BATCH))
+
+
+def pack(text_file: str, packed_file: str, name: str):
+    layout, has_x = LAYOUTS[name]
+    with open(text_file) as f, PackedTVWriter(packed_file, layout, has_x) as packed:
+        for line in f:
+            packed.write(line)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="converts testvector files between text and packed"
+    )
+    arg_parser.add_argument("direction", choices=["pack", "unpack"])
+    arg_parser.add_argument("input")
+    arg_parser.add_argument(
+        "-o", "--output", default=None, help="defaults to input with the other extension"
+    )
+    arg_parser.add_argument(
+        "--layout", choices=LAYOUTS, default=None, help="defaults to the name of the input"
+    )
+    args = arg_parser.parse_args()
+
+    base, _ = os.path.splitext(args.input)
+    if args.direction == "unpack":
+        unpack(args.input, args.output or base + ".tv")
+    else:
+        pack(args.input, args.output or base + ".tvb", args.layout or os.path.basename(base))
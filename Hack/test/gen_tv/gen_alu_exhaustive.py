@@ -0,0 +1,112 @@
+"""
+script for exhaustively generating the expected ALU outputs for every (x, y) input and every
+function
+
+Unlike gen_alu_tv.py this doesn't sample: the 2^16 x 2^16 input space of each function in
+ALUSimulator.funcs is split into shards of consecutive x values, which are simulated with
+ALUSimulator.simulate_batch by a multiprocessing pool and written as compact binary files.
+
+Format:
+- shard_{n}.bin: the out values as little endian int16, laid out as [func][x][y] where func goes in
+  the order of ALUSimulator.funcs and x and y are the 16-bit input patterns x_start..x_stop-1 and
+  0..65535. zr and ng aren't stored since they follow from out (out == 0 and out < 0).
+- manifest.json: the functions, the layout and the x range of every shard, so that consumers (i.e.
+  check_alu_exhaustive.py) can stream through the shards
+
+The full space is 18 * 2^32 vectors (144 GiB), so --x-stop has no default: every run names the x
+range it covers, i.e.
+    python3 gen_tv/gen_alu_exhaustive.py --x-stop 1024
+covers 1/64 of every function's input space (2.25 GiB), and --x-stop 65536 covers all of it.
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from typing import Tuple
+from simulators.alu import ALUSimulator
+
+OUTPUT_DIR = "tvs/alu_exhaustive"  # expects to be run from directory above this
+SHARD_X = 256  # x values per shard, i.e. 18 * 256 * 65536 vectors (576 MiB) per shard
+BATCH_X = 16  # x values simulated at once by a worker, bounds its memory use
+
+alusim = ALUSimulator()
+Y = np.arange(2**16, dtype=np.int64)
+
+
+def write_shard(job: Tuple[str, int, int]) -> Tuple[str, int, float]:
+    """
+    simulates every function for x in [x_start, x_stop) and every y, and writes the out values to
+    filename
+    returns (filename, number of vectors, seconds spent)
+    """
+    filename, x_start, x_stop = job
+    start = time.perf_counter()
+    with open(filename, "wb") as f:
+        for func in alusim.funcs:
+            for batch_start in range(x_start, x_stop, BATCH_X):
+                x = np.repeat(np.arange(batch_start, min(batch_start + BATCH_X, x_stop)), len(Y))
+                y = np.tile(Y, len(x) // len(Y))
+                out, _, _ = alusim.simulate_batch(x, y, func)
+                f.write(out.astype("<i2").tobytes())
+    return filename, len(alusim.funcs) * (x_stop - x_start) * len(Y), time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="exhaustively generates the ALU's expected outputs"
+    )
+    arg_parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    arg_parser.add_argument(
+        "--x-start", type=int, default=0, help="first x (as a 16-bit pattern) to cover"
+    )
+    arg_parser.add_argument(
+        "--x-stop",
+        type=int,
+        required=True,
+        help="stop before this x, 65536 for the full space (144 GiB)",
+    )
+    arg_parser.add_argument("--shard-x", type=int, default=SHARD_X, help="x values per shard")
+    arg_parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = arg_parser.parse_args()
+    if not 0 <= args.x_start < args.x_stop <= 2**16:
+        arg_parser.error("need 0 <= --x-start < --x-stop <= 65536")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [
+        (
+            os.path.join(args.output_dir, f"shard_{n:05d}.bin"),
+            x_start,
+            min(x_start + args.shard_x, args.x_stop),
+        )
+        for n, x_start in enumerate(range(args.x_start, args.x_stop, args.shard_x))
+    ]
+
+    start = time.perf_counter()
+    with Pool(args.processes) as pool:
+        results = pool.map(write_shard, jobs)
+    wall_time = time.perf_counter() - start
+
+    manifest = {
+        "funcs": alusim.funcs,
+        "dtype": "<i2",
+        "layout": ["func", "x", "y"],
+        "y_count": len(Y),
+        "shards": [
+            {"file": os.path.basename(filename), "x_start": x_start, "x_stop": x_stop}
+            for filename, x_start, x_stop in jobs
+        ],
+    }
+    with open(os.path.join(args.output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    vectors = sum(count for _, count, _ in results)
+    cpu_time = sum(seconds for _, _, seconds in results)
+    covered = (args.x_stop - args.x_start) / 2**16
+    print(
+        f"{len(jobs)} shards, {vectors} vectors covering {100 * covered:.3f}% of the input space "
+        f"of each of {len(alusim.funcs)} functions"
+    )
+    print(f"{vectors / wall_time:,.0f} vectors/s with {args.processes} processes, "
+          f"{vectors / cpu_time:,.0f} vectors/s per core")
@@ -9,18 +9,31 @@ For each combination of zx, nx, zy, ny, f, no listed on page 56 of the pdf of th
 - check with:
   - x = 0, y = 0
   - check N times with random integers in [-32768, 32767]
+
+The vectors for each function are simulated and formatted in one batch (see
+ALUSimulator.simulate_batch), so N can be raised to millions. NOTE: ALU_tb.v expects exactly 18 * N
+vectors, update it along with N.
 """
+import argparse
+import numpy as np
 from simulators.alu import ALUSimulator
-from random import randint
 
 OUTPUT_FILE = "tvs/ALU.tv"  # expects to be run from directory above this
 N = 1000  # number of times each function will be checked with random inputs for x and y
 
+arg_parser = argparse.ArgumentParser(description="generates " + OUTPUT_FILE)
+arg_parser.add_argument("-n", type=int, default=N, help="random (x, y) pairs per function")
+arg_parser.add_argument("--seed", type=int, default=None, help="seed for reproducible vectors")
+arg_parser.add_argument("--packed",
+                        action="store_true",
+                        help="write " + OUTPUT_FILE + "b, see simulators.packed")
+args = arg_parser.parse_args()
+
 alusim = ALUSimulator()
+rng = np.random.default_rng(args.seed)
 
-with open(OUTPUT_FILE, "w") as f:
+with alusim.open_tv(OUTPUT_FILE + "b" if args.packed else OUTPUT_FILE, args.packed) as f:
     for func in alusim.funcs:
-        for i in range(N):
-            x = randint(-32768, 32767)
-            y = randint(-32768, 32767)
-            f.write(alusim.build_line(x, y, func))
+        x = rng.integers(-32768, 32767, size=args.n, endpoint=True)
+        y = rng.integers(-32768, 32767, size=args.n, endpoint=True)
+        f.write(alusim.build_lines(x, y, func))
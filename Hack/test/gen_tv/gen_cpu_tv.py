@@ -1,5 +1,5 @@
 """
-script for generating the testvector file for use in ALU_tb.v
+script for generating the testvector file for use in CPU_tb.v
 
 Format will be:
 {inM[WIDTH], instruction[WIDTH], reset}_{outM[WIDTH], writeM, addressM[WIDTH], pc[WIDTH]}
@@ -13,68 +13,139 @@ Algorithm:
     of how the ALU logic is hardcoded in the python simulation. The verilog in ALU.v is a high
     enough level of abstraction that I'm not sure what it does on an invalid instruction. It would
     be interesting to check this model out in that Xilinx tool that allows you to see the block/wiring
-    diagram and/or a signal-probe simulation, since that might give you more insight into how the high 
+    diagram and/or a signal-probe simulation, since that might give you more insight into how the high
     level verilog is interpreted.
-    
+
     This all makes me consider whether this is moment where formal verification might come into
     play -- I've heard that it's used effectively for digital design. In some sense it would also
     be a test of whether one's formal verification problem was set up correctly. I imagine that it
     might be better because formal verification might make it easier to specify and test all the possible
-    edge cases. Perhaps I'm being lazy, but trying to do that using my python simulations for a machine as 
+    edge cases. Perhaps I'm being lazy, but trying to do that using my python simulations for a machine as
     complex as the CPU is seems extremely daunting.
+
+Reproducibility:
+  - The vectors are a deterministic stream given a seed (see stream_vectors), made up of blocks of
+    BLOCK vectors. Each block draws its random inputs from its own generator seeded with (seed,
+    block number), and starts with a reset whose instruction computes a constant, so its expected
+    outputs don't depend on what ran before it. That way any part of the stream can be generated
+    on its own, and --chunks K writes the file in K chunks in parallel that concatenate to exactly
+    what a serial run writes.
+  - Only instructions the python ALU can simulate are drawn in the first place: C-instructions and
+    A-instructions both get their c1-c6 bits from ALUSimulator.funcs.
 """
+import os
+import shutil
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from typing import Iterator, Optional, Tuple
+from simulators import BIN_STRS_16
 from simulators.cpu import CPUSimulator
-from simulators.alu import ALUSimulator, UnkownALUFunction
-from random import randint
+from simulators.alu import ALUSimulator
 
 OUTPUT_FILE = "tvs/CPU.tv"  # expects to be run from directory above this
 N = 100000
-i = 0
+BLOCK = 10000  # vectors per independently seeded block, each starting with a reset
 
 # Flag in case you only want to generate A instructions to help
 # narrow down the debugging process
 GENERATE_ONLY_A_INSTRUCTIONS = False
 
-cpusim = CPUSimulator()
+FUNCS = np.array([int(func, 2) for func in ALUSimulator.funcs])
+# f(x,y) = 0, 1 and -1, for resets that compute the same outM whatever state the CPU was in
+CONSTANT_FUNCS = np.array([int(func, 2) for func in ["101010", "111111", "111010"]])
 
 
-def gen_random_instruction() -> str:
+def random_instructions(rng: np.random.Generator, n: int) -> np.ndarray:
     """
-    Function for generating a random instruction since there are some rules instructions should play by.
+    generates n random instructions since there are some rules instructions should play by:
+    - C-instructions have bits 14 and 13 set, per the specification 4.2.3 The C-Instruction
+    - c1-c6 must be a valid function for the alu, for A-instructions as well since the ALU runs on
+      every instruction
     """
-    possible_instruction = cpusim.int_to_bin_str(randint(-32768, 32767), cpusim.WIDTH)
-
+    bits = rng.integers(0, 2**16, size=n)
     if GENERATE_ONLY_A_INSTRUCTIONS:
-        return "0" + possible_instruction[1:]
-
-    if possible_instruction[0] == "0":
-        # if this is an A instruction go ahead and return it right away
-        return possible_instruction
-    else:
-        # else this is a C instruction, possible_instruction[1:3] == '1'
-        # per the specification 4.2.3 The C-Instruction
-        possible_instruction = possible_instruction[0] + "11" + possible_instruction[3:]
-        # a[4:10] must be a valid function for the alu
-        possible_instruction = (
-            possible_instruction[0:4]
-            + ALUSimulator.funcs[randint(0, len(ALUSimulator.funcs) - 1)]
-            + possible_instruction[10:]
-        )
-        return possible_instruction
-
-
-with open(OUTPUT_FILE, "w") as f:
-    while i < N:
-        inM = randint(-32768, 32767)
-        instruction = gen_random_instruction()
-        if i == 0:
-            reset = True
-        else:
-            # TODO: make reset = bool(randint(0, 1)), this
-            # current setup is just easier for debugging purposes
-            reset = False
-        try:
-            f.write(cpusim.build_line(inM, instruction, reset))
-            i += 1
-        except UnkownALUFunction as e:
-            continue
+        bits &= 0x7FFF
+    is_c = (bits >> 15) == 1
+    bits[is_c] |= 0b011 << 13
+    funcs = FUNCS[rng.integers(0, len(FUNCS), size=n)]
+    return (bits & ~(0b111111 << 6)) | (funcs << 6)
+
+
+def random_block(seed: int, block: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    draws (inM, instructions) for the BLOCK vectors of block number block
+    """
+    rng = np.random.default_rng([seed, block])
+    inM = rng.integers(-32768, 32767, size=BLOCK, endpoint=True)
+    instructions = random_instructions(rng, BLOCK)
+    # the reset at the start of the block is a C-instruction computing a constant
+    instructions[0] = ((instructions[0] | (0b111 << 13)) & ~(0b111111 << 6)) | (
+        CONSTANT_FUNCS[rng.integers(0, len(CONSTANT_FUNCS))] << 6)
+    return inM, instructions
+
+
+def stream_vectors(seed: int, offset: int = 0, count: Optional[int] = None) -> Iterator[str]:
+    """
+    yields the lines of the testvector stream for seed, starting with the line at offset
+    yields count lines, or goes on forever if count is None
+    """
+    block = offset // BLOCK
+    skip = offset % BLOCK
+    while count is None or count > 0:
+        cpusim = CPUSimulator()
+        inM, instructions = random_block(seed, block)
+        for i in range(BLOCK):
+            line = cpusim.build_line(int(inM[i]), BIN_STRS_16[instructions[i]], i == 0)
+            if skip:
+                # the CPU's state still has to be simulated up to offset
+                skip -= 1
+                continue
+            yield line
+            if count is not None:
+                count -= 1
+                if count == 0:
+                    return
+        block += 1
+
+
+def write_chunk(job: Tuple[str, int, int, int]) -> str:
+    """
+    writes count lines of the stream for seed starting at offset to filename
+    """
+    filename, seed, offset, count = job
+    with open(filename, "w") as f:
+        f.writelines(stream_vectors(seed, offset, count))
+    return filename
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="generates " + OUTPUT_FILE)
+    arg_parser.add_argument(
+        "-n", type=int, default=N, help="number of vectors, CPU_tb.v expects 100000"
+    )
+    arg_parser.add_argument("--seed", type=int, default=None, help="seed for reproducible vectors")
+    arg_parser.add_argument("--chunks", type=int, default=1, help="chunks to generate in parallel")
+    arg_parser.add_argument(
+        "--packed", action="store_true", help="write " + OUTPUT_FILE + "b, see simulators.packed"
+    )
+    args = arg_parser.parse_args()
+
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+    bounds = [args.n * k // args.chunks for k in range(args.chunks + 1)]
+    jobs = [
+        (f"{OUTPUT_FILE}.{k}", seed, bounds[k], bounds[k + 1] - bounds[k])
+        for k in range(args.chunks)
+    ]
+    with Pool(args.chunks) as pool:
+        chunks = pool.map(write_chunk, jobs)
+
+    output = OUTPUT_FILE + "b" if args.packed else OUTPUT_FILE
+    with CPUSimulator().open_tv(output, args.packed) as f:
+        for chunk in chunks:
+            with open(chunk) as c:
+                if args.packed:
+                    f.write(c.read())
+                else:
+                    shutil.copyfileobj(c, f)
+            os.remove(chunk)
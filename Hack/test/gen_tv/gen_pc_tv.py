@@ -10,10 +10,17 @@ Algorithm:
 - count up to 65535
 - count up to 1000 again to check rollover
 """
+import argparse
 from simulators.pc import PCSimulator
 
 OUTPUT_FILE = "tvs/PC.tv"  # expects to be run from directory above this
 
+arg_parser = argparse.ArgumentParser(description="generates " + OUTPUT_FILE)
+arg_parser.add_argument("--packed",
+                        action="store_true",
+                        help="write " + OUTPUT_FILE + "b, see simulators.packed")
+args = arg_parser.parse_args()
+
 pcsim = PCSimulator()
 
 # initial values
@@ -22,7 +29,7 @@ reset = 1  # start with a reset
 load = 1  # start with load 1, see that reset has precedence
 inc = 1  # start with inc 1, see that reset has precedence
 
-with open(OUTPUT_FILE, "w") as f:
+with pcsim.open_tv(OUTPUT_FILE + "b" if args.packed else OUTPUT_FILE, args.packed) as f:
     f.write(pcsim.build_line(in_v, reset, load, inc))
 
     # count up to 1000 to check increment
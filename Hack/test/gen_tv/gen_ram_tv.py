@@ -14,13 +14,20 @@ Algorithm:
 - confirm highest address register got 0. addressing doesn't rollover,
   out of bounds gets sent to the highest number register
 """
+import argparse
 from simulators.ram import RAMSimulator
 
 OUTPUT_FILE = "tvs/RAM.tv"  # expects to be run from directory above this
 
+arg_parser = argparse.ArgumentParser(description="generates " + OUTPUT_FILE)
+arg_parser.add_argument("--packed",
+                        action="store_true",
+                        help="write " + OUTPUT_FILE + "b, see simulators.packed")
+args = arg_parser.parse_args()
+
 ramsim = RAMSimulator()
 
-with open(OUTPUT_FILE, "w") as f:
+with ramsim.open_tv(OUTPUT_FILE + "b" if args.packed else OUTPUT_FILE, args.packed) as f:
     # address and in_v and out_v = 0..32767, load = 1: load each address with its value (test load)
     for i in range(32768):
         f.write(ramsim.build_line(i, i, True))
@@ -10,18 +10,27 @@ Format will be:
 Algorithm:
 - go through each address in ram and expect 32767 - address
 """
+import argparse
 from simulators.rom import ROMSimulator
 
 # expects to be run from directory above this
 ROM_MEMORY_INPUT = "tvs/ROM_input.tv"  # ROM32K must be loaded from a file
 OUTPUT_FILE = "tvs/ROM.tv"  # file for the testbench
 
+arg_parser = argparse.ArgumentParser(description="generates " + OUTPUT_FILE)
+arg_parser.add_argument("--packed",
+                        action="store_true",
+                        help="write " + ROM_MEMORY_INPUT + "b and " + OUTPUT_FILE +
+                        "b, see simulators.packed")
+args = arg_parser.parse_args()
+
 romsim = ROMSimulator()
 
-with open(ROM_MEMORY_INPUT, "w") as f:
+with romsim.open_tv(ROM_MEMORY_INPUT + "b" if args.packed else ROM_MEMORY_INPUT, args.packed,
+                   ROMSimulator.LOAD_LAYOUT) as f:
     for i in range(32768):
         f.write(romsim.load(i, 32767 - i))
 
-with open(OUTPUT_FILE, "w") as f:
+with romsim.open_tv(OUTPUT_FILE + "b" if args.packed else OUTPUT_FILE, args.packed) as f:
     for i in range(32768):
         f.write(romsim.build_line(i))
@@ -1,4 +1,7 @@
+import numpy as np
 from numpy import binary_repr
+from typing import List, TextIO, Union
+from simulators.packed import Layout, PackedTVWriter
 
 
 class BaseSimulator(object):
@@ -7,6 +10,21 @@ class BaseSimulator(object):
     Contains useful methods for dealing with integers and their binary string analogs
     '''
   WIDTH = 16
+  LAYOUT: Layout = []  # fields of the lines build_line returns, see simulators.packed
+  HAS_X = False  # whether build_line can return unknown (x) values
+
+  def open_tv(self,
+              filename: str,
+              packed: bool = False,
+              layout: Layout = None) -> Union[TextIO, PackedTVWriter]:
+    '''
+    opens a testvector file to write the lines build_line returns to, as text for $readmemb or
+    packed
+    layout: if the lines aren't build_line's (i.e. ROMSimulator.load's)
+    '''
+    if packed:
+      return PackedTVWriter(filename, layout or self.LAYOUT, self.HAS_X)
+    return open(filename, "w")
 
   def int_to_bin_str(self, val: int, width: int) -> str:
     '''
@@ -14,7 +32,8 @@ class BaseSimulator(object):
         val: number to be converted to binary
         width: bit-width of the output string (e.g. WIDTH-bits, 1-bit)
         '''
-    retval = binary_repr(val, width)
+    # mask first, numpy refuses to truncate values that don't fit in width
+    retval = binary_repr(int(val) % 2**width, width)
     if len(retval) > width:
       return retval[-width:]
     else:
@@ -40,6 +59,23 @@ class BaseSimulator(object):
       tmp3 = self.bin_str_to_int(tmp2)
       return -tmp3
 
+  def wrap(self, val: int) -> int:
+    '''
+    normalizes val to its WIDTH-bit twos complement interpretation, i.e. accounts for overflow
+    '''
+    return self.bin_str_to_int(self.int_to_bin_str(val, self.WIDTH))
+
+  def int_not(self, x: int) -> int:
+    return self.bin_str_to_int(self.bitwise_not(self.int_to_bin_str(x, self.WIDTH)))
+
+  def int_and(self, x: int, y: int) -> int:
+    return self.bin_str_to_int(
+        self.bitwise_and(self.int_to_bin_str(x, self.WIDTH), self.int_to_bin_str(y, self.WIDTH)))
+
+  def int_or(self, x: int, y: int) -> int:
+    return self.bin_str_to_int(
+        self.bitwise_or(self.int_to_bin_str(x, self.WIDTH), self.int_to_bin_str(y, self.WIDTH)))
+
   def bitwise_not(self, strval: str) -> str:
     notval = ''
     for dig in strval:
@@ -65,4 +101,74 @@ class BaseSimulator(object):
         orval += '1'
       else:
         orval += '0'
-    return orval
\ No newline at end of file
+    return orval
+
+  def bin_str_columns(self, vals: np.ndarray, width: int) -> np.ndarray:
+    '''
+    vectorized int_to_bin_str: converts an array of N integers to an (N, width) array of ascii
+    '0'/'1' characters, i.e. the rows of a testvector file before they're joined together
+    '''
+    bits = (np.asarray(vals, dtype=np.int64)[:, None] >> np.arange(width - 1, -1, -1)) & 1
+    return (bits + ord('0')).astype(np.uint8)
+
+  def join_columns(self, *columns) -> str:
+    '''
+    Joins columns from bin_str_columns (and separator strings like "_") into the lines of a
+    testvector file
+    '''
+    rows = len(next(column for column in columns if not isinstance(column, str)))
+    blocks = [
+        np.full((rows, len(column)), np.frombuffer(column.encode(), dtype=np.uint8))
+        if isinstance(column, str) else column for column in columns
+    ]
+    newlines = np.full((rows, 1), ord('\n'), dtype=np.uint8)
+    return np.hstack(blocks + [newlines]).tobytes().decode()
+
+
+# Every 16-bit value as a binary string, indexed by its unsigned value
+BIN_STRS_16: List[str] = [format(val, '016b') for val in range(2**16)]
+BITWISE_NOT = str.maketrans('01', '10')
+
+
+class IntBaseSimulator(BaseSimulator):
+  '''
+    Integer-native backend for BaseSimulator: values stay python ints throughout, masked to the
+    right width where needed, and are only turned into binary strings at the output, through a
+    lookup table for WIDTH-bit values.
+    Gives exactly the same results as BaseSimulator's string manipulation.
+    '''
+
+  def int_to_bin_str(self, val: int, width: int) -> str:
+    if width == 16:
+      return BIN_STRS_16[val & 0xFFFF]
+    return format(val & ((1 << width) - 1), f'0{width}b')
+
+  def bin_str_to_int(self, bin_str: str) -> int:
+    val = int(bin_str, 2)
+    if len(bin_str) > 1 and bin_str[0] == '1':
+      # negative value in twos complement
+      val -= 1 << len(bin_str)
+    return val
+
+  def wrap(self, val: int) -> int:
+    mask = (1 << self.WIDTH) - 1
+    sign = 1 << (self.WIDTH - 1)
+    return ((val + sign) & mask) - sign
+
+  def int_not(self, x: int) -> int:
+    return self.wrap(~x)
+
+  def int_and(self, x: int, y: int) -> int:
+    return self.wrap(x & y)
+
+  def int_or(self, x: int, y: int) -> int:
+    return self.wrap(x | y)
+
+  def bitwise_not(self, strval: str) -> str:
+    return strval.translate(BITWISE_NOT)
+
+  def bitwise_and(self, strx: str, stry: str) -> str:
+    return self.int_to_bin_str(int(strx, 2) & int(stry, 2), self.WIDTH)
+
+  def bitwise_or(self, strx: str, stry: str) -> str:
+    return self.int_to_bin_str(int(strx, 2) | int(stry, 2), self.WIDTH)
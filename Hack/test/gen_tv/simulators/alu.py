@@ -1,4 +1,5 @@
-from simulators import BaseSimulator
+import numpy as np
+from simulators import IntBaseSimulator
 from typing import Tuple
 
 
@@ -6,11 +7,17 @@ class UnkownALUFunction(Exception):
     pass
 
 
-class ALUSimulator(BaseSimulator):
+class ALUSimulator(IntBaseSimulator):
     """
     class for simulating the ALU
     """
 
+    LAYOUT = [
+        ("x", 16), "_", ("y", 16), "_",
+        ("zx", 1), ("nx", 1), ("zy", 1), ("ny", 1), ("f", 1), ("no", 1), "_",
+        ("out", 16), ("zr", 1), ("ng", 1),
+    ]
+
     # strings for function values in the format (zx)(nx)(zy)(ny)(f)(no), taken from page 56
     funcs = [
         "101010",  # f(x,y) = 0
@@ -43,7 +50,7 @@ class ALUSimulator(BaseSimulator):
             helper to build the tuple for each function
             """
             # account for overflow by normalizing to WIDTH-bit interpretation
-            out_norm = self.bin_str_to_int(self.int_to_bin_str(out, self.WIDTH))
+            out_norm = self.wrap(out)
             return (out_norm, out_norm == 0, out_norm < 0)
 
         if func == "101010":  # f(x,y) = 0
@@ -57,17 +64,9 @@ class ALUSimulator(BaseSimulator):
         elif func == "110000":  # f(x,y) = y
             return _norm_zr_ng(y)
         elif func == "001101":  # f(x,y) = !x
-            return _norm_zr_ng(
-                self.bin_str_to_int(
-                    self.bitwise_not(self.int_to_bin_str(x, self.WIDTH))
-                )
-            )
+            return _norm_zr_ng(self.int_not(x))
         elif func == "110001":  # f(x,y) = !y
-            return _norm_zr_ng(
-                self.bin_str_to_int(
-                    self.bitwise_not(self.int_to_bin_str(y, self.WIDTH))
-                )
-            )
+            return _norm_zr_ng(self.int_not(y))
         elif func == "001111":  # f(x,y) = -x
             return _norm_zr_ng(-x)
         elif func == "110011":  # f(x,y) = -y
@@ -87,23 +86,9 @@ class ALUSimulator(BaseSimulator):
         elif func == "000111":  # f(x,y) = y-x
             return _norm_zr_ng(y - x)
         elif func == "000000":  # f(x,y) = x&y
-            return _norm_zr_ng(
-                self.bin_str_to_int(
-                    self.bitwise_and(
-                        self.int_to_bin_str(x, self.WIDTH),
-                        self.int_to_bin_str(y, self.WIDTH),
-                    )
-                )
-            )
+            return _norm_zr_ng(self.int_and(x, y))
         elif func == "010101":  # f(x,y) = x|y
-            return _norm_zr_ng(
-                self.bin_str_to_int(
-                    self.bitwise_or(
-                        self.int_to_bin_str(x, self.WIDTH),
-                        self.int_to_bin_str(y, self.WIDTH),
-                    )
-                )
-            )
+            return _norm_zr_ng(self.int_or(x, y))
         else:
             raise UnkownALUFunction(f"Unkown function: {func}")
 
@@ -121,3 +106,50 @@ class ALUSimulator(BaseSimulator):
         x_s = self.int_to_bin_str(x, self.WIDTH)
         y_s = self.int_to_bin_str(y, self.WIDTH)
         return x_s + "_" + y_s + "_" + func + "_" + out_zr_ng_s + "\n"
+
+    def simulate_batch(
+        self, x: np.ndarray, y: np.ndarray, func: str
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        vectorized simulate_step for arrays of x and y, all with the same func
+        returns (out, zr, ng) as arrays of int16, bool and bool
+
+        Rather than one case per function, this follows the ALU's control bits (page 36), which
+        gives the same results for every function in funcs
+        """
+        if func not in self.funcs:
+            raise UnkownALUFunction(f"Unkown function: {func}")
+        zx, nx, zy, ny, f, no = (bit == "1" for bit in func)
+
+        # uint16 arithmetic wraps around just like the hardware
+        x = (np.asarray(x, dtype=np.int64) & 0xFFFF).astype(np.uint16)
+        y = (np.asarray(y, dtype=np.int64) & 0xFFFF).astype(np.uint16)
+        if zx:
+            x = np.zeros_like(x)
+        if nx:
+            x = ~x
+        if zy:
+            y = np.zeros_like(y)
+        if ny:
+            y = ~y
+        out = x + y if f else x & y
+        if no:
+            out = ~out
+
+        out = out.view(np.int16)
+        return (out, out == 0, out < 0)
+
+    def build_lines(self, x: np.ndarray, y: np.ndarray, func: str) -> str:
+        """
+        vectorized build_line, builds the lines for every x and y with func in one go
+        """
+        out, zr, ng = self.simulate_batch(x, y, func)
+        return self.join_columns(
+            self.bin_str_columns(x, self.WIDTH),
+            "_",
+            self.bin_str_columns(y, self.WIDTH),
+            "_" + func + "_",
+            self.bin_str_columns(out, self.WIDTH),
+            self.bin_str_columns(zr, 1),
+            self.bin_str_columns(ng, 1),
+        )
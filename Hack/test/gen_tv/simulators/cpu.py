@@ -1,14 +1,21 @@
-from simulators import BaseSimulator
+import numpy as np
+from simulators import IntBaseSimulator
 from simulators.alu import ALUSimulator
 from simulators.pc import PCSimulator
 from typing import Tuple, Optional
 
 
-class CPUSimulator(BaseSimulator):
+class CPUSimulator(IntBaseSimulator):
     """
     class to simulate the CPU
     """
 
+    LAYOUT = [
+        ("inM", 16), ("instruction", 16), ("reset", 1), "_",
+        ("outM", 16), ("writeM", 1), ("addressM", 16), ("pc", 16), "_",
+        ("alu_out", 16), ("A", 16), ("D", 16),
+    ]
+
     def _i(self, i: int) -> int:
         """
         Converts index from instruction variable in CPU.v to index for instruction variable
@@ -90,12 +97,65 @@ class CPUSimulator(BaseSimulator):
 
         # Lastly calculate the outputs
         outM: int = alu_out
-        writeM: bool = d3 is "1"
+        writeM: bool = d3 == "1"
         addressM: int = self._A
         pc: int = self._pc
 
         return (outM, writeM, addressM, self._pc, alu_out, self._A, self._D)
 
+    def simulate_batch(
+        self,
+        inM: np.ndarray,
+        instruction: np.ndarray,
+        reset: np.ndarray,
+        A: np.ndarray,
+        D: np.ndarray,
+        pc: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        vectorized simulate_step for N independent steps, step i starting from the registers A[i],
+        D[i] and pc[i] rather than the simulator's own state, i.e. the registers after the step
+        before it in a testvector file
+        instructions are integers here, values are taken as 16-bit patterns
+        returns (outM, writeM, addressM, pc, alu_out, A, D) after each step as arrays of unsigned
+        16-bit values (writeM bool)
+        """
+        inM, instruction, A, D, pc = (
+            np.asarray(v, dtype=np.int64) & 0xFFFF for v in (inM, instruction, A, D, pc)
+        )
+        reset = np.asarray(reset, dtype=bool)
+        is_C_instruction = (instruction >> 15) == 1
+
+        # ALU logic, one batch per function
+        A_or_inM = np.where((instruction >> 12) & 1 == 1, inM, A)
+        c = (instruction >> 6) & 0b111111
+        alu_out = np.zeros_like(instruction)
+        for func in np.unique(c):
+            rows = c == func
+            out, _, _ = self._ALU.simulate_batch(D[rows], A_or_inM[rows], format(func, "06b"))
+            alu_out[rows] = out.astype(np.int64) & 0xFFFF
+        alu_zr = alu_out == 0
+        alu_ng = alu_out >= 0x8000
+
+        # dest and jump bits are all zero for A instructions
+        d = np.where(is_C_instruction, (instruction >> 3) & 0b111, 0)
+        j = np.where(is_C_instruction, instruction & 0b111, 0)
+        jump = (
+            ((j & 0b100 != 0) & alu_ng)
+            | ((j & 0b010 != 0) & alu_zr)
+            | ((j & 0b001 != 0) & ~alu_ng & ~alu_zr)
+        )
+
+        pc = np.where(reset, 0, np.where(jump, A, pc + 1)) & 0xFFFF
+        A = np.where(d & 0b100 != 0, alu_out, A)
+        D = np.where(d & 0b010 != 0, alu_out, D)
+        A = np.where(is_C_instruction, A, instruction)
+        A = np.where(reset, 0, A)
+        D = np.where(reset, 0, D)
+        writeM = d & 0b001 != 0
+
+        return (alu_out, writeM, A, pc, alu_out, A, D)
+
     def build_line(self, inM: int, instruction: str, reset: bool) -> str:
         """
         format {inM[WIDTH], instruction[WIDTH], reset}_{outM[WIDTH], writeM, addressM[WIDTH], pc[WIDTH]_{alu_out[WIDTH], A[WIDTH], D[WIDTH]}}
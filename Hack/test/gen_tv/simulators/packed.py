@@ -0,0 +1,210 @@
+"""
+Bit-packed binary testvector files (*.tvb)
+
+A text testvector file spends a byte on every bit, plus the "_" separators and newlines. A packed
+file stores each vector as a fixed size record of bits instead, behind a header describing the
+fields, so that it can be converted back to exactly the same text for $readmemb.
+
+Format:
+- MAGIC
+- the length of the JSON header as a little endian uint32
+- the JSON header: {"layout": [...], "record_bytes": n, "has_x": bool}
+  layout is the simulator's LAYOUT: [name, width] for each field and "_" for each separator, in
+  the order of the text file (which is also the order of the concatenation the testbench unpacks,
+  i.e. {x, y, zx, nx, ...})
+- the records, each one the field bits MSB first, padded with zeros to record_bytes. If has_x, each
+  record is followed by another record_bytes marking the bits that are unknown ("x" in the text
+  file)
+"""
+import json
+import struct
+import numpy as np
+from typing import Dict, Iterable, List, Tuple, Union
+
+MAGIC = b"HACKTVB1"
+FLUSH_LINES = 1 << 16  # lines buffered by PackedTVWriter before packing them
+
+Layout = List[Union[str, Tuple[str, int]]]
+
+
+def layout_bits(layout: Layout) -> int:
+    return sum(field[1] for field in layout if field != "_")
+
+
+def bit_columns(layout: Layout) -> np.ndarray:
+    """
+    the columns of a text line that hold bits, i.e. everything but separators (and the newline)
+    """
+    columns = []
+    column = 0
+    for field in layout:
+        if field == "_":
+            column += 1
+        else:
+            columns.extend(range(column, column + field[1]))
+            column += field[1]
+    return np.array(columns)
+
+
+def line_length(layout: Layout) -> int:
+    """
+    length of a text line, including the newline
+    """
+    return layout_bits(layout) + layout.count("_") + 1
+
+
+def bits_to_fields(bits: np.ndarray, layout: Layout) -> Dict[str, np.ndarray]:
+    """
+    splits an (n, bits) array of lines into {name: array of unsigned field values}
+    """
+    values = {}
+    column = 0
+    for field in layout:
+        if field == "_":
+            continue
+        name, width = field
+        weights = 1 << np.arange(width - 1, -1, -1, dtype=np.int64)
+        values[name] = bits[:, column:column + width].astype(np.int64) @ weights
+        column += width
+    return values
+
+
+class PackedTVWriter(object):
+    """
+    file like object that takes the lines build_line (or build_lines) returns and writes them
+    packed, i.e.
+        with PackedTVWriter("tvs/ALU.tvb", ALUSimulator.LAYOUT) as f:
+            f.write(alusim.build_line(x, y, func))
+    """
+
+    def __init__(self, filename: str, layout: Layout, has_x: bool = False):
+        self.layout = [field if field == "_" else list(field) for field in layout]
+        self.has_x = has_x
+        self.bits = layout_bits(layout)
+        self.record_bytes = (self.bits + 7) // 8
+        self.line_length = line_length(layout)
+        self.columns = bit_columns(layout)
+        self.pending: List[str] = []
+        self.pending_lines = 0
+        self.file = open(filename, "wb")
+        header = json.dumps(
+            {"layout": self.layout, "record_bytes": self.record_bytes, "has_x": has_x}
+        ).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def write(self, lines: str):
+        self.pending.append(lines)
+        self.pending_lines += lines.count("\n")
+        if self.pending_lines >= FLUSH_LINES:
+            self.flush()
+
+    def writelines(self, lines: Iterable[str]):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        text = np.frombuffer("".join(self.pending).encode(), dtype=np.uint8)
+        self.pending = []
+        self.pending_lines = 0
+        if len(text) % self.line_length:
+            raise ValueError("lines don't match the layout")
+        chars = text.reshape(-1, self.line_length)[:, self.columns]
+        records = np.packbits(chars == ord("1"), axis=1)
+        if self.has_x:
+            records = np.hstack([records, np.packbits(chars == ord("x"), axis=1)])
+        elif (chars == ord("x")).any():
+            raise ValueError("unknown (x) bits in a file opened without has_x")
+        self.file.write(records.tobytes())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PackedTV(object):
+    """
+    memory mapped reader for packed testvector files
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename} is not a packed testvector file")
+            (header_length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+        self.layout: Layout = [
+            field if field == "_" else tuple(field) for field in header["layout"]
+        ]
+        self.has_x: bool = header["has_x"]
+        self.bits = layout_bits(self.layout)
+        record_bytes = header["record_bytes"] * (2 if self.has_x else 1)
+        self.records = np.memmap(
+            filename, dtype=np.uint8, mode="r", offset=len(MAGIC) + 4 + header_length
+        ).reshape(-1, record_bytes)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def bits_of(self, start: int = 0, stop: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        unpacks records[start:stop] into (bits, x) arrays of shape (n, bits), x is all zeros
+        unless has_x
+        """
+        records = np.asarray(self.records[start:stop])
+        record_bytes = records.shape[1] // (2 if self.has_x else 1)
+        bits = np.unpackbits(records[:, :record_bytes], axis=1)[:, : self.bits]
+        if self.has_x:
+            x = np.unpackbits(records[:, record_bytes:], axis=1)[:, : self.bits]
+        else:
+            x = np.zeros_like(bits)
+        return bits, x
+
+    def fields(self, start: int = 0, stop: int = None) -> Dict[str, np.ndarray]:
+        """
+        decodes records[start:stop] into {name: array of unsigned field values}
+        """
+        return bits_to_fields(self.bits_of(start, stop)[0], self.layout)
+
+    def fields_unknown(self, start: int = 0, stop: int = None) -> Dict[str, np.ndarray]:
+        """
+        like fields, but with the bits that are unknown (x) set instead
+        """
+        return bits_to_fields(self.bits_of(start, stop)[1], self.layout)
+
+    def to_text(self, start: int = 0, stop: int = None) -> str:
+        """
+        the text ($readmemb) lines for records[start:stop], exactly as build_line wrote them
+        """
+        bits, x = self.bits_of(start, stop)
+        chars = np.where(x == 1, ord("x"), bits + ord("0")).astype(np.uint8)
+        lines = np.full((len(chars), line_length(self.layout)), ord("_"), dtype=np.uint8)
+        lines[:, -1] = ord("\n")
+        lines[:, bit_columns(self.layout)] = chars
+        return lines.tobytes().decode()
+
+
+class TextTV(PackedTV):
+    """
+    memory mapped reader for text testvector files, with the same interface as PackedTV
+    (the lines of a file all have the same length, so it maps to a 2d array of characters)
+    """
+
+    def __init__(self, filename: str, layout: Layout):
+        self.layout = layout
+        self.has_x = True
+        self.bits = layout_bits(layout)
+        self.columns = bit_columns(layout)
+        self.records = np.memmap(filename, dtype=np.uint8, mode="r")
+        if len(self.records) % line_length(layout):
+            raise ValueError(f"the lines of {filename} don't match the layout")
+        self.records = self.records.reshape(-1, line_length(layout))
+
+    def bits_of(self, start: int = 0, stop: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        chars = self.records[start:stop, self.columns]
+        return (chars == ord("1")).astype(np.uint8), (chars == ord("x")).astype(np.uint8)
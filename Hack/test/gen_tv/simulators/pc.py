@@ -1,11 +1,13 @@
-from simulators import BaseSimulator
+from simulators import IntBaseSimulator
 
 
-class PCSimulator(BaseSimulator):
+class PCSimulator(IntBaseSimulator):
     """
     class for simulation program counter (PC)
     """
 
+    LAYOUT = [("in", 16), "_", ("reset", 1), "_", ("load", 1), "_", ("inc", 1), "_", ("out", 16)]
+
     def __init__(self):
         self.out = None  # int
 
@@ -1,11 +1,14 @@
-from simulators import BaseSimulator
+from simulators import IntBaseSimulator
 
 
-class RAMSimulator(BaseSimulator):
+class RAMSimulator(IntBaseSimulator):
     """
     class for simulating RAM
     """
 
+    LAYOUT = [("address", 16), "_", ("in", 16), "_", ("load", 1), "_", ("out", 16)]
+    HAS_X = True  # reads of addresses that were never loaded
+
     def __init__(self):
         self.mem = {}  # dict(int, int) => {address: value}
 
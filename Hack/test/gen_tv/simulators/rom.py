@@ -1,12 +1,16 @@
-from simulators import BaseSimulator
+from simulators import IntBaseSimulator
 from simulators.ram import RAMSimulator
 
 
-class ROMSimulator(BaseSimulator):
+class ROMSimulator(IntBaseSimulator):
     """
     class for simulating ROM
     """
 
+    LAYOUT = [("address", 16), "_", ("out", 16)]
+    LOAD_LAYOUT = [("out", 16)]  # lines returned by load
+    HAS_X = True  # reads of addresses that were never loaded
+
     def __init__(self):
         self.mem = RAMSimulator()
 
@@ -1,5 +1,9 @@
+import io
 import os
-from typing import List, TextIO, Optional
+import json
+from multiprocessing import Pool
+from functools import lru_cache, wraps
+from typing import Dict, Iterator, List, TextIO, Optional, Sequence, Union, Tuple
 from enum import Enum
 
 
@@ -20,77 +24,342 @@ class CommandType(Enum):
 CT = CommandType
 VMFileName = str
 
+# The CommandType of each VM command, by its first token
+COMMAND_TYPES: Dict[str, CommandType] = {
+    'add': CT.ARITHMETIC,
+    'sub': CT.ARITHMETIC,
+    'neg': CT.ARITHMETIC,
+    'eq': CT.ARITHMETIC,
+    'gt': CT.ARITHMETIC,
+    'lt': CT.ARITHMETIC,
+    'and': CT.ARITHMETIC,
+    'or': CT.ARITHMETIC,
+    'not': CT.ARITHMETIC,
+    'push': CT.PUSH,
+    'pop': CT.POP,
+    'label': CT.LABEL,
+    'goto': CT.GOTO,
+    'if-goto': CT.IF_GOTO,
+    'function': CT.FUNCTION,
+    'return': CT.RETURN,
+    'call': CT.CALL,
+}
+
+
+class Command:
+    '''
+    A single VM command,
+    i.e. `push local 2` on line 12 is Command(CT.PUSH, ['push', 'local', '2'], 12)
+    '''
+    __slots__ = ('command_type', 'tokens', 'line_number')
+
+    def __init__(self, command_type: CommandType, tokens: List[str], line_number: int):
+        self.command_type = command_type
+        self.tokens = tokens
+        self.line_number = line_number
+
 
 class Parser:
     '''
-    Parses *.vm files. 
-    
-    Supports full line comments, doesn't support inline comments i.e. `push argument 0 // this will break the parser`.
+    Parses *.vm files.
+
+    Reads the whole file in one go and strips comments, both full line and inline comments i.e.
+    `push argument 0 // like this one`.
 
-    Doesn't support error checking: we'll assume VMFileName contains only valid VM code.
+    Doesn't support error checking beyond unknown commands: we'll assume VMFileName contains only
+    valid VM code.
     '''
 
     def __init__(self, filename: VMFileName):
         self.filename = filename
-        self.lines: TextIO = open(self.filename, 'r')
-        self.cur_line: str = ''  # The current line being read, as a string
-        self.cur_line_split: List[str] = []  # cur_line tokenized into a list
-        self.cur_line_number = 0
-        self.command_type: Optional[
-            CommandType] = None  # The type of command cur_line is interpreted as
 
-    def advance(self) -> str:
+    def commands(self) -> Iterator[Command]:
         '''
-        Advances the parser on to the next line, and determines the command type of the line
-        Returns the line, which will be empty string ('') at the end of the file (useful for looping)
+        Yields the commands of the file in order. Line numbers count every line of the file,
+        comments and blank lines included, starting from 1.
         '''
+        with open(self.filename, 'r') as f:
+            lines = f.read().splitlines()
+        for line_number, line in enumerate(lines, 1):
+            tokens = line.split('//', 1)[0].split()
+            if not tokens:
+                continue
+            command_type = COMMAND_TYPES.get(tokens[0])
+            if command_type is None:
+                raise RuntimeError(
+                    f"Unkown command on line {line_number} of {self.filename}: {line.strip()}")
+            yield Command(command_type, tokens, line_number)
+
+
+# Symbols that address the stack pointer register itself
+SP_ALIASES = ('SP', 'R0', '0')
+
+# Prefixes the source marks CodeWriter collects along with the assembly code when it writes a source
+# map, i.e. `//@Main.vm\t12\tMain.main`. The peephole optimizer passes them through like any other
+# comment.
+SOURCE_MARK = '//@'
+
+
+def split_C_instr(line: str) -> Tuple[str, str, str]:
+    '''
+    Splits a C instruction like `AM=M-1;JMP` into (dest, comp, jump), missing parts are returned as
+    empty strings
+    '''
+    dest, _, rest = line.rpartition('=')
+    comp, _, jump = rest.partition(';')
+    return dest, comp, jump
+
+
+def is_instruction(line: Optional[str]) -> bool:
+    '''
+    Whether line is an A or C instruction, i.e. not a label, a comment, a blank line or a deleted
+    line (None)
+    '''
+    return bool(line) and line[0] != '(' and line[:2] != '//'
+
+
+def prev_instruction(lines: List[Optional[str]], k: int) -> int:
+    '''
+    Returns the index of the closest instruction before lines[k], or -1 if there is none
+    '''
+    k -= 1
+    while k >= 0 and not is_instruction(lines[k]):
+        k -= 1
+    return k
+
+
+def cancel_SP_pairs(lines: List[str]) -> List[str]:
+    '''
+    Removes `@SP M=M+1 ... @SP M=M-1` round trips, i.e. the SP++ at the end of a push and the SP--
+    at the start of the pop (or arithmetic command, or if-goto) that consumes it. The `@SP` in front
+    of the `M=M-1` is kept because SP_mm usually follows up with `A=M`.
+
+    The instructions in between must not touch SP: no labels or jumps, no `@SP`, and M is only
+    accessed through a register we know isn't SP. Nor may they read A before loading it, since
+    without the `@SP` of the SP++ it no longer holds SP.
+    '''
+    lines: List[Optional[str]] = list(lines)
+    for j in range(len(lines)):
+        if lines[j] != 'M=M-1':
+            continue
+        at_SP_mm = prev_instruction(lines, j)
+        if at_SP_mm < 0 or lines[at_SP_mm] != '@SP':
+            continue
+
+        # Walk back to the closest SP++
+        i = at_SP_mm - 1
+        while i >= 0 and lines[i] != 'M=M+1' and (lines[i] or ' ')[0] != '(' and \
+                (lines[i] or ' ')[1:] not in SP_ALIASES:
+            i -= 1
+        if i < 0 or lines[i] != 'M=M+1':
+            continue
+        at_SP_pp = prev_instruction(lines, i)
+        if at_SP_pp < 0 or lines[at_SP_pp] != '@SP':
+            continue
+
+        # Check that nothing in between depends on SP, starting with A still pointing at SP
+        A_is_loaded = False  # Whether A was set since the SP++, rather than left over from it
+        A_is_safe = False
+        for line in lines[i + 1:at_SP_mm]:
+            if not is_instruction(line):
+                continue
+            if line[0] == '@':
+                A_is_loaded = True
+                A_is_safe = line[1:] not in SP_ALIASES
+                continue
+            dest, comp, jump = split_C_instr(line)
+            touches_M = 'M' in dest or 'M' in comp
+            if jump or (touches_M and not A_is_safe) or ('A' in comp and not A_is_loaded):
+                break
+            if 'A' in dest:
+                A_is_loaded = True
+                A_is_safe = False
+        else:
+            lines[at_SP_pp] = lines[i] = lines[j] = None
+    return [line for line in lines if line is not None]
+
+
+def drop_redundant_loads(lines: List[str]) -> List[str]:
+    '''
+    Tracks what is known about the A and D registers through straight line code and drops
+    instructions that wouldn't change anything:
+        - `@X` when A already holds X, or when the next instruction overwrites A without using it
+        - `@SP A=M` when A already holds the address SP points to
+        - `D=M` when D already holds M
+
+    A is either ('sym', X) after `@X` or ('deref', X) after `@X A=M`, D is ('mem', A) when it's a
+    copy of RAM[A]. Labels are jump targets, so everything is forgotten at a label.
+    '''
+    out: List[str] = []
+    A: Optional[Tuple[str, str]] = None
+    D: Optional[Tuple[str, Tuple[str, str]]] = None
+    instructions = [k for k, line in enumerate(lines) if is_instruction(line)]
+    next_instruction = {k: lines[n] for k, n in zip(instructions, instructions[1:])}
+    skip_next = False
+    for k, line in enumerate(lines):
+        if not is_instruction(line):
+            if line[:1] == '(':
+                A = D = None
+            out.append(line)
+            continue
+        if skip_next:
+            skip_next = False
+            continue
+
+        if line[0] == '@':
+            symbol = line[1:]
+            following = next_instruction.get(k, '')
+            if A == ('sym', symbol) or following[:1] == '@':
+                continue
+            if symbol == 'SP' and A == ('deref', 'SP') and following == 'A=M':
+                skip_next = True
+                continue
+            A = ('sym', symbol)
+            out.append(line)
+            continue
+
+        dest, comp, jump = split_C_instr(line)
+        if dest == 'D' and comp == 'M' and not jump and A is not None and D == ('mem', A):
+            continue
+        out.append(line)
+        new_A = A
+        if 'A' in dest:
+            new_A = ('deref', A[1]) if dest == 'A' and comp == 'M' and A and A[0] == 'sym' else None
+        if 'M' in dest:
+            # Assumes nothing writes SP through a pointer, i.e. stack addresses never alias SP
+            D = ('mem', A) if dest == 'M' and comp == 'D' and A is not None else None
+        elif 'D' in dest:
+            D = ('mem', A) if comp == 'M' and A is not None else None
+        A = new_A
+    return out
+
+
+def peephole(lines: List[str]) -> List[str]:
+    '''
+    Peephole optimizes the assembly code written by CodeWriter (one instruction, label, comment or
+    blank line per list entry, without newlines), repeating the passes until nothing changes
+    '''
+    while True:
+        optimized = drop_redundant_loads(cancel_SP_pairs(lines))
+        if optimized == lines:
+            return optimized
+        lines = optimized
+
+
+class AInstruction(str):
+    '''
+    `@symbol`
+
+    The assembly records CodeWriter collects are typed strings: they serialize (and compare) as the
+    line of assembly code they stand for, with their parts available as properties.
+    '''
+    __slots__ = ()
+
+    @property
+    def symbol(self) -> str:
+        return self[1:]
+
+
+class CInstruction(str):
+    '''
+    `dest=comp;jump`, dest and jump are empty strings when left out
+    '''
+    __slots__ = ()
+
+    @property
+    def dest(self) -> str:
+        return split_C_instr(self)[0]
+
+    @property
+    def comp(self) -> str:
+        return split_C_instr(self)[1]
+
+    @property
+    def jump(self) -> str:
+        return split_C_instr(self)[2]
+
+
+class Label(str):
+    '''
+    `(name)`
+    '''
+    __slots__ = ()
+
+    @property
+    def name(self) -> str:
+        return self[1:-1]
 
-        def set_command_type():
-            '''
-            Called after reading a new line in order to set the command type
-            '''
-            if self.cur_line[:2] == '//' or self.cur_line == '\n':
-                self.command_type = CT.SKIP
-                return
 
-            self.cur_line = self.cur_line.strip('\n')
-            # Split the line into tokens for future processing
-            self.cur_line_split = self.cur_line.split()
-
-            if (self.cur_line_split[0] == 'add' or self.cur_line_split[0] == 'sub' or
-                    self.cur_line_split[0] == 'neg' or self.cur_line_split[0] == 'eq' or
-                    self.cur_line_split[0] == 'gt' or self.cur_line_split[0] == 'lt' or
-                    self.cur_line_split[0] == 'and' or self.cur_line_split[0] == 'or' or
-                    self.cur_line_split[0] == 'not'):
-                self.command_type = CT.ARITHMETIC
-            elif (self.cur_line_split[0] == 'push'):
-                self.command_type = CT.PUSH
-            elif (self.cur_line_split[0] == 'pop'):
-                self.command_type = CT.POP
-            elif (self.cur_line_split[0] == 'label'):
-                self.command_type = CT.LABEL
-            elif (self.cur_line_split[0] == 'if-goto'):
-                self.command_type = CT.IF_GOTO
-            elif (self.cur_line_split[0] == 'goto'):
-                self.command_type = CT.GOTO
-            elif (self.cur_line_split[0] == 'function'):
-                self.command_type = CT.FUNCTION
-            elif (self.cur_line_split[0] == 'return'):
-                self.command_type = CT.RETURN
-            elif (self.cur_line_split[0] == 'call'):
-                self.command_type = CT.CALL
-
-        # Read the next line and strip leading/trailing spaces
-        self.cur_line = self.lines.readline().strip(' ')
-        self.cur_line_number += 1
-
-        # If EOF, return EOF
-        if self.cur_line == '':
-            return self.cur_line
-
-        set_command_type()
-
-        return self.cur_line
+class Comment(str):
+    '''
+    `// text`
+    '''
+    __slots__ = ()
+
+    @property
+    def text(self) -> str:
+        return self[3:]
+
+
+class Blank(str):
+    '''
+    An empty line, separating the code of one VM command from the next
+    '''
+    __slots__ = ()
+
+
+BLANK = Blank()
+# One line of assembly code, as written by CodeWriter
+AsmRecord = Union[AInstruction, CInstruction, Label, Comment, Blank]
+
+
+@lru_cache(maxsize=None)
+def A_instr(symbol: str) -> AInstruction:
+    '''
+    The AInstruction for symbol. Most of them are the likes of `@SP`, so they are created once and
+    shared.
+    '''
+    return AInstruction(f"@{symbol}")
+
+
+@lru_cache(maxsize=None)
+def C_instr(line: str) -> CInstruction:
+    '''
+    The CInstruction for a line like `AM=M-1`. There are only so many distinct C instructions, so
+    they are created once and shared.
+    '''
+    return CInstruction(line)
+
+
+# The snippets CodeWriter writes the most, ready made
+SP_PP = [A_instr("SP"), C_instr("M=M+1")]
+SP_MM = [A_instr("SP"), C_instr("M=M-1")]
+LOAD_SP_INTO_A = [A_instr("SP"), C_instr("A=M")]
+LOAD_SP_INTO_D = [A_instr("SP"), C_instr("D=M")]
+
+
+def reuse_translation(write_command):
+    '''
+    Decorates the CodeWriter methods for VM commands that translate to the same records every time
+    they appear in a file, i.e. push, pop and arithmetic (except for eq/gt/lt, which number their
+    labels), so that each distinct command is only translated once
+    '''
+
+    @wraps(write_command)
+    def write(self, command: Command):
+        if command.tokens[0] in ('eq', 'gt', 'lt'):
+            write_command(self, command)
+            return
+        key = (self.cur_parser_filename, tuple(command.tokens))
+        code = self.translations.get(key)
+        if code is None:
+            start = len(self.instructions)
+            write_command(self, command)
+            self.translations[key] = self.instructions[start:]
+        else:
+            self.instructions += code
+
+    return write
 
 
 class CodeWriter:
@@ -107,22 +376,168 @@ class CodeWriter:
     # constant, should never change
     TEMP = 5
 
-    def __init__(self, output_filename: str):
-        self.output_file = open(output_filename, 'w')
+    def __init__(self,
+                 output: Union[str, TextIO],
+                 optimize: bool = False,
+                 shared_compare: bool = False,
+                 shared_call: bool = False,
+                 comments: bool = True,
+                 source_map: Optional[Union[str, TextIO]] = None):
+        '''
+        The assembly code is collected as a list of AsmRecords in self.instructions, and only
+        written to output, in one go, on close()
+
+        output: either the filename of the .asm file to write, or any already open text sink
+                (i.e. an io.StringIO)
+        optimize: run the assembly code through `peephole` before writing it to output
+        shared_compare: translate eq/gt/lt into calls to one shared routine per operator instead
+                        of inlining them
+        shared_call: translate call and return into jumps to the shared routines `$$call` and
+                     `$$return`
+        comments: write the `// push constant 7` style comments and the blank lines between VM
+                  commands
+        source_map: the filename (or text sink) to write the source map to, see write_source_map
+        '''
+        self.owns_output_file = isinstance(output, str)  # Only close what we opened ourselves
+        self.source_map = source_map
+        # Whether to collect source marks, see mark_source
+        self.mark_sources = source_map is not None
+        self.optimize = optimize
+        self.shared_compare = shared_compare
+        self.shared_call = shared_call
+        self.comments = comments
+        self.sink: TextIO = open(output, 'w') if isinstance(output, str) else output
+        self.instructions: List[AsmRecord] = []
+        # See reuse_translation
+        self.translations: Dict[Tuple[str, Tuple[str, ...]], List[AsmRecord]] = {}
         self.cur_parser_filename = ''  # Gets updated per parser, used for naming static variables
+        # Gets updated per parser, prefixes the labels of `eq`, `gt` and `lt` operations
+        self.label_namespace = ''
         self.cur_func_name = ''  # Gets updated per function declaration, used for naming labels within functions
-        self.eq_num = 0  # Used as an identifier in `eq` operations
-        self.gt_num = 0  # Used as an identifier in `gt` operations
-        self.lt_num = 0  # Used as an identifier in `lt` operations
+        self.eq_num = 0  # Used as an identifier in `eq` operations, counts per file
+        self.gt_num = 0  # Used as an identifier in `gt` operations, counts per file
+        self.lt_num = 0  # Used as an identifier in `lt` operations, counts per file
+        # The shared routines called so far, in order of first use
+        self.used_routines: List[str] = []
 
         # Initialization assembly code
-        self.output_file.write(f"// init\n")
+        self.mark_source('', 0, '')
+        self.emit_comment("init")
         # Initialize the stack pointer to address 256
         self.set_reg("SP", 256)
         # Call Sys.init
-        self.output_file.write(f"@Sys.init\n")
-        self.output_file.write(f"0;JMP\n")
-        self.output_file.write(f"\n")
+        self.emit_A("Sys.init")
+        self.emit_C("0;JMP")
+        self.emit_blank()
+        # Shared routines go right after the jump to Sys.init, where nothing falls through into them
+        self.routines_offset = len(self.instructions)
+
+    def close(self, linked: Sequence[Tuple[str, List[str]]] = ()):
+        '''
+        Called once all the parsers are done. Inserts the shared routines that were used and writes
+        the (peephole optimized if optimizing) code to output. Closes the output file if the
+        CodeWriter opened it.
+
+        linked: the translated_code() of files translated by other CodeWriters, appended in order
+        '''
+        for _, used_routines in linked:
+            for routine in used_routines:
+                self.use_routine(routine)
+        body = self.instructions[self.routines_offset:]
+        del self.instructions[self.routines_offset:]
+        for routine in self.used_routines:
+            self.mark_source('', 0, f"$${routine}")
+            if routine == 'call':
+                self.write_call_routine()
+            elif routine == 'return':
+                self.write_return_routine()
+            else:
+                self.write_compare_routine(routine)
+        self.instructions.extend(body)
+        # peephole works on plain strings, which compare faster than the records
+        lines = peephole(list(map(str, self.instructions))) if self.optimize else self.instructions
+        if self.source_map is None:
+            self.sink.write('\n'.join(lines) + '\n')
+            for code, _ in linked:
+                self.sink.write(code)
+        else:
+            # The linked code has source marks of its own, which need to be stripped out too
+            lines = [*lines, *(line for code, _ in linked for line in code.splitlines())]
+            self.sink.write('\n'.join(self.write_source_map(lines)) + '\n')
+        if self.owns_output_file:
+            self.sink.close()
+
+    def write_source_map(self, lines: List[str]) -> List[str]:
+        '''
+        Strips the source marks out of lines and writes them to self.source_map as JSON lines, one
+        per VM command (and one for the init code and each shared routine):
+            [ROM address of the first instruction, .vm file, line number, function]
+        A command's code runs up to the next command's address. Commands that don't translate into
+        any instructions (i.e. labels) share their address with the next one. The init code and the
+        shared routines have an empty file and line 0. Returns lines without the source marks.
+        '''
+        sink = open(self.source_map, 'w') if isinstance(self.source_map, str) else self.source_map
+        code: List[str] = []
+        address = 0
+        for line in lines:
+            if line[:len(SOURCE_MARK)] == SOURCE_MARK:
+                filename, line_number, function = line[len(SOURCE_MARK):].split('\t')
+                sink.write(json.dumps([address, filename, int(line_number), function]) + '\n')
+                continue
+            if is_instruction(line):
+                address += 1
+            code.append(line)
+        if sink is not self.source_map:
+            sink.close()
+        return code
+
+    def translated_code(self) -> Tuple[str, List[str]]:
+        '''
+        The code written since the init code (peephole optimized if optimizing), and the shared
+        routines it uses, for linking it into the output of another CodeWriter with close()
+        '''
+        body = list(map(str, self.instructions[self.routines_offset:]))
+        lines = peephole(body) if self.optimize else body
+        return '\n'.join(lines) + '\n', self.used_routines
+
+    def write_file(self, parser: Parser):
+        '''
+        Translates every command of the file parser parses. The labels the translation makes up only
+        depend on the file, so files can be translated by separate CodeWriters (see translate_file)
+        and linked together.
+        '''
+        # Update cur_parser_filename so the static vars are named after the file (book section 7.3)
+        self.cur_parser_filename = parser.filename
+        self.label_namespace = f"{self.file_stem()}$"
+        self.cur_func_name = ''
+        self.eq_num = self.gt_num = self.lt_num = 0
+
+        # codewriter function for each type of command
+        writers = {
+            CT.ARITHMETIC: self.write_arithmetic,
+            CT.PUSH: self.write_push,
+            CT.POP: self.write_pop,
+            CT.LABEL: self.write_label,
+            CT.IF_GOTO: self.write_if_goto,
+            CT.GOTO: self.write_goto,
+            CT.FUNCTION: self.write_function,
+            CT.RETURN: self.write_return,
+            CT.CALL: self.write_call,
+        }
+        stem = self.file_stem()
+        for command in parser.commands():
+            if self.mark_sources:
+                # A function command already belongs to the function it declares
+                is_function = command.command_type == CT.FUNCTION
+                function = command.tokens[1] if is_function else self.cur_func_name
+                self.mark_source(f"{stem}.vm", command.line_number, function)
+            writers[command.command_type](command)
+
+    def file_stem(self) -> str:
+        '''
+        The name of the file being translated, without its directory and extension
+        '''
+        return self.cur_parser_filename.split('/')[-1].split('.')[0]
 
     def static_symbol(self, suffix: str) -> str:
         '''
@@ -133,7 +548,7 @@ class CodeWriter:
         Xxx.vm contains the command push static 3. This command can be translated to the Hack assembly commands @Xxx.3 and D=M, followed 
         by additional assembly code that pushes D’s value to the stack. This implementation of the static segment is somewhat tricky, but it works."
         '''
-        return self.cur_parser_filename.split('/')[-1].split('.')[0] + f".{suffix}"
+        return self.file_stem() + f".{suffix}"
 
     def prefix_w_cur_func_name(self, label: str) -> str:
         '''
@@ -155,35 +570,58 @@ class CodeWriter:
         # 'ra' short for "return address"
         return f"ra_{cur_func_name}_{cur_line_number}"
 
-    def set_reg(self, symbol: str, value: int):
+    def mark_source(self, filename: str, line_number: int, function: str):
+        '''
+        Marks where the code of the VM command at line_number of filename starts, if writing a
+        source map
+        '''
+        if self.mark_sources:
+            self.instructions.append(Comment(f"{SOURCE_MARK}{filename}\t{line_number}\t{function}"))
+
+    def emit_A(self, symbol: Union[int, str]):
+        self.instructions.append(A_instr(str(symbol)))
+
+    def emit_C(self, line: str):
+        self.instructions.append(C_instr(line))
+
+    def emit_label(self, name: str):
+        self.instructions.append(Label(f"({name})"))
+
+    def emit_comment(self, text: str):
+        if self.comments:
+            self.instructions.append(Comment(f"// {text}"))
+
+    def emit_blank(self):
+        if self.comments:
+            self.instructions.append(BLANK)
+
+    def set_reg(self, symbol: str, value: Union[int, str]):
         '''
         Sets the register symbol to value
         i.e. if you want to set the stack pointer to 256, call `set_reg("SP", 256)
         '''
-        self.output_file.write(f"@{value}\n")
-        self.output_file.write(f"D=A\n")
-        self.output_file.write(f"@{symbol}\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A(value)
+        self.emit_C("D=A")
+        self.emit_A(symbol)
+        self.emit_C("M=D")
 
     def SP_pp(self, load_SP_into_A):
         '''
         SP++
         If load_SP_into_A, loads the value of SP into the A register upon completion
         '''
-        self.output_file.write(f"@SP\n")
-        self.output_file.write(f"M=M+1\n")
+        self.instructions += SP_PP
         if load_SP_into_A:
-            self.output_file.write(f"A=M\n")
+            self.emit_C("A=M")
 
     def SP_mm(self, load_SP_into_A):
         '''
         SP--
         If load_SP_into_A, loads the value of SP into the A register upon completion
         '''
-        self.output_file.write(f"@SP\n")
-        self.output_file.write(f"M=M-1\n")
+        self.instructions += SP_MM
         if load_SP_into_A:
-            self.output_file.write(f"A=M\n")
+            self.emit_C("A=M")
 
     def push_value(self, symbol: str, offset: int):
         '''
@@ -196,20 +634,20 @@ class CodeWriter:
         then push the value pointed to by that pointer onto the stack
         '''
         # Build the pointer in the A register
-        self.output_file.write(f"@{symbol}\n")
+        self.emit_A(symbol)
         if offset > 0:
-            self.output_file.write(f"D=M\n")
-            self.output_file.write(f"@{offset}\n")
-            self.output_file.write(f"A=D+A\n")
+            self.emit_C("D=M")
+            self.emit_A(offset)
+            self.emit_C("A=D+A")
         else:
-            self.output_file.write(f"A=M\n")
+            self.emit_C("A=M")
 
         # Grab the value being pointed to and store it in the D register
-        self.output_file.write(f"D=M\n")
+        self.emit_C("D=M")
 
         # Push that onto the stack
         self.load_SP_into_A()
-        self.output_file.write(f"M=D\n")
+        self.emit_C("M=D")
 
         # Increment the stack pointer
         self.SP_pp(load_SP_into_A=False)
@@ -222,12 +660,12 @@ class CodeWriter:
         In this example, we will find the pointer stored in the THIS register and push it onto the stack
         '''
         # Grab the pointer referenced by symbol and store it in the D register
-        self.output_file.write(f"@{symbol}\n")
-        self.output_file.write(f"D=M\n")
+        self.emit_A(symbol)
+        self.emit_C("D=M")
 
         # Push it onto the stack
         self.load_SP_into_A()
-        self.output_file.write(f"M=D\n")
+        self.emit_C("M=D")
 
         # Increment the stack pointer
         self.SP_pp(load_SP_into_A=False)
@@ -243,23 +681,23 @@ class CodeWriter:
         value off the top of the stack and store it in the pointer
         '''
         # Load pointer stored at address symbol, add offset, and save it in R13
-        self.output_file.write(f"@{symbol}\n")
-        self.output_file.write(f"D=M\n")
+        self.emit_A(symbol)
+        self.emit_C("D=M")
         if offset > 0:
-            self.output_file.write(f"@{offset}\n")
-            self.output_file.write(f"D=D+A\n")
-        self.output_file.write(f"@R13\n")
-        self.output_file.write(f"M=D\n")
+            self.emit_A(offset)
+            self.emit_C("D=D+A")
+        self.emit_A("R13")
+        self.emit_C("M=D")
 
         # Pop the top value off the stack and save it in D
         self.SP_mm(load_SP_into_A=True)
-        self.output_file.write(f"D=M\n")
+        self.emit_C("D=M")
 
         # Now grab the pointer from R13, and set the memory it points to
         # to the previously-top-of-the-stack value stored in D
-        self.output_file.write(f"@R13\n")
-        self.output_file.write(f"A=M\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A("R13")
+        self.emit_C("A=M")
+        self.emit_C("M=D")
 
     def pop_pointer(self, symbol: str):
         '''
@@ -269,34 +707,85 @@ class CodeWriter:
         '''
         # Load the value at the top of the stack into D
         self.SP_mm(load_SP_into_A=True)
-        self.output_file.write(f"D=M\n")
+        self.emit_C("D=M")
 
         # And move it into the register `symbol`
-        self.output_file.write(f"@{symbol}\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A(symbol)
+        self.emit_C("M=D")
 
     def load_SP_into_A(self):
         '''
         Loads the value of SP into the A register
         '''
-        self.output_file.write(f"@SP\n")
-        self.output_file.write(f"A=M\n")
+        self.instructions += LOAD_SP_INTO_A
 
     def load_SP_into_D(self):
         '''
         Loads the value of SP into the D register
         '''
-        self.output_file.write(f"@SP\n")
-        self.output_file.write(f"D=M\n")
+        self.instructions += LOAD_SP_INTO_D
 
     def goto_label(self, label: str):
         '''
         Loads address `label` into the A register and then jumps to that instruction
         '''
-        self.output_file.write(f"@{label}\n")
-        self.output_file.write(f"0;JMP\n")
+        self.emit_A(label)
+        self.emit_C("0;JMP")
 
-    def write_arithmetic(self, parser: Parser):
+    def use_routine(self, routine: str):
+        '''
+        Marks the shared routine `$$routine` as used, so that close() writes it
+        '''
+        if routine not in self.used_routines:
+            self.used_routines.append(routine)
+
+    def call_compare_routine(self, op: str, num: int):
+        '''
+        Calls the shared routine for the comparison op (one of eq, gt, lt), see
+        write_compare_routine. The return address goes in R15, num makes the return label unique.
+        '''
+        ret_label = f"{self.label_namespace}{op}{num}Ret"
+        self.use_routine(op)
+        self.emit_A(ret_label)
+        self.emit_C("D=A")
+        self.emit_A("R15")
+        self.emit_C("M=D")
+        self.goto_label(f"$${op}")
+        self.emit_label(ret_label)
+
+    def write_compare_routine(self, op: str):
+        '''
+        Writes the routine `$$op` shared by every `op` command (one of eq, gt, lt) when
+        self.shared_compare is set. Pops y and x and pushes -1 (True) if `x op y` else 0 (False),
+        exactly like the inlined version in write_arithmetic, then jumps back to the return address
+        stored in R15.
+        '''
+        jump = {'eq': 'JEQ', 'gt': 'JGT', 'lt': 'JLT'}[op]
+        self.emit_comment(f"shared {op}")
+        self.emit_label(f"$${op}")
+        # SP--, D = y
+        self.emit_A("SP")
+        self.emit_C("AM=M-1")
+        self.emit_C("D=M")
+        # D = x - y, and assume `x op y` is True until proven otherwise
+        self.emit_C("A=A-1")
+        self.emit_C("D=M-D")
+        self.emit_C("M=-1")
+        self.emit_A(f"$${op}True")
+        self.emit_C(f"D;{jump}")
+        # False case
+        self.emit_A("SP")
+        self.emit_C("A=M-1")
+        self.emit_C("M=0")
+        # Return
+        self.emit_label(f"$${op}True")
+        self.emit_A("R15")
+        self.emit_C("A=M")
+        self.emit_C("0;JMP")
+        self.emit_blank()
+
+    @reuse_translation
+    def write_arithmetic(self, command: Command):
         '''
         Say you have vm code like:
            push constant x
@@ -315,7 +804,7 @@ class CodeWriter:
         
         NOTE: Any time dest=M, the stack pointer should be incremented (self.SP += 1)
         '''
-        if parser.cur_line_split[0] == "add":
+        if command.tokens[0] == "add":
             # // add
             # // SP--
             # load_SP_into_A() // A = *y
@@ -324,13 +813,13 @@ class CodeWriter:
             # load_SP_into_A() // A = *x
             # M=D+M // RAM[*x] = y + x
             # // SP++
-            self.output_file.write(f"// add\n")
+            self.emit_comment("add")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=D+M\n")
+            self.emit_C("M=D+M")
             self.SP_pp(load_SP_into_A=False)
-        elif parser.cur_line_split[0] == "sub":
+        elif command.tokens[0] == "sub":
             # // sub
             # // SP--
             # load_SP_into_A() // A = *y
@@ -339,23 +828,23 @@ class CodeWriter:
             # load_SP_into_A() // A = *x
             # M=M-D // RAM[*x] = x - y
             # // SP++
-            self.output_file.write(f"// sub\n")
+            self.emit_comment("sub")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=M-D\n")
+            self.emit_C("M=M-D")
             self.SP_pp(load_SP_into_A=False)
-        elif parser.cur_line_split[0] == "neg":
+        elif command.tokens[0] == "neg":
             # // neg
             # // SP--
             # load_SP_into_A() // A = *y
             # M=-M // Negate y and replace it with it's negated value
             # // Increment stack pointer, now at 258
-            self.output_file.write(f"// neg\n")
+            self.emit_comment("neg")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=-M\n")
+            self.emit_C("M=-M")
             self.SP_pp(load_SP_into_A=False)
-        elif parser.cur_line_split[0] == "eq":
+        elif command.tokens[0] == "eq":
             # // eq
             # // SP--
             # load_SP_into_A() // A = *y
@@ -375,24 +864,29 @@ class CodeWriter:
             # M=-1 // RAM[*x] = -1 (True)
             # (eq0TrueEnd)
             # // SP++
-            self.output_file.write(f"// eq\n")
+            self.emit_comment("eq")
+            if self.shared_compare:
+                self.call_compare_routine("eq", self.eq_num)
+                self.eq_num += 1
+                self.emit_blank()
+                return
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M-D\n")
-            self.output_file.write(f"@eq{self.eq_num}True\n")
-            self.output_file.write(f"D;JEQ\n")
+            self.emit_C("D=M-D")
+            self.emit_A(f"{self.label_namespace}eq{self.eq_num}True")
+            self.emit_C("D;JEQ")
             self.load_SP_into_A()
-            self.output_file.write(f"M=0\n")
-            self.output_file.write(f"@eq{self.eq_num}TrueEnd\n")
-            self.output_file.write(f"0;JMP\n")
-            self.output_file.write(f"(eq{self.eq_num}True)\n")
+            self.emit_C("M=0")
+            self.emit_A(f"{self.label_namespace}eq{self.eq_num}TrueEnd")
+            self.emit_C("0;JMP")
+            self.emit_label(f"{self.label_namespace}eq{self.eq_num}True")
             self.load_SP_into_A()
-            self.output_file.write(f"M=-1\n")
-            self.output_file.write(f"(eq{self.eq_num}TrueEnd)\n")
+            self.emit_C("M=-1")
+            self.emit_label(f"{self.label_namespace}eq{self.eq_num}TrueEnd")
             self.SP_pp(load_SP_into_A=False)
             self.eq_num += 1
-        elif parser.cur_line_split[0] == "gt":
+        elif command.tokens[0] == "gt":
             # // gt
             # // SP--
             # load_SP_into_A() // A = *y
@@ -412,24 +906,29 @@ class CodeWriter:
             # M=-1 // RAM[*x] = -1 (True)
             # (gt0TrueEnd)
             # // SP++
-            self.output_file.write(f"// gt\n")
+            self.emit_comment("gt")
+            if self.shared_compare:
+                self.call_compare_routine("gt", self.gt_num)
+                self.gt_num += 1
+                self.emit_blank()
+                return
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M-D\n")
-            self.output_file.write(f"@gt{self.gt_num}True\n")
-            self.output_file.write(f"D;JGT\n")
+            self.emit_C("D=M-D")
+            self.emit_A(f"{self.label_namespace}gt{self.gt_num}True")
+            self.emit_C("D;JGT")
             self.load_SP_into_A()
-            self.output_file.write(f"M=0\n")
-            self.output_file.write(f"@gt{self.gt_num}TrueEnd\n")
-            self.output_file.write(f"0;JMP\n")
-            self.output_file.write(f"(gt{self.gt_num}True)\n")
+            self.emit_C("M=0")
+            self.emit_A(f"{self.label_namespace}gt{self.gt_num}TrueEnd")
+            self.emit_C("0;JMP")
+            self.emit_label(f"{self.label_namespace}gt{self.gt_num}True")
             self.load_SP_into_A()
-            self.output_file.write(f"M=-1\n")
-            self.output_file.write(f"(gt{self.gt_num}TrueEnd)\n")
+            self.emit_C("M=-1")
+            self.emit_label(f"{self.label_namespace}gt{self.gt_num}TrueEnd")
             self.SP_pp(load_SP_into_A=False)
             self.gt_num += 1
-        elif parser.cur_line_split[0] == "lt":
+        elif command.tokens[0] == "lt":
             # // lt
             # // SP--
             # load_SP_into_A() // A = *y
@@ -449,24 +948,29 @@ class CodeWriter:
             # M=-1 // RAM[*x] = -1 (True)
             # (lt0TrueEnd)
             # // SP++
-            self.output_file.write(f"// lt\n")
+            self.emit_comment("lt")
+            if self.shared_compare:
+                self.call_compare_routine("lt", self.lt_num)
+                self.lt_num += 1
+                self.emit_blank()
+                return
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M-D\n")
-            self.output_file.write(f"@lt{self.lt_num}True\n")
-            self.output_file.write(f"D;JLT\n")
+            self.emit_C("D=M-D")
+            self.emit_A(f"{self.label_namespace}lt{self.lt_num}True")
+            self.emit_C("D;JLT")
             self.load_SP_into_A()
-            self.output_file.write(f"M=0\n")
-            self.output_file.write(f"@lt{self.lt_num}TrueEnd\n")
-            self.output_file.write(f"0;JMP\n")
-            self.output_file.write(f"(lt{self.lt_num}True)\n")
+            self.emit_C("M=0")
+            self.emit_A(f"{self.label_namespace}lt{self.lt_num}TrueEnd")
+            self.emit_C("0;JMP")
+            self.emit_label(f"{self.label_namespace}lt{self.lt_num}True")
             self.load_SP_into_A()
-            self.output_file.write(f"M=-1\n")
-            self.output_file.write(f"(lt{self.lt_num}TrueEnd)\n")
+            self.emit_C("M=-1")
+            self.emit_label(f"{self.label_namespace}lt{self.lt_num}TrueEnd")
             self.SP_pp(load_SP_into_A=False)
             self.lt_num += 1
-        elif parser.cur_line_split[0] == "and":
+        elif command.tokens[0] == "and":
             # // and
             # // SP--
             # load_SP_into_A() // A = *y
@@ -475,13 +979,13 @@ class CodeWriter:
             # load_SP_into_A() // A = *x
             # M=D&M // RAM[*x] = x - y
             # // SP++
-            self.output_file.write(f"// and\n")
+            self.emit_comment("and")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=D&M\n")
+            self.emit_C("M=D&M")
             self.SP_pp(load_SP_into_A=False)
-        elif parser.cur_line_split[0] == "or":
+        elif command.tokens[0] == "or":
             # // or
             # // SP--
             # load_SP_into_A() // A = *y
@@ -490,129 +994,131 @@ class CodeWriter:
             # load_SP_into_A() // A = *x
             # M=D|M // RAM[*x] = x - y
             # // SP++
-            self.output_file.write(f"// or\n")
+            self.emit_comment("or")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=D|M\n")
+            self.emit_C("M=D|M")
             self.SP_pp(load_SP_into_A=False)
-        elif parser.cur_line_split[0] == "not":
+        elif command.tokens[0] == "not":
             # // not
             # // SP--
             # load_SP_into_A() // A = *y
             # M=!M // Negate y and replace it with it's negated value
             # // Increment stack pointer, now at 258
-            self.output_file.write(f"// neg\n")
+            self.emit_comment("not")
             self.SP_mm(load_SP_into_A=True)
-            self.output_file.write(f"M=!M\n")
+            self.emit_C("M=!M")
             self.SP_pp(load_SP_into_A=False)
 
-        self.output_file.write(f'\n')
+        self.emit_blank()
 
     def push_constant(self, val: str):
         '''
         Pushes val onto the stack and incrememnts the stack pointer
         '''
-        self.output_file.write(f"@{val}\n")
-        self.output_file.write(f"D=A\n")
+        self.emit_A(val)
+        self.emit_C("D=A")
         self.load_SP_into_A()
-        self.output_file.write(f"M=D\n")
+        self.emit_C("M=D")
         self.SP_pp(load_SP_into_A=False)
 
-    def write_push(self, parser: Parser):
+    @reuse_translation
+    def write_push(self, command: Command):
         # Write a comment with the VM code for reference/debugging
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:3])}\n")
-
-        if parser.cur_line_split[1] == "constant":
-            self.push_constant(parser.cur_line_split[2])
-        elif parser.cur_line_split[1] == "local":
-            self.push_value("LCL", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "argument":
-            self.push_value("ARG", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "static":
-            self.push_pointer(self.static_symbol(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "temp":
-            self.push_pointer(f"{self.TEMP + int(parser.cur_line_split[2])}")
-        elif parser.cur_line_split[1] == "pointer":
-            if int(parser.cur_line_split[2]) == 0:
+        self.emit_comment(' '.join(command.tokens[:3]))
+
+        if command.tokens[1] == "constant":
+            self.push_constant(command.tokens[2])
+        elif command.tokens[1] == "local":
+            self.push_value("LCL", int(command.tokens[2]))
+        elif command.tokens[1] == "argument":
+            self.push_value("ARG", int(command.tokens[2]))
+        elif command.tokens[1] == "static":
+            self.push_pointer(self.static_symbol(command.tokens[2]))
+        elif command.tokens[1] == "temp":
+            self.push_pointer(f"{self.TEMP + int(command.tokens[2])}")
+        elif command.tokens[1] == "pointer":
+            if int(command.tokens[2]) == 0:
                 self.push_pointer("THIS")
-            elif int(parser.cur_line_split[2]) == 1:
+            elif int(command.tokens[2]) == 1:
                 self.push_pointer("THAT")
             else:
                 raise RuntimeError("Invalid command")
-        elif parser.cur_line_split[1] == "this":
-            self.push_value("THIS", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "that":
-            self.push_value("THAT", int(parser.cur_line_split[2]))
+        elif command.tokens[1] == "this":
+            self.push_value("THIS", int(command.tokens[2]))
+        elif command.tokens[1] == "that":
+            self.push_value("THAT", int(command.tokens[2]))
         else:
-            raise RuntimeError(f"Unkown push command: {' '.join(parser.cur_line_split[:3])}")
-
-        self.output_file.write(f'\n')
-
-    def write_pop(self, parser: Parser):
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:3])}\n")
-
-        if parser.cur_line_split[1] == "local":
-            self.pop_value("LCL", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "argument":
-            self.pop_value("ARG", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "static":
-            self.pop_pointer(self.static_symbol(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "temp":
-            self.pop_pointer(f"{self.TEMP + int(parser.cur_line_split[2])}")
-        elif parser.cur_line_split[1] == "pointer":
-            if int(parser.cur_line_split[2]) == 0:
+            raise RuntimeError(f"Unkown push command: {' '.join(command.tokens[:3])}")
+
+        self.emit_blank()
+
+    @reuse_translation
+    def write_pop(self, command: Command):
+        self.emit_comment(' '.join(command.tokens[:3]))
+
+        if command.tokens[1] == "local":
+            self.pop_value("LCL", int(command.tokens[2]))
+        elif command.tokens[1] == "argument":
+            self.pop_value("ARG", int(command.tokens[2]))
+        elif command.tokens[1] == "static":
+            self.pop_pointer(self.static_symbol(command.tokens[2]))
+        elif command.tokens[1] == "temp":
+            self.pop_pointer(f"{self.TEMP + int(command.tokens[2])}")
+        elif command.tokens[1] == "pointer":
+            if int(command.tokens[2]) == 0:
                 self.pop_pointer("THIS")
-            elif int(parser.cur_line_split[2]) == 1:
+            elif int(command.tokens[2]) == 1:
                 self.pop_pointer("THAT")
             else:
                 raise RuntimeError("Invalid command")
-        elif parser.cur_line_split[1] == "this":
-            self.pop_value("THIS", int(parser.cur_line_split[2]))
-        elif parser.cur_line_split[1] == "that":
-            self.pop_value("THAT", int(parser.cur_line_split[2]))
+        elif command.tokens[1] == "this":
+            self.pop_value("THIS", int(command.tokens[2]))
+        elif command.tokens[1] == "that":
+            self.pop_value("THAT", int(command.tokens[2]))
         else:
-            raise RuntimeError(f"Unkown pop command: {' '.join(parser.cur_line_split[:3])}")
+            raise RuntimeError(f"Unkown pop command: {' '.join(command.tokens[:3])}")
 
-        self.output_file.write(f'\n')
+        self.emit_blank()
         pass
 
-    def write_label(self, parser: Parser):
-        self.output_file.write(f"({self.prefix_w_cur_func_name(parser.cur_line_split[1])})\n")
-        self.output_file.write(f"\n")
+    def write_label(self, command: Command):
+        self.emit_label(self.prefix_w_cur_func_name(command.tokens[1]))
+        self.emit_blank()
 
-    def write_if_goto(self, parser: Parser):
+    def write_if_goto(self, command: Command):
         '''
         This command effects a conditional goto operation. The stack’s topmost value is popped; 
         if the value is not zero, execution continues from the location marked by the label; otherwise, 
         execution continues from the next command in the program. 
         The jump destination must be located in the same function.
         '''
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:2])}\n")
+        self.emit_comment(' '.join(command.tokens[:2]))
         # Pop the top of the stack into the D register
         self.SP_mm(load_SP_into_A=True)
-        self.output_file.write(f"D=M\n")
+        self.emit_C("D=M")
 
         # Load the label into the A register
-        self.output_file.write(f"@{self.prefix_w_cur_func_name(parser.cur_line_split[1])}\n")
+        self.emit_A(self.prefix_w_cur_func_name(command.tokens[1]))
 
         # If popped value is non-zero, jump to label
-        self.output_file.write(f"D;JNE\n")
+        self.emit_C("D;JNE")
 
-        self.output_file.write(f"\n")
+        self.emit_blank()
 
-    def write_goto(self, parser: Parser):
+    def write_goto(self, command: Command):
         '''
         This command effects an unconditional goto operation, causing execution to continue from the location marked by the label. 
         The jump destination must be located in the same function.
         '''
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:2])}\n")
+        self.emit_comment(' '.join(command.tokens[:2]))
 
-        self.goto_label(self.prefix_w_cur_func_name(parser.cur_line_split[1]))
+        self.goto_label(self.prefix_w_cur_func_name(command.tokens[1]))
 
-        self.output_file.write(f"\n")
+        self.emit_blank()
 
-    def write_function(self, parser: Parser):
+    def write_function(self, command: Command):
         '''
         `function f k`: declaring a function `f` that has `k` local variables
         ```psuedocode
@@ -622,22 +1128,22 @@ class CodeWriter:
         ```
         See Figure 8.5 on p. 193
         '''
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:2])}\n")
+        self.emit_comment(' '.join(command.tokens[:2]))
 
-        f = parser.cur_line_split[1]
-        k = int(parser.cur_line_split[2])
+        f = command.tokens[1]
+        k = int(command.tokens[2])
 
         # Set cur_func_name so that labels within this function can be written as `functionName$label`
         self.cur_func_name = f
 
         # Create label for the function itself
-        self.output_file.write(f"({f})\n")
+        self.emit_label(f)
 
         # Push k local variables onto the stack, initialized to 0
         for _ in range(k):
             self.push_constant("0")
 
-    def write_call(self, parser: Parser):
+    def write_call(self, command: Command):
         '''
         `call f n`: calling a function `f` after `n` arguments have been pushed onto the stack
         ```psuedocode
@@ -653,11 +1159,22 @@ class CodeWriter:
         ```
         See Figure 8.5 on p. 193
         '''
-        self.output_file.write(f"// {' '.join(parser.cur_line_split[:3])}\n")
-
-        f = parser.cur_line_split[1]
-        n = parser.cur_line_split[2]
-        ret_addr = self.create_ret_addr(self.cur_func_name, parser.cur_line_number)
+        self.emit_comment(' '.join(command.tokens[:3]))
+
+        f = command.tokens[1]
+        n = command.tokens[2]
+        ret_addr = self.create_ret_addr(self.cur_func_name, command.line_number)
+
+        if self.shared_call:
+            # R13 = n, R14 = f, R15 = return-address, goto $$call
+            self.set_reg("R13", n)
+            self.set_reg("R14", f)
+            self.set_reg("R15", ret_addr)
+            self.use_routine('call')
+            self.goto_label("$$call")
+            self.emit_label(ret_addr)
+            self.emit_blank()
+            return
 
         self.push_constant(ret_addr)
         self.push_pointer("LCL")
@@ -669,22 +1186,55 @@ class CodeWriter:
         self.load_SP_into_D()
 
         # LCL = SP
-        self.output_file.write(f"@LCL\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A("LCL")
+        self.emit_C("M=D")
 
         # ARG = SP - n - 5
-        self.output_file.write(f"@{n}\n")
-        self.output_file.write(f"D=D-A\n")
-        self.output_file.write(f"@{5}\n")
-        self.output_file.write(f"D=D-A\n")
-        self.output_file.write(f"@ARG\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A(n)
+        self.emit_C("D=D-A")
+        self.emit_A("5")
+        self.emit_C("D=D-A")
+        self.emit_A("ARG")
+        self.emit_C("M=D")
 
         self.goto_label(f)
-        self.output_file.write(f"({ret_addr})\n")
-        self.output_file.write(f"\n")
+        self.emit_label(ret_addr)
+        self.emit_blank()
 
-    def write_return(self, parser: Parser):
+    def write_call_routine(self):
+        '''
+        Writes the routine `$$call` shared by every `call f n` when self.shared_call is set. Does
+        the same as the inlined version in write_call, with n in R13, the address of f in R14 and
+        the return-address in R15.
+        '''
+        self.emit_comment("shared call")
+        self.emit_label("$$call")
+        self.push_pointer("R15")
+        self.push_pointer("LCL")
+        self.push_pointer("ARG")
+        self.push_pointer("THIS")
+        self.push_pointer("THAT")
+
+        # LCL = SP
+        self.load_SP_into_D()
+        self.emit_A("LCL")
+        self.emit_C("M=D")
+
+        # ARG = SP - n - 5
+        self.emit_A("R13")
+        self.emit_C("D=D-M")
+        self.emit_A("5")
+        self.emit_C("D=D-A")
+        self.emit_A("ARG")
+        self.emit_C("M=D")
+
+        # goto f
+        self.emit_A("R14")
+        self.emit_C("A=M")
+        self.emit_C("0;JMP")
+        self.emit_blank()
+
+    def write_return(self, command: Command):
         '''
         ```psuedocode
         FRAME = LCL
@@ -699,48 +1249,81 @@ class CodeWriter:
         ```
         See Figure 8.5 on p. 193
         '''
-        self.output_file.write(f"// {parser.cur_line_split[0]}\n")
+        self.emit_comment(command.tokens[0])
+        if self.shared_call:
+            self.use_routine('return')
+            self.goto_label("$$return")
+            self.emit_blank()
+            return
+        self.write_return_code()
+
+    def write_return_routine(self):
+        '''
+        Writes the routine `$$return` shared by every `return` when self.shared_call is set
+        '''
+        self.emit_comment("shared return")
+        self.emit_label("$$return")
+        self.write_return_code()
+
+    def write_return_code(self):
+        '''
+        The code for `return`, which doesn't depend on where it's returning from
+        '''
         # FRAME = LCL
         # RET = *(FRAME - 5)
-        self.output_file.write(f"@LCL\n")
-        self.output_file.write(f"D=M\n")
-        self.output_file.write(f"@5\n")
-        self.output_file.write(f"A=D-A\n")
-        self.output_file.write(f"D=M\n")
+        self.emit_A("LCL")
+        self.emit_C("D=M")
+        self.emit_A("5")
+        self.emit_C("A=D-A")
+        self.emit_C("D=M")
         # Save in register 14
-        self.output_file.write(f"@R14\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A("R14")
+        self.emit_C("M=D")
 
         # *ARG = pop()
         # reposition the return value from the current top of stack to the caller's top of stack (which is the current ARG)
         self.pop_value("ARG", 0)
 
         # SP = ARG+1
-        self.output_file.write(f"@ARG\n")
-        self.output_file.write(f"D=M+1\n")
-        self.output_file.write(f"@SP\n")
-        self.output_file.write(f"M=D\n")
+        self.emit_A("ARG")
+        self.emit_C("D=M+1")
+        self.emit_A("SP")
+        self.emit_C("M=D")
 
         # THAT = *(FRAME - 1)
         # THIS = *(FRAME - 2)
         # ARG = *(FRAME - 3)
         # LCL = *(FRAME - 4)
         for destination in ['THAT', 'THIS', 'ARG', 'LCL']:
-            self.output_file.write(f"@LCL\n")
+            self.emit_A("LCL")
             # LCL = FRAME-1 so that the loop works, A = FRAME-1
-            self.output_file.write(f"AM=M-1\n")
+            self.emit_C("AM=M-1")
             # D = *(FRAME-1), the saved value
-            self.output_file.write(f"D=M\n")
+            self.emit_C("D=M")
             # destination = D
-            self.output_file.write(f"@{destination}\n")
-            self.output_file.write(f"M=D\n")
+            self.emit_A(destination)
+            self.emit_C("M=D")
 
         # goto RET
-        self.output_file.write(f"@R14\n")
-        self.output_file.write(f"A=M\n")
-        self.output_file.write(f"0;JMP\n")
+        self.emit_A("R14")
+        self.emit_C("A=M")
+        self.emit_C("0;JMP")
+
+        self.emit_blank()
 
-        self.output_file.write(f"\n")
+
+def translate_file(job: Tuple[VMFileName, Dict[str, bool], bool]) -> Tuple[str, List[str]]:
+    '''
+    Translates a single file with the CodeWriter options given, in one of VMtranslator's worker
+    processes. Returns the CodeWriter's translated_code(), with source marks in it if mark_sources
+    is set.
+    '''
+    filename, options, mark_sources = job
+    codewriter = CodeWriter(io.StringIO(), **options)
+    # The source map itself is written by the CodeWriter the code gets linked into
+    codewriter.mark_sources = mark_sources
+    codewriter.write_file(Parser(filename))
+    return codewriter.translated_code()
 
 
 class VMtranslator:
@@ -748,63 +1331,113 @@ class VMtranslator:
     Parses and translates *.vm specification compliant files into assembly code to be run on the Hack machine architecture
     '''
 
-    def __init__(self, directory_or_filename: str):
+    def __init__(self,
+                 directory_or_filename: str,
+                 output: Optional[TextIO] = None,
+                 optimize: bool = False,
+                 shared_compare: bool = False,
+                 shared_call: bool = False,
+                 comments: bool = True,
+                 jobs: Optional[int] = None,
+                 source_map: Union[bool, str, TextIO] = False):
         '''
         directory_or_filename: The directory or *.vm file to translate
+        output: Where to write the assembly code. Defaults to a *.asm file named after
+                directory_or_filename, pass i.e. an io.StringIO to keep the translation in memory
+        optimize: Run the peephole optimizer over the assembly code before writing it
+        shared_compare: Translate eq/gt/lt into calls to shared routines instead of inlining them,
+                        to save ROM
+        shared_call: Translate call and return into jumps to shared routines instead of inlining
+                     them, to save ROM
+        comments: Write comments with the VM code and blank lines between commands, turn off for
+                  smaller output
+        jobs: Translate the files in a pool of this many processes. Gives the same output as
+              translating them one after the other.
+        source_map: Write a source map (see CodeWriter.write_source_map) to this file or text sink.
+                    True writes it next to the *.asm file, with `.map` appended to its name.
         '''
         self.parsers: List[Parser] = []
+        self.jobs = jobs
 
-        # If directory_or_filename is a filename, check that its a .vm file
-        if '.' in directory_or_filename:
+        if not os.path.isdir(directory_or_filename):
+            # If directory_or_filename is a filename, check that its a .vm file
             if directory_or_filename.split('.')[-1] != 'vm':
                 raise RuntimeError("Files passed to VMTranslator must end with the .vm extension")
             self.parsers.append(Parser(directory_or_filename))  # only one parser
         else:
             # Else directory_or_filename is a directory, walk through each file and give it a parser
-            for filename in os.listdir(directory_or_filename):
+            # in sorted order, so the output doesn't depend on the file system's listing order
+            for filename in sorted(os.listdir(directory_or_filename)):
                 if filename.split('.')[-1] == 'vm':
-                    self.parsers.append(Parser(f"{directory_or_filename}/{filename}"))
+                    self.parsers.append(Parser(os.path.join(directory_or_filename, filename)))
 
         # Create CodeWriter
-        self.codewriter = CodeWriter(directory_or_filename.split('.')[0].strip('/') + '.asm')
+        if output is None:
+            output = os.path.splitext(directory_or_filename.rstrip('/'))[0] + '.asm'
+        if source_map is True:
+            if not isinstance(output, str):
+                raise RuntimeError(
+                    "Pass the filename or sink to write the source map to along with the output")
+            source_map = output + '.map'
+        self.options = dict(optimize=optimize,
+                            shared_compare=shared_compare,
+                            shared_call=shared_call,
+                            comments=comments)
+        self.codewriter = CodeWriter(output, source_map=source_map or None, **self.options)
 
     def run(self):
         '''
         Main function that calls each parser to run, passing each parsed token into codewriter which then 
         writes the corresponding assembly code to the output file.
         '''
+        if self.jobs is not None:
+            # Each file is translated on its own, then linked in order by closing the codewriter
+            with Pool(self.jobs) as pool:
+                linked = pool.map(translate_file,
+                                  [(parser.filename, self.options, self.codewriter.mark_sources)
+                                   for parser in self.parsers])
+            self.codewriter.close(linked)
+            return
+
         for parser in self.parsers:
-            # Update cur_parser_filename so codewriter knows how to name static vars (section 7.3 in the book)
-            self.codewriter.cur_parser_filename = parser.filename
-            while (parser.advance()):
-                # parser parses the input, codewriter translates tokens to assembly, this section
-                # contains the logic for which codewrite function to pass the parser to
-                if parser.command_type == CT.SKIP:
-                    continue
-                elif parser.command_type == CT.ARITHMETIC:
-                    self.codewriter.write_arithmetic(parser)
-                elif parser.command_type == CT.PUSH:
-                    self.codewriter.write_push(parser)
-                elif parser.command_type == CT.POP:
-                    self.codewriter.write_pop(parser)
-                elif parser.command_type == CT.LABEL:
-                    self.codewriter.write_label(parser)
-                elif parser.command_type == CT.IF_GOTO:
-                    self.codewriter.write_if_goto(parser)
-                elif parser.command_type == CT.GOTO:
-                    self.codewriter.write_goto(parser)
-                elif parser.command_type == CT.FUNCTION:
-                    self.codewriter.write_function(parser)
-                elif parser.command_type == CT.RETURN:
-                    self.codewriter.write_return(parser)
-                elif parser.command_type == CT.CALL:
-                    self.codewriter.write_call(parser)
+            self.codewriter.write_file(parser)
 
         # Don't forget to close the output file when you're done
-        self.codewriter.output_file.close()
+        self.codewriter.close()
 
 
 if __name__ == "__main__":
-    import sys
-    vmt = VMtranslator(sys.argv[1])
-    vmt.run()
\ No newline at end of file
+    import argparse
+    arg_parser = argparse.ArgumentParser(
+        description='Translates *.vm files into Hack assembly code')
+    arg_parser.add_argument('directory_or_filename', help='the directory or *.vm file to translate')
+    arg_parser.add_argument('--optimize',
+                            action='store_true',
+                            help='peephole optimize the assembly code')
+    arg_parser.add_argument(
+        '--shared-compare',
+        action='store_true',
+        help='call one shared routine per eq/gt/lt operator instead of inlining them')
+    arg_parser.add_argument('--shared-call',
+                            action='store_true',
+                            help='jump to shared call and return routines instead of inlining them')
+    arg_parser.add_argument('--no-comments',
+                            action='store_true',
+                            help='leave out the comments and blank lines between VM commands')
+    arg_parser.add_argument('--jobs',
+                            type=int,
+                            default=None,
+                            help='translate the files in this many processes')
+    arg_parser.add_argument(
+        '--source-map',
+        action='store_true',
+        help='also write a source map from ROM addresses to VM commands to the *.asm.map file')
+    args = arg_parser.parse_args()
+    vmt = VMtranslator(args.directory_or_filename,
+                       optimize=args.optimize,
+                       shared_compare=args.shared_compare,
+                       shared_call=args.shared_call,
+                       comments=not args.no_comments,
+                       jobs=args.jobs,
+                       source_map=args.source_map)
+    vmt.run()
@@ -1,24 +1,24 @@
 '''
 Program to simulate the Hack platform based on assembly input
 '''
+import io
+import os
+import re
+import copy
+import json
+import sys
+import zlib
+import struct
+import numpy as np
 from enum import Enum
-from typing import TextIO, List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Callable, Iterable, FrozenSet, Union
 from dataclasses import dataclass
-from numpy import int16, uint16
+from array import array
+from time import perf_counter
+from collections import deque
 from collections.abc import MutableSequence
 
 
-class LineType(Enum):
-    A_COMMAND = 1
-    C_COMMAND = 2
-    L_COMMAND = 3
-    SKIP = 4
-    EOF = 5
-
-
-LT = LineType
-
-
 class CommandType(Enum):
     A_COMMAND = 1
     C_COMMAND = 2
@@ -36,30 +36,64 @@ class Instruction:
     val for type=END is just an empty Dict
     line: the line in the .asm file corresponding to this instruction, useful for debugging
     line_num: the line number in the .asm file corresponding to this instruction, useful for debugging
+    comment: the last whole line comment before this instruction, i.e. `push constant 7` for the
+    code the VMtranslator writes for that command
+    function: the VM function this instruction belongs to, going by the `// function f` comments
+    the VMtranslator writes (`$$call` etc. for the shared routines, empty for the init code)
     '''
     type: CommandType
     val: Dict[str, str]
     line: str
     line_num: int
+    comment: str = ''
+    function: str = ''
+
+
+@dataclass
+class SourceLocation:
+    '''
+    Where an instruction came from, according to a source map the VMtranslator wrote
+    file: the name of the .vm file, empty for the init code and the shared routines
+    line: the line number of the VM command in file, 0 for the init code and the shared routines
+    function: the VM function the command belongs to (`$$call` etc. for the shared routines)
+    '''
+    file: str
+    line: int
+    function: str
 
 
 class AsmParser:
     '''
-    Used to step through a Hack assembly file and generate a list of Instruction to be fed into the HackExecutor
+    Used to turn Hack assembly into a list of Instruction to be fed into the HackExecutor
+
+    source: either the filename of an .asm file, or any other iterable of lines of assembly (a list
+    of strings, an io.StringIO, ...). See also from_string.
+
+    Single pass parser: every line is tokenised exactly once. A_COMMAND's that reference a symbol
+    are backpatched at the end once every label's address is known. Like the assembler, the symbols
+    that are never declared as labels are variables, which get the free addresses from 16 on in
+    order of first use.
+
+    Whole line comments are kept as the comment (and function) of the instructions that follow them,
+    which maps code the VMtranslator wrote back to the VM commands it came from (see
+    HackExecutor.profile).
 
-    Two pass parser: first steps through the file and builds the symbol table, then steps through again to create the instructions
+    source_map: the source map the VMtranslator wrote along with the assembly, as a filename or
+    iterable of lines like source. Defaults to the .asm file's name with `.map` appended, if there
+    is such a file. It's only loaded the first time location is called.
     '''
 
-    def __init__(self, filename: str):
-        self.filename = filename
-        self.file: TextIO = open(self.filename, 'r')
-        self.cur_line: str
-        self.asm_code_line_num: int = 0  # The line number in the .asm file
-        # The next machine code line number. Gets incremented after each A_COMMAND or C_COMMAND,
-        # so that subsequent L_COMMAND's know which line they should be set to
-        self.machine_code_line_num: int = 0  # Only increments on executable lines, i.e. only A_COMMAND's and C_COMMAND's; 0 indexed
-        self.line_type: LineType
-        self.first_pass: bool = True  # True for first pass, false for second pass
+    def __init__(self,
+                 source: Union[str, Iterable[str]],
+                 source_map: Optional[Union[str, Iterable[str]]] = None):
+        self.filename: Optional[str] = source if isinstance(source, str) else None
+        self.source: Iterable[str] = source
+        default_map = None if self.filename is None else self.filename + '.map'
+        if source_map is None and default_map is not None and os.path.isfile(default_map):
+            source_map = default_map
+        self.source_map: Optional[Union[str, Iterable[str]]] = source_map
+        # By ROM address, filled out by location
+        self.locations: Optional[List[Optional[SourceLocation]]] = None
         self.symbol_table: Dict[str, str] = {
             'R0': '0',
             'R1': '1',
@@ -81,158 +115,144 @@ class AsmParser:
             'LCL': '1',
             'ARG': '2',
             'THIS': '3',
-            'THAT': '4'
+            'THAT': '4',
+            'SCREEN': '16384',
+            'KBD': '24576'
         }
         self.next_unknown_symbol = 16
-        self.instructions: List[Instruction] = []  # Filled out in the second pass
-
-    def advance(self) -> str:
-        '''
-        Advances to the next line of the file and updates the state of the parser.
-        If this is the first pass, updates the symbol table as appropriate.
-        If this is the second pass, replaces symbols with their respective values as appropriate.
-        '''
-        # Read the next line and strip leading/trailing spaces
-        self.cur_line = self.file.readline().strip(' ')
-        self.asm_code_line_num += 1
-
-        # EOF
-        if self.cur_line == '':
-            self.line_type = LT.EOF
-            # If this is the first pass, reset file, set first_pass flag to false, and reset machine_code_line_num and asm_code_line_num
-            if self.first_pass:
-                self.file.seek(0)
-                self.first_pass = False
-                self.machine_code_line_num = 0
-                self.asm_code_line_num = 0
-            else:
-                self.append_instruction(CT.END, {})
-            return self.cur_line
-
-        # If this is a full line comment or empty line return a SKIP
-        if self.cur_line == '\n' or self.cur_line[:2] == "//":
-            self.line_type = LT.SKIP
-            return self.cur_line
-
-        # Strip away all comments and newlines so the line is only the first token
-        # i.e. "@45 // load 45 into the A reg\n" becomes "@45"
-        self.cur_line = self.cur_line.split('//')[0].strip()
-
-        # L_COMMAND
-        if self.cur_line[0] == "(":
-            self.line_type = LT.L_COMMAND
-            if self.first_pass:
-                # On first pass, update symbol table with L_COMMAND's
-                self.symbol_table[self.cur_line[1:-1]] = str(self.machine_code_line_num)
-            return self.cur_line
-
-        # A_COMMAND
-        if self.cur_line[0] == '@':
-            self.line_type = LT.A_COMMAND
-            if self.first_pass:
-                if self.cur_line[1].isalpha():
-                    # On first pass, if this is a symbol, update the symbol table iif the symbol dne
-                    if self.symbol_table.get(self.cur_line[1:]) == None:
-                        self.symbol_table[self.cur_line[1:]] = str(self.next_unknown_symbol)
-                        self.next_unknown_symbol += 1
-            else:
-                self.append_A_instr(self.cur_line)
-            self.machine_code_line_num += 1
-            return self.cur_line
-        else:  # C_COMMAND
-            self.line_type = LT.C_COMMAND
-            if self.first_pass:
-                pass
-            else:
-                self.append_C_instr(self.cur_line)
-            self.machine_code_line_num += 1
-            return self.cur_line
-
-        # Build the instruction
-        instruction = self.__build_instruction(self.cur_line, self.machine_code_line_num)
+        self.instructions: List[Instruction] = []  # Filled out by run
 
-        return ''
-
-    def append_instruction(self, type: CommandType, val: Dict[str, str]):
+    @classmethod
+    def from_string(cls, asm: str, source_map: Optional[str] = None) -> 'AsmParser':
         '''
-        Appends an Instruction to self.instructions
+        Creates a parser for assembly (and optionally its source map) held in memory rather than
+        in a file
         '''
-        self.instructions.append(Instruction(type, val, self.cur_line, self.asm_code_line_num))
-
-    def append_A_instr(self, cur_line: str):
-        if self.is_infinite_loop_terminator(cur_line):
-            return
-        val = cur_line[1:]  # remove '@'
-        if val[0].isalpha():
-            val = self.symbol_table[val]
-        self.append_instruction(CT.A_COMMAND, {'val': val})
-
-    def append_C_instr(self, cur_line: str):
-        dest = ''
-        comp = ''
-        jump = ''
-        buf = cur_line
-        if '=' in cur_line:
-            split_buf = buf.split('=')
-            # Extract dest
-            dest = split_buf[0]
-            # Remove it from buf
-            buf = split_buf[-1]
-        if ';' in cur_line:
-            split_buf = buf.split(';')
-            # Extract jump
-            jump = split_buf[-1]
-            # Remove it from buf
-            buf = split_buf[0]
-        # Only comp is left over
-        comp = buf
-
-        self.append_instruction(CT.C_COMMAND, {'dest': dest, 'comp': comp, 'jump': jump})
-
-    def is_infinite_loop_terminator(self, cur_line: str):
-        '''
-        NOTE: Major hack incoming
-
-        A Sys.init VM function will typically setup and then call some other function, and then terminate with an infinite loop:
-        {code[vm]
-            function Sys.init 0
-            push constant 4
-            call Main.fibonacci 1   // computes the 4'th fibonacci element
-            label INFLOOP
-            goto INFLOOP            // loops infinitely
-        }
-        
-        The assembly for the final two lines (the infinite loop) will wind up looking like the following
-        {code[asm]
-            (Sys.init$INFLOOP)
-            @Sys.init$INFLOOP
-            0;JMP
-        }
+        return cls(asm.splitlines(), None if source_map is None else source_map.splitlines())
 
-        This makes sense for ordinary Hack usage, but for the purposes of our testing simulator (HackExecutor), we want the program to
-        terminate or else the tests themselves will run in an infinite loop and never complete. To avoid this, we will designate the
-        label `Sys.init$INFLOOP` a special keyword in our testing setup, and use it to indicate that we've reached the infinte loop
-        and so should terminate the program (denoted by a CT.END instruction)
+    def location(self, address: int) -> Optional[SourceLocation]:
         '''
-        if cur_line == "@Sys.init$INFLOOP":
-            self.append_instruction(CT.END, {})
-            return True
-        return False
+        The VM command the instruction at ROM address was translated from, None if there's no source
+        map or it doesn't cover address. Call run first, since the source map is spread over the
+        instructions it finds.
+        '''
+        if self.locations is None:
+            if self.source_map is not None and not self.instructions:
+                raise RuntimeError("Call run before location, "
+                                   "the source map can't be read without the instructions")
+            self.locations = self.load_source_map()
+        return self.locations[address] if 0 <= address < len(self.locations) else None
+
+    def load_source_map(self) -> List[Optional[SourceLocation]]:
+        '''
+        Reads the source map, one JSON line `[address, file, line, function]` per VM command, and
+        spreads each command's location over the addresses up to the next command's
+        '''
+        if self.source_map is None:
+            return []
+        if isinstance(self.source_map, str):
+            with open(self.source_map, 'r') as f:
+                lines: Iterable[str] = f.read().splitlines()
+        else:
+            lines = self.source_map
+        entries = [json.loads(line) for line in lines if line.strip()]
+        # The END pseudo instruction isn't in the ROM the source map covers
+        locations: List[Optional[SourceLocation]] = [None] * max(len(self.instructions) - 1, 0)
+        ends = [entry[0] for entry in entries[1:]] + [len(locations)]
+        for (start, file, line, function), end in zip(entries, ends):
+            location = SourceLocation(file, line, function)
+            for address in range(start, end):
+                locations[address] = location
+        return locations
 
     def run(self) -> List[Instruction]:
         '''
-        Walk through the input file and generate a list of instructions to be passed into the HackExecutor
+        Walk through the input and generate a list of instructions to be passed into the
+        HackExecutor
         '''
-        # Run first pass to fill out symbol table
-        while self.advance():
-            continue
+        if self.filename is not None:
+            with open(self.filename, 'r') as f:
+                lines: Iterable[str] = f.read().splitlines()
+        else:
+            lines = self.source
+
+        symbol_table = self.symbol_table
+        instructions = self.instructions
+        # A_COMMAND's whose symbol gets resolved at the end
+        fixups: List[Tuple[Instruction, str]] = []
+        # Symbols not known at their first use, in order (labels or variables)
+        unresolved: Dict[str, None] = {}
+        comment = ''
+        function = ''
+        line_num = 0
+        for line_num, line in enumerate(lines, 1):
+            # Strip away all comments and whitespace so the line is only the first token
+            # i.e. "@45 // load 45 into the A reg\n" becomes "@45"
+            if '//' in line:
+                start = line.index('//')
+                if not line[:start].strip():
+                    comment = line[start + 2:].strip()
+                    if comment.startswith('function '):
+                        function = comment.split()[1]
+                    elif comment.startswith('shared '):
+                        function = '$$' + comment.split()[1]
+                    elif comment == 'init':
+                        function = ''
+                    continue
+                line = line[:start]
+            line = line.strip()
+            if not line:
+                continue
+
+            if line[0] == '(':  # L_COMMAND
+                symbol_table[line[1:-1]] = str(len(instructions))
+            elif line[0] == '@':  # A_COMMAND
+                val = line[1:]
+                ins = Instruction(CT.A_COMMAND, {'val': val}, line, line_num, comment, function)
+                if not val.isdigit():
+                    if val not in symbol_table:
+                        unresolved[val] = None
+                    fixups.append((ins, val))
+                instructions.append(ins)
+            else:  # C_COMMAND
+                instructions.append(
+                    Instruction(CT.C_COMMAND, self.split_C_instr(line), line, line_num, comment,
+                                function))
+
+        # Whatever still isn't a label now is a variable
+        for symbol in unresolved:
+            if symbol not in symbol_table:
+                symbol_table[symbol] = str(self.next_unknown_symbol)
+                self.next_unknown_symbol += 1
+
+        # Backpatch symbols now that all the labels are known
+        for ins, symbol in fixups:
+            ins.val['val'] = symbol_table[symbol]
+
+        instructions.append(Instruction(CT.END, {}, '', line_num + 1))
+        return instructions
+
+    @staticmethod
+    def split_C_instr(line: str) -> Dict[str, str]:
+        '''
+        Splits `dest=comp;jump` into its parts, dest and jump are empty strings when they're omitted
+        '''
+        dest = ''
+        jump = ''
+        comp = line
+        if '=' in comp:
+            dest, comp = comp.split('=', 1)
+        if ';' in comp:
+            comp, jump = comp.split(';', 1)
+        return {'dest': dest, 'comp': comp, 'jump': jump}
 
-        # Run second pass to fill out list of instructions
-        while self.advance():
-            continue
 
-        # Return the list
-        return self.instructions
+def to_int16(val: int) -> int:
+    '''
+    Wraps a python int into the signed 16-bit range of a Hack register,
+    i.e. to_int16(32768) == -32768
+    '''
+    return ((val + 0x8000) & 0xFFFF) - 0x8000
 
 
 class RAM32K(MutableSequence):
@@ -241,218 +261,886 @@ class RAM32K(MutableSequence):
     I.e. ram[-32768] becomes ram[0]. This is in case we have a negative value in the A register
     and our simulator has a C_COMMAND that asks for `M` (either dest or comp).
 
-    Also casting all values stored in the array to int16 for good measure
+    Backed by a flat array of signed 16-bit values. Addresses are wrapped by masking off all but
+    their low 15 bits, and values are wrapped into the signed 16-bit range before being stored.
     '''
 
-    def __init__(self):
-        self._mem = [int16(0)] * 2**15
+    ADDRESS_MASK = 2**15 - 1
 
-    def __to_uint15(self, index) -> int:
-        '''
-        To be called before any method that makes use of index
-        '''
-        # Cast index to uint16, format that to a 16-bit binary string representation,
-        # lop off the MSB (with [-15:]), then cast that 15-bit binary string to an int
-        return int(format(uint16(index), '016b')[-15:], 2)
+    def __init__(self):
+        self._mem = array('h', bytes(2 * 2**15))
 
     def __len__(self):
         return len(self._mem)
 
     def __delitem__(self, index):
-        self._mem.__delitem__(self.__to_uint15(index))
+        self._mem.__delitem__(index & self.ADDRESS_MASK)
 
     def insert(self, index, value):
-        self._mem.insert(self.__to_uint15(index), int16(value))
+        self._mem.insert(index & self.ADDRESS_MASK, to_int16(value))
 
     def __setitem__(self, index, value):
-        self._mem.__setitem__(self.__to_uint15(index), int16(value))
+        self._mem[index & self.ADDRESS_MASK] = to_int16(value)
 
     def __getitem__(self, index):
-        return self._mem.__getitem__(self.__to_uint15(index))
+        return self._mem[index & self.ADDRESS_MASK]
+
+    def load(self, addresses: slice, values: Iterable[int]):
+        '''
+        Stores values into the registers selected by the slice addresses,
+        i.e. `ram.load(slice(256, 259), [1, 1, 1])`. Unlike single indices, slices are not wrapped
+        and must select exactly as many registers as there are values.
+        '''
+        values = array('h', (to_int16(value) for value in values))
+        if len(range(*addresses.indices(len(self._mem)))) != len(values):
+            raise ValueError(
+                f"Can't load {len(values)} values into RAM[{addresses.start}:{addresses.stop}]")
+        self._mem[addresses] = values
 
+    def dump(self, addresses: slice) -> List[int]:
+        '''
+        Returns the values of the registers selected by the slice addresses, i.e.
+        `ram.dump(slice(256, 259))`
+        '''
+        return self._mem[addresses].tolist()
 
-class HackExecutor:
+    def to_bytes(self) -> bytes:
+        '''
+        The whole RAM as the raw bytes of its registers, which copies in a few microseconds
+        '''
+        return self._mem.tobytes()
+
+    def from_bytes(self, data: bytes):
+        '''
+        Overwrites the whole RAM with bytes from to_bytes
+        '''
+        mem = array('h')
+        mem.frombytes(data)
+        if len(mem) != len(self._mem):
+            raise ValueError(f"Can't load {len(mem)} registers into a RAM of {len(self._mem)}")
+        self._mem[:] = mem
+
+
+# Predecoded opcodes, see HackExecutor.decode
+OP_A = 0
+OP_C = 1
+OP_END = 2
+OP_BREAK = 3  # Only ever patched in by HackExecutor.run, never produced by decode
+
+# Bits of a decoded dest, matching the d1 d2 d3 bits of a Hack C-instruction
+DEST_A = 0b100
+DEST_D = 0b010
+DEST_M = 0b001
+
+# Python expressions for every comp mnemonic in terms of the D and A registers. The M variants are
+# the same expressions evaluated with RAM[A] passed in place of A. Anything that can leave the
+# 16-bit range is wrapped.
+COMP_EXPRS: Dict[str, str] = {
+    '0': '0',
+    '1': '1',
+    '-1': '-1',
+    'D': 'D',
+    'A': 'A',
+    '!D': '~D',
+    '!A': '~A',
+    '-D': '((-D + 0x8000) & 0xFFFF) - 0x8000',
+    '-A': '((-A + 0x8000) & 0xFFFF) - 0x8000',
+    'D+1': '((D + 1 + 0x8000) & 0xFFFF) - 0x8000',
+    'A+1': '((A + 1 + 0x8000) & 0xFFFF) - 0x8000',
+    'D-1': '((D - 1 + 0x8000) & 0xFFFF) - 0x8000',
+    'A-1': '((A - 1 + 0x8000) & 0xFFFF) - 0x8000',
+    'D+A': '((D + A + 0x8000) & 0xFFFF) - 0x8000',
+    'D-A': '((D - A + 0x8000) & 0xFFFF) - 0x8000',
+    'A-D': '((A - D + 0x8000) & 0xFFFF) - 0x8000',
+    'D&A': 'D & A',
+    'D|A': 'D | A',
+}
+COMP_FUNCS: Dict[str, Callable[[int, int], int]] = {
+    comp: eval(f"lambda D, A: {expr}") for comp, expr in COMP_EXPRS.items()
+}
+
+# For each jump mnemonic, whether the jump is taken when the ALU output is
+# (negative, zero, positive)
+JUMP_TABLE: Dict[str, Tuple[bool, bool, bool]] = {
+    'JGT': (False, False, True),
+    'JEQ': (False, True, False),
+    'JGE': (False, True, True),
+    'JLT': (True, False, False),
+    'JNE': (True, False, True),
+    'JLE': (True, True, False),
+    'JMP': (True, True, True),
+}
+
+# The same jump tables as python conditions on the ALU output `out`, used by CompiledHackExecutor
+JUMP_CONDITIONS: Dict[str, str] = {
+    'JGT': 'out > 0',
+    'JEQ': 'out == 0',
+    'JGE': 'out >= 0',
+    'JLT': 'out < 0',
+    'JNE': 'out != 0',
+    'JLE': 'out <= 0',
+    'JMP': 'True',
+}
+
+# A decoded C_COMMAND: (comp function, whether comp reads M, dest bits, jump table entry or None)
+DecodedC = Tuple[Callable[[int, int], int], bool, int, Optional[Tuple[bool, bool, bool]]]
+
+# A basic block compiled by CompiledHackExecutor: (block function taking (mem, A, D) and returning
+# the next (pc, A, D), number of instructions in the block, whether it writes RAM)
+CompiledBlock = Tuple[Callable[[array, int, int], Tuple[int, int, int]], int, bool]
+
+
+class HaltReason(Enum):
+    END = 1  # reached a CT.END instruction or a jump to itself
+    MAX_CYCLES = 2  # ran out of cycle budget
+    BREAKPOINT = 3  # about to execute an instruction at a breakpoint
+    WATCH = 4  # just wrote to a watched RAM address
+    FIXED_POINT = 5  # looping without changing any state, so it would never make progress again
+
+
+@dataclass
+class RunResult:
     '''
-    Takes in the List[Instruction] generated by the AsmParser and then simulates them step by step
+    cycles: the number of instructions executed by this run
+    halt_reason: why the run stopped
+    pc: the program counter at the time the run stopped, i.e. the next instruction to be executed
+    wall_time: seconds spent in the run
     '''
+    cycles: int
+    halt_reason: HaltReason
+    pc: int
+    wall_time: float
 
-    def __init__(self, instructions: List[Instruction]):
-        self.instructions = instructions  # Should only be A_COMMAND's and C_COMMAND's at this point
-        self.pc: int16 = 0  # The program counter, used to index the instructions
-        self.ram: RAM32K = RAM32K()  # 32k RAM initialized to 0
-        self.A: int16 = 0  # A reg
-        self.D: int16 = 0  # D reg
-        self.ALU_output: int16 = 0
 
-    # Give all numpy.int16 attributes getters and setters so that we don't need to remember to cast to int16 every set call.
-    @property
-    def pc(self) -> int16:
-        return self._pc
+@dataclass
+class Profile:
+    '''
+    hits: the number of times the instruction at each ROM address was executed
+    by_function: cycles spent in each VM function (see Instruction.function)
+    by_command: cycles spent in each type of VM command, i.e. `push` or `call` (the first word of
+    Instruction.comment, or the operator of a shared routine)
+    '''
+    hits: List[int]
+    by_function: Dict[str, int]
+    by_command: Dict[str, int]
+
+    def report(self, top: int = 10) -> str:
+        '''
+        The top functions and commands by cycles, as a table
+        '''
+        total = sum(self.hits) or 1
+        lines = []
+        for title, cycles in [('function', self.by_function), ('command', self.by_command)]:
+            lines.append(f"{'cycles':>12}{'':>8}  VM {title}")
+            for name, count in sorted(cycles.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"{count:>12}{100 * count / total:>7.1f}%  {name or '-'}")
+        return '\n'.join(lines)
 
-    @pc.setter
-    def pc(self, val):
-        self._pc = int16(val)
 
-    @property
-    def A(self) -> int16:
-        return self._A
+# The memory mapped screen: the book's screen is 512x256 pixels, while the VGA controller of the
+# FPGA shows 320x240 pixels out of the same memory. Either way each row takes width / 16 consecutive
+# registers, and bit 0 of a register is its leftmost pixel, with 1 meaning black.
+SCREEN = 16384
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
 
-    @A.setter
-    def A(self, val):
-        self._A = int16(val)
 
-    @property
-    def D(self) -> int16:
-        return self._D
+def unpack_screen(words: np.ndarray) -> np.ndarray:
+    '''
+    Unpacks a (rows, width / 16) array of screen registers into a (rows, width) bitmap, in one go
+    '''
+    return np.unpackbits(words.astype('<u2').view(np.uint8), axis=-1, bitorder='little')
 
-    @D.setter
-    def D(self, val):
-        self._D = int16(val)
 
-    @property
-    def ALU_output(self) -> int16:
-        return self._ALU_output
+def write_pbm(filename: str, bitmap: np.ndarray):
+    '''
+    Writes bitmap as a binary PBM image (which also has 1 mean black)
+    '''
+    height, width = bitmap.shape
+    with open(filename, 'wb') as f:
+        f.write(f"P4\n{width} {height}\n".encode() + np.packbits(bitmap, axis=1).tobytes())
 
-    @ALU_output.setter
-    def ALU_output(self, val):
-        self._ALU_output = int16(val)
+
+def write_png(filename: str, bitmap: np.ndarray):
+    '''
+    Writes bitmap as a 1 bit grayscale PNG image (where 1 means white)
+    '''
+    height, width = bitmap.shape
+    # Each row starts with its filter type, 0 for none
+    rows = np.hstack([np.zeros((height, 1), dtype=np.uint8), np.packbits(1 - bitmap, axis=1)])
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(kind + data)
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', crc)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' +
+                chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)) +
+                chunk(b'IDAT', zlib.compress(rows.tobytes())) + chunk(b'IEND', b''))
+
+
+# Image writer for each format record_screen can write
+IMAGE_WRITERS: Dict[str, Callable[[str, np.ndarray], None]] = {'pbm': write_pbm, 'png': write_png}
+
+# The memory mapped keyboard, which holds the code of the key that's pressed or 0 for none.
+# Printable characters are their ASCII codes, the other keys have codes from 128 on.
+KBD = 24576
+KEY_CODES: Dict[str, int] = {
+    'newline': 128,
+    'backspace': 129,
+    'left': 130,
+    'up': 131,
+    'right': 132,
+    'down': 133,
+    'home': 134,
+    'end': 135,
+    'page up': 136,
+    'page down': 137,
+    'insert': 138,
+    'delete': 139,
+    'esc': 140,
+}
+KEY_CODES.update({f"f{n}": 140 + n for n in range(1, 13)})
+
+
+def key_code(key: Union[int, str, None]) -> int:
+    '''
+    The keyboard register value for key: a key code, a single character, a name in KEY_CODES, or
+    None for no key
+    '''
+    if key is None:
+        return 0
+    if isinstance(key, int):
+        return key
+    if len(key) == 1:
+        return ord(key)
+    return KEY_CODES[key]
+
+
+@dataclass
+class Snapshot:
+    '''
+    The state of a HackExecutor at some point, see HackExecutor.snapshot.
+    ram and key_events are immutable, so any number of executors can be restored from the same one.
+    '''
+    pc: int
+    A: int
+    D: int
+    cycles: int
+    ram: bytes
+    # The scripted key presses still to come, see script_keyboard
+    key_events: Tuple[Tuple[int, int], ...] = ()
+
+
+class HackExecutor:
+    '''
+    Takes in the List[Instruction] generated by the AsmParser and then simulates them.
+
+    Each Instruction is decoded once up front (see decode) into an integer opcode plus a DecodedC
+    for C_COMMAND's, so that the fetch/execute loop only ever touches plain python ints: registers
+    are kept wrapped to the signed 16-bit range, RAM is addressed with the low 15 bits of A, and
+    jumps go to the unsigned 16-bit value of A.
+
+    profile: when True, counts how often each instruction executes, see profile(). Rather than
+    counting every instruction, the loop only counts where control flow doesn't just fall through to
+    the next address: the instruction a run starts at (entries), taken jumps (exits at the jump,
+    entries at the target) and the instruction a run stops at (which wasn't executed). The hits are
+    rebuilt from those afterwards, so a profiled run is barely slower, and an unprofiled one pays a
+    single check per taken jump.
+    '''
+
+    def __init__(self, instructions: List[Instruction], profile: bool = False):
+        self.instructions = instructions  # Should only be A_COMMAND's and C_COMMAND's at this point
+        self.pc: int = 0  # The program counter, used to index the instructions
+        self.ram: RAM32K = RAM32K()  # 32k RAM initialized to 0
+        self.A: int = 0  # A reg
+        self.D: int = 0  # D reg
+        self.cycles: int = 0  # Total number of instructions executed
+        self.key_events: deque = deque()  # (cycle, key code) still to come, see script_keyboard
+        # See profile, allocated up front so the loop only ever increments them
+        counts = bytes(8 * len(instructions))
+        self.entries: Optional[array] = array('q', counts) if profile else None
+        self.exits: Optional[array] = array('q', counts) if profile else None
+        self.opcodes: List[int] = []  # OP_A, OP_C or OP_END for each instruction
+        self.operands: List = []  # The A value, DecodedC or None for each instruction
+        for ins in instructions:
+            opcode, operand = self.decode(ins)
+            self.opcodes.append(opcode)
+            self.operands.append(operand)
+        self.mark_self_jumps()
+
+    @staticmethod
+    def decode(ins: Instruction) -> Tuple[int, object]:
+        '''
+        Decodes an Instruction into its (opcode, operand) pair
+        '''
+        if ins.type == CT.A_COMMAND:
+            return OP_A, to_int16(int(ins.val['val']))
+        if ins.type == CT.C_COMMAND:
+            comp = ins.val['comp']
+            func = COMP_FUNCS.get(comp.replace('M', 'A'))
+            if func is None:
+                raise RuntimeError(f"Unkown comp command: {comp}")
+            dest = ins.val['dest']
+            dest_bits = ((DEST_A if 'A' in dest else 0) | (DEST_D if 'D' in dest else 0) |
+                         (DEST_M if 'M' in dest else 0))
+            jump = ins.val['jump']
+            if jump and jump not in JUMP_TABLE:
+                raise RuntimeError(f"Unkown jump command: {jump}")
+            return OP_C, (func, 'M' in comp, dest_bits, JUMP_TABLE.get(jump))
+        return OP_END, None
+
+    def mark_self_jumps(self):
+        '''
+        Programs terminate by jumping to themselves forever, typically like so
+        {code[asm]
+            (END)
+            @END
+            0;JMP
+        }
+        Every `@X` at address X that is followed by an unconditional jump (which doesn't write
+        anywhere) is such an infinite loop, so it's decoded as OP_END to halt the simulation right
+        there.
+        '''
+        opcodes = self.opcodes
+        operands = self.operands
+        for pc in range(len(opcodes) - 1):
+            if opcodes[pc] == OP_A and operands[pc] == pc and opcodes[pc + 1] == OP_C:
+                _, _, dest, jump = operands[pc + 1]
+                if dest == 0 and jump == JUMP_TABLE['JMP']:
+                    opcodes[pc] = OP_END
+
+    def profile(self) -> Profile:
+        '''
+        The instruction hits, and the cycles per VM function and command, of every run so far
+        '''
+        if self.entries is None:
+            raise RuntimeError("Profiling is off, create the HackExecutor with profile=True")
+        hits: List[int] = []
+        count = 0
+        for entries, exits in zip(self.entries, self.exits):
+            count += entries
+            hits.append(count)
+            count -= exits
+        by_function: Dict[str, int] = {}
+        by_command: Dict[str, int] = {}
+        for ins, count in zip(self.instructions, hits):
+            if count:
+                words = ins.comment.split()
+                if len(words) > 1 and words[0] == 'shared':
+                    command = words[1]
+                else:
+                    command = words[0] if words else ''
+                by_function[ins.function] = by_function.get(ins.function, 0) + count
+                by_command[command] = by_command.get(command, 0) + count
+        return Profile(hits, by_function, by_command)
+
+    def snapshot(self) -> Snapshot:
+        '''
+        Saves the registers, RAM, cycle count and the key presses still to come, to go back to
+        them with restore
+        '''
+        return Snapshot(self.pc, self.A, self.D, self.cycles, self.ram.to_bytes(),
+                        tuple(self.key_events))
+
+    def restore(self, snapshot: Snapshot):
+        '''
+        Puts the machine back into the state it was in when snapshot was taken (by this or any
+        other executor of the same program). Profile counts aren't part of a snapshot, they keep
+        adding up.
+        '''
+        self.pc = snapshot.pc
+        self.A = snapshot.A
+        self.D = snapshot.D
+        self.cycles = snapshot.cycles
+        self.ram.from_bytes(snapshot.ram)
+        self.key_events = deque(snapshot.key_events)
+
+    def fork(self) -> 'HackExecutor':
+        '''
+        Returns a new executor of the same program in the same state as this one, that runs
+        independently from here on. i.e. run the bootstrap code once, and then fork an executor for
+        each test case.
+
+        The program is shared rather than decoded again (and so are the compiled blocks of a
+        CompiledHackExecutor, which only depend on the program), so forking costs about as much as
+        copying the 64 KiB of RAM.
+        '''
+        fork = copy.copy(self)
+        fork.ram = RAM32K()
+        fork.ram.from_bytes(self.ram.to_bytes())
+        fork.key_events = deque(self.key_events)
+        if self.entries is not None:
+            fork.entries = array('q', self.entries)
+            fork.exits = array('q', self.exits)
+        return fork
+
+    def screen(self, width: int = SCREEN_WIDTH, height: int = SCREEN_HEIGHT) -> np.ndarray:
+        '''
+        The screen as a (height, width) array of pixels, 1 for black
+        '''
+        words = np.frombuffer(self.ram._mem,
+                              dtype=np.int16,
+                              count=width // 16 * height,
+                              offset=2 * SCREEN)
+        return unpack_screen(words.reshape(height, width // 16))
+
+    def record_screen(self,
+                      directory: str,
+                      every: int,
+                      max_cycles: Optional[int] = None,
+                      breakpoints: Iterable[int] = (),
+                      image_format: str = 'pbm',
+                      width: int = SCREEN_WIDTH,
+                      height: int = SCREEN_HEIGHT) -> Tuple[RunResult, List[str]]:
+        '''
+        Runs like run does, and after every `every` cycles writes a frame of the screen to directory
+        as a pbm or png image named after the cycle it was taken at, i.e. frame_000001000000.pbm.
+
+        Only frames that differ from the last one written are written at all: the screen registers
+        are compared against the last frame's as bytes, and only the rows with changed registers are
+        unpacked again. Returns the RunResult of the whole run along with the filenames of the
+        frames written, in order.
+        '''
+        if every <= 0:
+            raise ValueError("every must be a positive number of cycles")
+        write_image = IMAGE_WRITERS[image_format]
+        os.makedirs(directory, exist_ok=True)
+        start = perf_counter()
+        words_per_row = width // 16
+        bitmap = np.zeros((height, width), dtype=np.uint8)
+        last: Optional[bytes] = None
+        frames: List[str] = []
+        cycles = 0
+        while True:
+            result = self.run(every if max_cycles is None else min(every, max_cycles - cycles),
+                              breakpoints)
+            cycles += result.cycles
+            screen = self.ram._mem[SCREEN:SCREEN + words_per_row * height].tobytes()
+            if screen != last:
+                words = np.frombuffer(screen, dtype=np.int16).reshape(height, words_per_row)
+                if last is None:
+                    rows = np.arange(height)
+                else:
+                    last_words = np.frombuffer(last, dtype=np.int16).reshape(height, words_per_row)
+                    rows = np.flatnonzero((words != last_words).any(axis=1))
+                bitmap[rows] = unpack_screen(words[rows])
+                frames.append(os.path.join(directory, f"frame_{self.cycles:012d}.{image_format}"))
+                write_image(frames[-1], bitmap)
+                last = screen
+            if result.halt_reason != HaltReason.MAX_CYCLES or cycles == max_cycles:
+                break
+        return RunResult(cycles, result.halt_reason, self.pc, perf_counter() - start), frames
 
     def step(self) -> Instruction:
         '''
-        Executes a single instruction
+        Executes a single instruction, after typing in any scripted key presses that are due
         '''
+        self._type_keys()
         ins: Instruction = self.instructions[self.pc]
-
-        if ins.type == CT.A_COMMAND:
-            # If this is an A command, load the value into the A register and increment the pc
-            self.A = ins.val['val']
-            self.pc += 1
-        elif ins.type == CT.C_COMMAND:
-            # NOTE: The order of the following commands matter, see respective docstrings
-            self.__handle_comp(ins.val['comp'])
-            self.__handle_jump(ins.val['jump'])
-            self.__handle_dest(ins.val['dest'])
-        # else: ins.type == CT.END
+        if self.opcodes[self.pc] == OP_END and ins.type != CT.END:
+            # A self jump, see mark_self_jumps
+            return Instruction(CT.END, {}, ins.line, ins.line_num)
+        self.cycles += self._execute(1, self.opcodes, frozenset())[0]
         return ins
 
-    def __handle_comp(self, comp: str):
-        '''
-        Logic for handling the comp command, must be called before __handle_jump and __handle_dest
-        since this function sets the ALU_output that each of those depend on
-        '''
-        if comp == '0':
-            self.ALU_output = 0
-        elif comp == '1':
-            self.ALU_output = 1
-        elif comp == '-1':
-            self.ALU_output = -1
-        elif comp == 'D':
-            self.ALU_output = self.D
-        elif comp == 'A':
-            self.ALU_output = self.A
-        elif comp == '!D':
-            self.ALU_output = ~self.D
-        elif comp == '!A':
-            self.ALU_output = ~self.A
-        elif comp == '-D':
-            self.ALU_output = -self.D
-        elif comp == '-A':
-            self.ALU_output = -self.A
-        elif comp == 'D+1':
-            self.ALU_output = self.D + 1
-        elif comp == 'A+1':
-            self.ALU_output = self.A + 1
-        elif comp == 'D-1':
-            self.ALU_output = self.D - 1
-        elif comp == 'A-1':
-            self.ALU_output = self.A - 1
-        elif comp == 'D+A':
-            self.ALU_output = self.D + self.A
-        elif comp == 'D-A':
-            self.ALU_output = self.D - self.A
-        elif comp == 'A-D':
-            self.ALU_output = self.A - self.D
-        elif comp == 'D&A':
-            self.ALU_output = self.D & self.A
-        elif comp == 'D|A':
-            self.ALU_output = self.D | self.A
-        elif comp == 'M':
-            self.ALU_output = self.ram[self.A]
-        elif comp == '!M':
-            self.ALU_output = ~self.ram[self.A]
-        elif comp == '-M':
-            self.ALU_output = -self.ram[self.A]
-        elif comp == 'M+1':
-            self.ALU_output = self.ram[self.A] + 1
-        elif comp == 'M-1':
-            self.ALU_output = self.ram[self.A] - 1
-        elif comp == 'D+M':
-            self.ALU_output = self.D + self.ram[self.A]
-        elif comp == 'D-M':
-            self.ALU_output = self.D - self.ram[self.A]
-        elif comp == 'M-D':
-            self.ALU_output = self.ram[self.A] - self.D
-        elif comp == 'D&M':
-            self.ALU_output = self.D & self.ram[self.A]
-        elif comp == 'D|M':
-            self.ALU_output = self.D | self.ram[self.A]
-        else:
-            raise RuntimeError(f"Unkown comp command: {comp}")
-
-    def __handle_jump(self, jump: str):
-        '''
-        Only to be called after __handle_comp, and before __handle_dest because:
-        1) it depends on self.ALU_output being already set for this step (set by __handle_comp)
-        2) it depends on the self.A of the previous step (self.A is modified for this step in __handle_dest, so we can't do it first)
-
-        jump is either an empty string or one of JGT, JEQ, JGE, JLT, JNE, JLE, JMP
-
-        Since jump optionally sets the program counter self.pc, we'll also handle incrementing that counter
-        here too
-        '''
-        if jump == 'JGT' and self.ALU_output > 0:
-            self.pc = self.A
-        elif jump == 'JEQ' and self.ALU_output == 0:
-            self.pc = self.A
-        elif jump == 'JGE' and self.ALU_output >= 0:
-            self.pc = self.A
-        elif jump == 'JLT' and self.ALU_output < 0:
-            self.pc = self.A
-        elif jump == 'JNE' and self.ALU_output != 0:
-            self.pc = self.A
-        elif jump == 'JLE' and self.ALU_output <= 0:
-            self.pc = self.A
-        elif jump == 'JMP':
-            self.pc = self.A
+    def script_keyboard(self, events: Iterable[Tuple[int, Union[int, str, None]]]):
+        '''
+        Schedules key presses for the runs to come: each (cycle, key) event puts key (see
+        key_code) into the keyboard register once self.cycles reaches cycle, where it stays until
+        the next event. i.e.
+            hack.script_keyboard([(1000000, 'right'), (1500000, None), (2000000, 'q')])
+        holds down the right arrow for half a million cycles and later presses q. Events for cycles
+        that have already passed are typed in at the start of the next run or step.
+        '''
+        self.key_events = deque(
+            sorted(((cycle, key_code(key)) for cycle, key in [*self.key_events, *events]),
+                   key=lambda event: event[0]))
+
+    def _type_keys(self):
+        '''
+        Puts the key events that are due into the keyboard register
+        '''
+        events = self.key_events
+        while events and events[0][0] <= self.cycles:
+            self.ram[KBD] = events.popleft()[1]
+
+    def run(
+        self,
+        max_cycles: Optional[int] = None,
+        breakpoints: Iterable[int] = (),
+        watch: Iterable[int] = ()
+    ) -> RunResult:
+        '''
+        Executes instructions until the program ends (see HaltReason) or one of the following
+        happens:
+        max_cycles: stop after executing this many instructions
+        breakpoints: stop before executing the instruction at any of these ROM addresses
+        watch: stop right after writing to any of these RAM addresses
+
+        Calling run again picks up where the previous run stopped, stepping over the breakpoint it
+        stopped at (if any).
+
+        Key presses scheduled with script_keyboard are typed in along the way: the run is split up
+        into one run up to each event, so the loop itself never checks for them. Fixed points are
+        only detected once no more events are to come, as until then the program may just be waiting
+        for the next key.
+        '''
+        if not self.key_events:
+            return self._run(max_cycles, breakpoints, watch)
+
+        start = perf_counter()
+        breakpoints = frozenset(breakpoints)
+        watch = frozenset(watch)
+        events = self.key_events
+        cycles = 0
+        while True:
+            self._type_keys()
+            budget = -1 if max_cycles is None else max_cycles - cycles
+            if events:
+                until_event = events[0][0] - self.cycles
+                budget = until_event if budget < 0 else min(budget, until_event)
+            result = self._run(None if budget < 0 else budget,
+                               breakpoints,
+                               watch,
+                               fixed_points=not events)
+            cycles += result.cycles
+            halt_reason = result.halt_reason
+            if cycles == max_cycles:
+                break
+            if halt_reason != HaltReason.MAX_CYCLES:
+                break
+            if self.pc in breakpoints:
+                # Only stopped for a key event, and the next run would step over this breakpoint
+                halt_reason = HaltReason.BREAKPOINT
+                break
+        return RunResult(cycles, halt_reason, self.pc, perf_counter() - start)
+
+    def _run(self,
+             max_cycles: Optional[int],
+             breakpoints: Iterable[int],
+             watch: Iterable[int],
+             fixed_points: bool = True) -> RunResult:
+        '''
+        run without the key events, fixed_points: whether to stop at fixed points (see _execute)
+        '''
+        start = perf_counter()
+        budget = -1 if max_cycles is None else max_cycles
+        breakpoints = frozenset(breakpoints)
+        watch = frozenset(address & RAM32K.ADDRESS_MASK for address in watch)
+
+        cycles = 0
+        halt_reason = HaltReason.MAX_CYCLES
+        if self.pc in breakpoints and budget != 0:
+            # Resuming from a breakpoint, step over it before the breakpoints are patched in
+            cycles, halt_reason = self._execute(1, self.opcodes, watch, fixed_points)
+            if halt_reason == HaltReason.MAX_CYCLES and budget != 1:
+                halt_reason = None
+        elif budget != 0:
+            halt_reason = None
+
+        if halt_reason is None:
+            opcodes = self.opcodes
+            if breakpoints:
+                opcodes = list(opcodes)
+                for address in breakpoints:
+                    if 0 <= address < len(opcodes) and opcodes[address] != OP_END:
+                        opcodes[address] = OP_BREAK
+            more_cycles, halt_reason = self._execute(budget - cycles if budget >= 0 else -1,
+                                                     opcodes, watch, fixed_points)
+            cycles += more_cycles
+
+        self.cycles += cycles
+        return RunResult(cycles, halt_reason, self.pc, perf_counter() - start)
+
+    def _execute(self,
+                 max_cycles: int,
+                 opcodes: List[int],
+                 watch: FrozenSet[int],
+                 fixed_points: bool = True) -> Tuple[int, HaltReason]:
+        '''
+        The fetch/execute loop. Runs until an OP_END or OP_BREAK opcode, a write to an address in
+        watch, a fixed point (unless fixed_points is False), or until max_cycles instructions have
+        been executed (never, for a negative max_cycles).
+        Returns the number of instructions executed and the reason for stopping.
+
+        A fixed point is detected when the same jump is taken twice in a row with the same A and D
+        and no RAM changed in between: the machine is back in exactly the same state, so it would
+        loop forever. The loop stops right before taking the jump the second time.
+
+        The registers are pulled into locals for the duration of the loop and written back
+        afterwards. Within a C_COMMAND, the jump target and RAM[A] are resolved with the value of A
+        from before the instruction, since dest may overwrite A.
+        '''
+        operands = self.operands
+        mem = self.ram._mem
+        entries = self.entries
+        exits = self.exits
+        profiling = entries is not None
+        pc = self.pc
+        if profiling:
+            entries[pc] += 1
+        A = self.A
+        D = self.D
+        cycles = 0
+        # State at the last taken jump, for detecting fixed points
+        loop_pc = -1
+        loop_A = loop_D = 0
+        wrote = False
+        while cycles != max_cycles:
+            opcode = opcodes[pc]
+            if opcode == OP_A:
+                A = operands[pc]
+                pc += 1
+            elif opcode == OP_C:
+                func, reads_M, dest, jump = operands[pc]
+                out = func(D, mem[A & 0x7FFF] if reads_M else A)
+                if jump is not None and jump[(out > 0) - (out < 0) + 1]:
+                    if pc == loop_pc and A == loop_A and D == loop_D and not wrote and fixed_points:
+                        halt_reason = HaltReason.FIXED_POINT
+                        break
+                    loop_pc = pc
+                    loop_A = A
+                    loop_D = D
+                    wrote = False
+                    if profiling:
+                        exits[pc] += 1
+                        entries[A & 0xFFFF] += 1
+                    pc = A & 0xFFFF
+                else:
+                    pc += 1
+                if dest & DEST_M:
+                    # M must be set before A, since M means ram[A_from_previous_step]
+                    address = A & 0x7FFF
+                    if mem[address] != out:
+                        mem[address] = out
+                        wrote = True
+                    if dest & DEST_A:
+                        A = out
+                    if dest & DEST_D:
+                        D = out
+                    if watch and address in watch:
+                        cycles += 1
+                        halt_reason = HaltReason.WATCH
+                        break
+                elif dest:
+                    if dest & DEST_A:
+                        A = out
+                    if dest & DEST_D:
+                        D = out
+            elif opcode == OP_END:
+                halt_reason = HaltReason.END
+                break
+            else:  # OP_BREAK
+                halt_reason = HaltReason.BREAKPOINT
+                break
+            cycles += 1
         else:
-            # Don't forget to increment the counter if the jump condition isn't met
-            self.pc += 1
+            halt_reason = HaltReason.MAX_CYCLES
+        if profiling:
+            # The instruction the run stopped at was reached, but not executed
+            entries[pc] -= 1
+        self.pc = pc
+        self.A = A
+        self.D = D
+        return cycles, halt_reason
+
+
+class CompiledHackExecutor(HackExecutor):
+    '''
+    A HackExecutor that compiles the program into basic blocks instead of interpreting it
+    instruction by instruction.
+
+    A block is a straight run of instructions starting at some address and ending with the first
+    instruction that has a jump (or right before a CT.END). Since the only way into the middle of a
+    program is a jump, blocks start at labels in practice. Each block is compiled into a single
+    generated python function that keeps A and D in locals, runs all of its instructions, and
+    returns the next (pc, A, D). Blocks are compiled lazily the first time execution reaches their
+    start address, and the run loop just dispatches from one block to the next.
+
+    verify: differential testing switch. When True, a reference HackExecutor is run in lockstep and
+    the registers and RAM are compared after every block, raising a RuntimeError at the first block
+    where they diverge.
+    '''
 
-    def __handle_dest(self, dest: str):
+    def __init__(self, instructions: List[Instruction], verify: bool = False):
+        super().__init__(instructions)
+        self.verify = verify
+        self.reference: Optional[HackExecutor] = HackExecutor(instructions) if verify else None
+        self.blocks: Dict[int, CompiledBlock] = {}  # By start address
+
+    def compile_block(self, start: int) -> CompiledBlock:
+        '''
+        Generates, compiles and caches the block starting at address start
+        '''
+        body: List[str] = []
+        pc = start
+        while pc < len(self.instructions) and self.opcodes[pc] != OP_END:
+            ins = self.instructions[pc]
+            body.append(f"# {pc}: {ins.line.strip()}")
+            pc += 1
+            if ins.type == CT.A_COMMAND:
+                body.append(f"A = {self.operands[pc - 1]}")
+                continue
+
+            comp, dest, jump = ins.val['comp'], ins.val['dest'], ins.val['jump']
+            if 'M' in comp:
+                expr = re.sub(r'\bA\b', 'M', COMP_EXPRS[comp.replace('M', 'A')])
+            else:
+                expr = COMP_EXPRS[comp]
+            if 'M' in comp:
+                body.append("M = mem[A & 0x7FFF]")
+            if not jump:
+                if not dest:
+                    continue  # Nothing observable happens
+                body.append(f"out = {expr}")
+                if 'M' in dest:
+                    body.append("mem[A & 0x7FFF] = out")
+                if 'A' in dest:
+                    body.append("A = out")
+                if 'D' in dest:
+                    body.append("D = out")
+                continue
+
+            # Jumps end the block, at the A from before this instruction's dest is applied
+            body.append(f"out = {expr}")
+            body.append("target = A & 0xFFFF")
+            if 'M' in dest:
+                body.append("mem[A & 0x7FFF] = out")
+            if 'A' in dest:
+                body.append("A = out")
+            if 'D' in dest:
+                body.append("D = out")
+            body.append(f"if {JUMP_CONDITIONS[jump]}:")
+            body.append("    return target, A, D")
+            break
+        body.append(f"return {pc}, A, D")
+
+        source = f"def block_{start}(mem, A, D):\n" + ''.join(f"    {line}\n" for line in body)
+        namespace: Dict = {}
+        exec(compile(source, f"<block {start}>", 'exec'), namespace)
+        writes = any('mem[A & 0x7FFF] = out' == line for line in body)
+        block = (namespace[f"block_{start}"], pc - start, writes)
+        self.blocks[start] = block
+        return block
+
+    def _run(self,
+             max_cycles: Optional[int],
+             breakpoints: Iterable[int],
+             watch: Iterable[int],
+             fixed_points: bool = True) -> RunResult:
         '''
-        Only to be called after __handle_comp and __handle_jump since:
-        1) it depends on self.ALU_output being already set for this step (set by __handle_comp)
-        2) it modifies self.A for this step, but self.A from the previous step is needed for __handle_comp and __handle_jump
+        See HackExecutor.run. Breakpoints and watches need per-instruction checks, so runs that use
+        them (and the tail end of a run that would overshoot max_cycles mid-block) fall back to the
+        interpreter.
 
-        dest is either an empty string for null or some combination of A, M, and D.
+        Fixed points are detected at block granularity: a block that doesn't write RAM and jumps
+        back to its own start with A and D unchanged.
+        '''
+        if breakpoints or watch:
+            return super()._run(max_cycles, breakpoints, watch, fixed_points)
+
+        start = perf_counter()
+        if self.reference is not None:
+            self._sync_reference()
+        budget = -1 if max_cycles is None else max_cycles
+        blocks = self.blocks
+        opcodes = self.opcodes
+        mem = self.ram._mem
+        pc = self.pc
+        A = self.A
+        D = self.D
+        cycles = 0
+        while True:
+            block = blocks.get(pc)
+            if block is None:
+                if opcodes[pc] == OP_END:
+                    halt_reason = HaltReason.END
+                    break
+                block = self.compile_block(pc)
+            func, length, writes = block
+            if 0 <= budget < cycles + length:
+                # Finish off the budget one instruction at a time
+                self.pc, self.A, self.D = pc, A, D
+                more_cycles, halt_reason = self._execute(budget - cycles, opcodes, frozenset(),
+                                                         fixed_points)
+                cycles += more_cycles
+                pc, A, D = self.pc, self.A, self.D
+                break
+            next_pc, next_A, next_D = func(mem, A, D)
+            cycles += length
+            if self.reference is not None:
+                self._check_reference(next_pc, next_A, next_D, length)
+            if next_pc == pc and next_A == A and next_D == D and not writes and fixed_points:
+                halt_reason = HaltReason.FIXED_POINT
+                break
+            pc = next_pc
+            A = next_A
+            D = next_D
+        self.pc = pc
+        self.A = A
+        self.D = D
+        self.cycles += cycles
+        return RunResult(cycles, halt_reason, pc, perf_counter() - start)
+
+    def _sync_reference(self):
+        '''
+        Copies the current machine state into the reference executor
+        '''
+        self.reference.pc, self.reference.A, self.reference.D = self.pc, self.A, self.D
+        self.reference.ram._mem[:] = self.ram._mem
 
-        Our assembler cares about the order of A/M/D, as specified in Figure 4.4 of the book.
-        For the sake of expediency here, we'll simply ignore that
+    def _check_reference(self, pc: int, A: int, D: int, length: int):
+        '''
+        Runs the reference executor over the same number of instructions as the block that was just
+        executed and raises a RuntimeError if the two machines no longer agree
         '''
-        # M must be set before A, since M means ram[self.A_from_previous_step]
-        if 'M' in dest:
-            self.ram[self.A] = self.ALU_output
+        reference = self.reference
+        start = reference.pc
+        reference.run(max_cycles=length)
+        expected = (reference.pc, reference.A, reference.D)
+        if expected != (pc, A, D):
+            raise RuntimeError(f"Compiled block at {start} diverged from the reference: "
+                               f"(pc, A, D) == {(pc, A, D)}, expected {expected}")
+        if reference.ram._mem != self.ram._mem:
+            address = next(
+                i for i, (x, y) in enumerate(zip(self.ram._mem, reference.ram._mem)) if x != y)
+            raise RuntimeError(
+                f"Compiled block at {start} diverged from the reference: RAM[{address}] == "
+                f"{self.ram._mem[address]}, expected {reference.ram._mem[address]}")
+
+
+def translate_and_run(path: str,
+                      ram: Optional[Dict[int, int]] = None,
+                      executor: Callable[[List[Instruction]], HackExecutor] = HackExecutor,
+                      translator_args: Optional[Dict] = None,
+                      **run_args) -> Tuple[HackExecutor, RunResult]:
+    '''
+    Translates the *.vm file or directory at path with the VMtranslator and runs the result, without
+    ever writing the assembly to disk.
+
+    ram: {address: value} to seed the RAM with before running
+    executor: the HackExecutor class to run the program with, i.e. CompiledHackExecutor
+    translator_args: passed on to VMtranslator, i.e. {'optimize': True}
+    run_args: passed on to HackExecutor.run, i.e. max_cycles
 
-        if 'A' in dest:
-            self.A = self.ALU_output
+    Returns the executor (to inspect the final state of the machine) along with the RunResult.
+    '''
+    # The VMtranslator lives in the directory above this one
+    translator_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+    if translator_dir not in sys.path:
+        sys.path.append(translator_dir)
+    from VMtranslator import VMtranslator
 
-        if 'D' in dest:
-            self.D = self.ALU_output
+    asm = io.StringIO()
+    VMtranslator(path, output=asm, **(translator_args or {})).run()
+    asm.seek(0)
+    hack = executor(AsmParser(asm).run())
+    for address, value in (ram or {}).items():
+        hack.ram[address] = value
+    return hack, hack.run(**run_args)
 
 
 if __name__ == "__main__":
-    import sys
-
     hack = HackExecutor(AsmParser(sys.argv[1]).run())
-    for _ in hack.instructions:
-        hack.step()
+    hack.run()
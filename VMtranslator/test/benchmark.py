@@ -0,0 +1,125 @@
+'''
+Compares the assembly code the VMtranslator generates with and without translator options, i.e.
+
+    python test/benchmark.py --option optimize
+
+reports the ROM size and the number of cycles run with and without
+`VMtranslator(..., optimize=True)` for the test programs. Run it from the VMtranslator directory.
+
+Programs run until they halt, or until they first call Sys.halt or poll the keyboard with
+Keyboard.keyPressed (the Jack programs never return, and the interactive ones would otherwise wait
+for a key forever). The Jack programs under ../Compiler/test and ../Os/test need to have been
+compiled to *.vm first, those that haven't are skipped.
+
+Pass --profile to also print where the cycles of each run with the options go, by VM function and
+command.
+
+Pass --keys to keep the interactive programs (Pong, Square, ...) going instead: the arrow keys are
+typed in by a script (see KEY_SCRIPT) and the runs go on until Sys.halt or the cycle budget, which
+makes for long, repeatable runs of real interactive code.
+'''
+import io
+import os
+import sys
+import argparse
+from typing import Dict, List, Optional, Tuple
+from HackAsmSimulator import AsmParser, HackExecutor, Profile, RunResult
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from VMtranslator import VMtranslator
+
+# Functions that mark the end of a run
+STOP_AT = ['Sys.halt', 'Keyboard.keyPressed']
+
+# Cycle budget per run
+MAX_CYCLES = 20000000
+
+# The keys typed in with --keys: right and left in turn, each held down for a million cycles
+KEY_SCRIPT = [
+    (cycle, 'left' if n % 2 else 'right') for n, cycle in enumerate(range(0, MAX_CYCLES, 1000000))
+]
+
+
+def default_programs() -> List[str]:
+    '''
+    FibonacciElement and NestedCall, and every compiled Jack program under ../Compiler/test and
+    ../Os/test
+    '''
+    programs = ['test/FibonacciElement', 'test/NestedCall']
+    for tests in ['../Compiler/test', '../Os/test']:
+        for name in sorted(os.listdir(tests)):
+            program = os.path.join(tests, name)
+            if os.path.isfile(os.path.join(program, 'Main.vm')):
+                programs.append(program)
+    return programs
+
+
+def measure(program: str,
+            translator_args: Dict,
+            profile: bool = False,
+            keys: bool = False) -> Tuple[int, RunResult, Optional[Profile]]:
+    '''
+    Translates and runs program, returns the ROM size, the RunResult and the Profile of the run if
+    profile is set. With keys, types in KEY_SCRIPT rather than stopping at the first
+    Keyboard.keyPressed.
+    '''
+    asm = io.StringIO()
+    VMtranslator(program, output=asm, **translator_args).run()
+    parser = AsmParser.from_string(asm.getvalue())
+    instructions = parser.run()
+    stop_at = ['Sys.halt'] if keys else STOP_AT
+    breakpoints = [
+        int(parser.symbol_table[symbol]) for symbol in stop_at if symbol in parser.symbol_table
+    ]
+    hack = HackExecutor(instructions, profile=profile)
+    if keys:
+        hack.script_keyboard(KEY_SCRIPT)
+    result = hack.run(max_cycles=MAX_CYCLES, breakpoints=breakpoints)
+    # The END pseudo instruction doesn't take up ROM
+    return len(instructions) - 1, result, hack.profile() if profile else None
+
+
+def change(before: int, after: int) -> str:
+    return f"{100 * (after - before) / before:+.1f}%"
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Compares VMtranslator options by ROM size and cycles')
+    arg_parser.add_argument('programs',
+                            nargs='*',
+                            help='*.vm files or directories, defaults to the test programs')
+    arg_parser.add_argument('--option',
+                            action='append',
+                            default=[],
+                            help='VMtranslator keyword argument to set to True, can be repeated')
+    arg_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='print the cycles by VM function and command of the runs with the options')
+    arg_parser.add_argument(
+        '--keys',
+        action='store_true',
+        help='type in the arrow keys rather than stopping when a program polls the keyboard')
+    args = arg_parser.parse_args()
+
+    options = {option: True for option in args.option}
+    print(f"options: {', '.join(args.option) or 'none'}")
+    print(f"{'program':<32}{'ROM':>8}{'ROM with options':>24}"
+          f"{'cycles':>12}{'cycles with options':>28}  stopped at")
+    for program in args.programs or default_programs():
+        rom, result, _ = measure(program, {}, keys=args.keys)
+        opt_rom, opt_result, profile = measure(program, options, args.profile, args.keys)
+        if result.halt_reason != opt_result.halt_reason:
+            raise RuntimeError(
+                f"{program} stopped with {result.halt_reason} without and {opt_result.halt_reason} "
+                f"with {args.option}")
+        print(f"{program:<32}{rom:>8}{opt_rom:>14} ({change(rom, opt_rom):>7}){result.cycles:>12}"
+              f"{opt_result.cycles:>18} ({change(result.cycles, opt_result.cycles):>7})  "
+              f"{result.halt_reason.name.lower()}")
+        if args.keys:
+            # Runs that go on to the cycle budget are still telling of how fast they're simulated
+            print(f"{'':<32}simulated at {result.cycles / result.wall_time / 1e6:.2f}M cycles/s, "
+                  f"{opt_result.cycles / opt_result.wall_time / 1e6:.2f}M cycles/s with options")
+        if profile is not None:
+            print(profile.report())
@@ -1,45 +1,31 @@
-import sys
-import os.path
-from HackAsmSimulator import HackExecutor, AsmParser, CT
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
-from VMtranslator import VMtranslator
+from HackAsmSimulator import translate_and_run, HaltReason
+
+# Cycle budget for each test program, so that a bad translation fails instead of running forever
+MAX_CYCLES = 100000
 
 
 def test_FibonacciElement():
-    # Run the VMtranslator
-    VMtranslator('test/FibonacciElement').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/FibonacciElement.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/FibonacciElement', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
+
     assert hack.ram[0] == 257
     assert hack.ram[256] == 21
 
 
 def test_SimpleFunction():
-    # Run the VMtranslator
-    VMtranslator('test/SimpleFunction').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/SimpleFunction.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/SimpleFunction', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
+
     assert hack.ram[0] == 257
     assert hack.ram[256] == 1196
 
 
 def test_NestedCall():
-    # Run the VMtranslator
-    VMtranslator('test/NestedCall').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/NestedCall.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/NestedCall', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[0] == 256
     assert hack.ram[3] == 4000
@@ -49,14 +35,9 @@ def test_NestedCall():
 
 
 def test_StaticsTest():
-    # Run the VMtranslator
-    VMtranslator('test/StaticsTest').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/StaticsTest.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/StaticsTest', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[0] == 258
     assert hack.ram[256] == -2
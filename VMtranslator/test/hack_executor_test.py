@@ -0,0 +1,343 @@
+import io
+import zlib
+import sys
+import pytest
+import os.path
+from HackAsmSimulator import (HackExecutor, CompiledHackExecutor, AsmParser, CT, HaltReason, OP_END,
+                              KBD)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from VMtranslator import VMtranslator
+
+
+def write_asm(tmp_path, code: str) -> str:
+    '''
+    Writes code to an .asm file in tmp_path and returns the filename
+    '''
+    filename = str(tmp_path / 'prog.asm')
+    with open(filename, 'w') as f:
+        f.write(code)
+    return filename
+
+
+def test_step_matches_run():
+    # Run the VMtranslator
+    VMtranslator('test/FibonacciElement').run()
+    instructions = AsmParser('test/FibonacciElement.asm').run()
+
+    # Simulate one program instruction by instruction and the other in one go
+    stepped = HackExecutor(instructions)
+    steps = 0
+    while stepped.step().type != CT.END:
+        steps += 1
+    ran = HackExecutor(instructions)
+    result = ran.run()
+
+    assert result.halt_reason == HaltReason.END
+    assert result.cycles == steps == ran.cycles == stepped.cycles
+    assert (ran.pc, ran.A, ran.D) == (stepped.pc, stepped.A, stepped.D)
+    assert ran.ram.dump(slice(0, len(ran.ram))) == stepped.ram.dump(slice(0, len(stepped.ram)))
+    assert ran.ram[256] == 21
+
+
+def test_16_bit_wrapping(tmp_path):
+    code = '@32767\nD=A\nD=D+1\n@0\nM=D\nM=M-1\nD=-D\n@1\nM=D\nA=-1\nM=-1\n'
+    hack = HackExecutor(AsmParser(write_asm(tmp_path, code)).run())
+    hack.run()
+
+    # 32767 + 1 overflows to -32768 and back again
+    assert hack.ram[0] == 32767
+    # -(-32768) overflows to itself
+    assert hack.ram[1] == -32768
+    # A == -1 addresses the last register of the 15-bit address space
+    assert hack.ram[32767] == -1
+
+
+def test_ram_load_and_dump():
+    hack = HackExecutor([])
+    hack.ram.load(slice(256, 259), [1, -1, 65535])
+    assert hack.ram.dump(slice(255, 260)) == [0, 1, -1, -1, 0]
+    # Single addresses wrap around the 15-bit address space, slices don't
+    assert hack.ram[256 - 2**15] == 1
+    hack.ram[-1] = 32768
+    assert hack.ram.dump(slice(-1, None)) == [-32768]
+    with pytest.raises(ValueError):
+        hack.ram.load(slice(0, 2), [1, 2, 3])
+
+
+def test_run_max_cycles(tmp_path):
+    # Infinite loop incrementing RAM[0]
+    hack = HackExecutor(AsmParser(write_asm(tmp_path, '(LOOP)\n@0\nM=M+1\n@LOOP\n0;JMP\n')).run())
+
+    result = hack.run(max_cycles=400)
+    assert result.halt_reason == HaltReason.MAX_CYCLES
+    assert result.cycles == 400
+    assert hack.ram[0] == 100
+
+    # Runs pick up where the last one stopped
+    hack.run(max_cycles=2)
+    assert hack.ram[0] == 101
+    assert hack.cycles == 402
+
+
+def test_run_breakpoints_and_watch(tmp_path):
+    hack = HackExecutor(
+        AsmParser(write_asm(tmp_path, '(LOOP)\n@0\nM=M+1\n@5\nM=M-1\n@LOOP\n0;JMP\n')).run())
+
+    # Stops before the breakpoint is executed
+    result = hack.run(breakpoints=[3])
+    assert (result.halt_reason, result.pc, result.cycles) == (HaltReason.BREAKPOINT, 3, 3)
+    assert hack.ram[0] == 1
+    assert hack.ram[5] == 0
+
+    # Resuming steps over the breakpoint it stopped at and stops at it again on the next iteration
+    result = hack.run(breakpoints=[3])
+    assert (result.halt_reason, result.pc, result.cycles) == (HaltReason.BREAKPOINT, 3, 6)
+    assert hack.ram[0] == 2
+    assert hack.ram[5] == -1
+
+    # Stops right after the watched address is written
+    result = hack.run(watch=[5])
+    assert (result.halt_reason, result.pc) == (HaltReason.WATCH, 4)
+    assert hack.ram[5] == -2
+
+
+@pytest.mark.parametrize('program',
+                         ['FibonacciElement', 'NestedCall', 'StaticsTest', 'SimpleFunction'])
+def test_compiled_matches_reference(program):
+    # Run the VMtranslator
+    VMtranslator(f'test/{program}').run()
+    instructions = AsmParser(f'test/{program}.asm').run()
+
+    # verify=True checks every compiled block against the reference executor
+    compiled = CompiledHackExecutor(instructions, verify=True)
+    result = compiled.run(max_cycles=100000)
+    reference = HackExecutor(instructions)
+    reference.run(max_cycles=100000)
+
+    assert result.halt_reason == HaltReason.END
+    assert result.cycles == reference.cycles
+    assert compiled.ram.dump(slice(0, 2048)) == reference.ram.dump(slice(0, 2048))
+
+
+def test_compiled_max_cycles_and_divergence(tmp_path):
+    filename = write_asm(tmp_path, '(LOOP)\n@0\nM=M+1\n@LOOP\n0;JMP\n')
+
+    # Budgets that end mid-block are finished off by the interpreter
+    hack = CompiledHackExecutor(AsmParser(filename).run())
+    result = hack.run(max_cycles=401)
+    assert (result.halt_reason, result.cycles, result.pc) == (HaltReason.MAX_CYCLES, 401, 1)
+    assert hack.ram[0] == 100
+
+    # A miscompiled block is caught by the reference executor
+    hack = CompiledHackExecutor(AsmParser(filename).run(), verify=True)
+    func, length, writes = hack.compile_block(0)
+    hack.blocks[0] = (lambda mem, A, D: func(mem, A, D + 1), length, writes)
+    with pytest.raises(RuntimeError):
+        hack.run(max_cycles=100)
+
+
+@pytest.mark.parametrize('executor', [HackExecutor, CompiledHackExecutor])
+def test_halt_detection(tmp_path, executor):
+    # A jump to itself anywhere in the program is an END
+    hack = executor(
+        AsmParser(write_asm(tmp_path, '@7\nD=A\n@0\nM=D\n(DONE)\n@DONE\n0;JMP\n')).run())
+    result = hack.run(max_cycles=100)
+    assert (result.halt_reason, result.pc, result.cycles) == (HaltReason.END, 4, 4)
+    assert hack.ram[0] == 7
+
+    # Polling RAM[1] forever without changing anything is a fixed point
+    hack = executor(
+        AsmParser(write_asm(tmp_path, '(WAIT)\n@1\nD=M\n@WAIT\nD;JEQ\n@2\nM=1\n')).run())
+    result = hack.run(max_cycles=100)
+    assert result.halt_reason == HaltReason.FIXED_POINT
+    assert result.cycles < 10
+
+    # But a loop that writes to RAM isn't
+    hack = executor(AsmParser(write_asm(tmp_path, '(LOOP)\n@0\nM=M+1\n@LOOP\n0;JMP\n')).run())
+    assert hack.run(max_cycles=100).halt_reason == HaltReason.MAX_CYCLES
+
+
+def test_parser_sources(tmp_path):
+    code = '@END // forward reference\nD=0;JMP\n@i\nM=1\n(END)\n@$$ret.1\n@END\n0;JMP\n'
+    from_file = AsmParser(write_asm(tmp_path, code))
+    from_string = AsmParser.from_string(code)
+    from_lines = AsmParser(io.StringIO(code))
+
+    for parser in [from_file, from_string, from_lines]:
+        instructions = parser.run()
+        addresses = [ins.val.get('val') for ins in instructions if ins.type == CT.A_COMMAND]
+        assert addresses == ['4', '16', '17', '4']
+        assert instructions[1].val == {'dest': 'D', 'comp': '0', 'jump': 'JMP'}
+        assert instructions[-1].type == CT.END
+        # The forward reference to the label END doesn't use up a variable address
+        assert parser.symbol_table['i'] == '16'
+        assert parser.symbol_table['$$ret.1'] == '17'
+
+
+@pytest.mark.parametrize('translator_args', [{}, {
+    'optimize': True,
+    'shared_call': True,
+    'shared_compare': True
+}])
+def test_profile(translator_args):
+    asm = io.StringIO()
+    VMtranslator('test/FibonacciElement', output=asm, **translator_args).run()
+    parser = AsmParser.from_string(asm.getvalue())
+    instructions = parser.run()
+
+    # Count the hits of every instruction by stepping through the program
+    stepped = HackExecutor(instructions)
+    expected = [0] * len(instructions)
+    while stepped.opcodes[stepped.pc] != OP_END:
+        expected[stepped.pc] += 1
+        stepped.step()
+
+    # Runs stopped by budgets, breakpoints and watches add up to the same hits
+    hack = HackExecutor(instructions, profile=True)
+    hack.run(max_cycles=1000)
+    hack.run(breakpoints=[int(parser.symbol_table['Main.fibonacci'])])
+    hack.step()
+    hack.run(watch=[256])
+    hack.run()
+    profile = hack.profile()
+    assert profile.hits == expected
+    by_function, by_command = sum(profile.by_function.values()), sum(profile.by_command.values())
+    assert by_function == by_command == hack.cycles == sum(expected)
+    assert max(profile.by_function, key=profile.by_function.get) == 'Main.fibonacci'
+    assert {'push', 'call', 'return', 'lt', 'if-goto'} <= set(profile.by_command)
+
+    with pytest.raises(RuntimeError):
+        HackExecutor(instructions).profile()
+
+
+@pytest.mark.parametrize('executor', [HackExecutor, CompiledHackExecutor])
+def test_snapshot_and_fork(executor):
+    VMtranslator('test/FibonacciElement').run()
+    parser = AsmParser('test/FibonacciElement.asm')
+    instructions = parser.run()
+    expected = HackExecutor(instructions)
+    expected.run()
+
+    # Run the bootstrap code once, up to the first call of Main.fibonacci
+    hack = executor(instructions)
+    hack.run(breakpoints=[int(parser.symbol_table['Main.fibonacci'])])
+    snapshot = hack.snapshot()
+
+    # Forks carry on from there independently of each other
+    forks = [hack.fork() for _ in range(2)]
+    forks[1].ram[256] = 1000
+    result = forks[0].run()
+    assert result.halt_reason == HaltReason.END
+    assert (forks[0].pc, forks[0].cycles, forks[0].ram[256]) == (expected.pc, expected.cycles, 21)
+    assert forks[1].ram[256] == 1000
+    assert (hack.pc, hack.cycles) == (snapshot.pc, snapshot.cycles)
+
+    # Restoring goes back to the snapshot, even after running to the end
+    hack.run()
+    hack.restore(snapshot)
+    assert hack.snapshot() == snapshot
+    hack.run()
+    assert hack.ram.dump(slice(0, 2048)) == expected.ram.dump(slice(0, 2048))
+    with pytest.raises(ValueError):
+        hack.ram.from_bytes(b'\0\0')
+
+
+def test_screen(tmp_path):
+    # Top left pixel, then the rightmost pixel of the second row, then the top left pixel again
+    # after a while
+    code = ('@16384\nM=1\n@16447\nM=-1\nA=-1\nM=-1\n@100\nD=A\n(WAIT)\nD=D-1\n@WAIT\nD;JGT\n'
+            '@16384\nM=-1\n(END)\n@END\n0;JMP\n')
+    hack = HackExecutor(AsmParser(write_asm(tmp_path, code)).run())
+    hack.run(max_cycles=4)
+    screen = hack.screen()
+    assert screen.shape == (256, 512)
+    assert screen.sum() == 17
+    assert screen[0, 0] == 1 and screen[0, 1] == 0
+    assert screen[1, 496:].all() and not screen[1, :496].any()
+    # The VGA controller shows 320x240 pixels, 20 registers per row
+    assert hack.screen(320, 240)[3, 48:64].all()
+
+    # Frames are only written when the screen changed, with the writes to RAM[32767] not counting
+    hack = HackExecutor(AsmParser(write_asm(tmp_path, code)).run())
+    result, frames = hack.record_screen(str(tmp_path / 'frames'), 100)
+    assert result.halt_reason == HaltReason.END
+    names = [os.path.basename(frame) for frame in frames]
+    assert names == ['frame_000000000100.pbm', 'frame_000000000310.pbm']
+    with open(frames[-1], 'rb') as f:
+        header, width, height, pixels = f.read().split(maxsplit=3)
+    assert (header, width, height, len(pixels)) == (b'P4', b'512', b'256', 512 * 256 // 8)
+    # PBM packs the leftmost pixel into the most significant bit
+    assert pixels[:3] == bytes([0xFF, 0xFF, 0x00])
+
+    hack = HackExecutor(AsmParser(write_asm(tmp_path, code)).run())
+    frames = hack.record_screen(str(tmp_path / 'frames'), 1000, image_format='png')[1]
+    with open(frames[0], 'rb') as f:
+        png = f.read()
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    # The image data is every row prefixed with filter type 0, 1 meaning white
+    idat = png.index(b'IDAT')
+    rows = zlib.decompress(png[idat + 4:idat + 4 + int.from_bytes(png[idat - 4:idat], 'big')])
+    assert rows[:4] == bytes([0, 0x00, 0x00, 0xFF]) and len(rows) == 256 * 65
+
+
+@pytest.mark.parametrize('executor', [HackExecutor, CompiledHackExecutor])
+def test_script_keyboard(tmp_path, executor):
+    # Waits for a key, stores it in RAM[0], waits for it to be released and stores the cycle count
+    # in RAM[1]
+    code = ('(WAIT)\n@KBD\nD=M\n@WAIT\nD;JEQ\n@0\nM=D\n'
+            '(RELEASE)\n@KBD\nD=M\n@1\nM=M+1\n@RELEASE\nD;JNE\n(END)\n@END\n0;JMP\n')
+    instructions = AsmParser(write_asm(tmp_path, code)).run()
+
+    # The same program stepped through with the keyboard register set by hand
+    stepped = HackExecutor(instructions)
+    while stepped.opcodes[stepped.pc] != OP_END:
+        stepped.ram[KBD] = {1000: 97, 2500: 0}.get(stepped.cycles, stepped.ram[KBD])
+        stepped.step()
+
+    hack = executor(instructions)
+    hack.script_keyboard([(2500, None), (1000, 'a')])
+    result = hack.run()
+    assert result.halt_reason == HaltReason.END
+    assert (result.cycles, hack.ram[0], hack.ram[1]) == (stepped.cycles, 97, stepped.ram[1])
+    assert not hack.key_events
+
+    # Steps type in the scripted keys too
+    hack = executor(instructions)
+    hack.script_keyboard([(1000, 'a'), (2500, None)])
+    while hack.step().type != CT.END:
+        pass
+    assert (hack.cycles, hack.ram[0], hack.ram[1]) == (stepped.cycles, 97, stepped.ram[1])
+
+    # Waiting for a key isn't a fixed point while there are events still to come, only after the
+    # last one
+    hack = executor(instructions)
+    hack.script_keyboard([(2500, None)])
+    result = hack.run()
+    assert result.halt_reason == HaltReason.FIXED_POINT and 2500 <= result.cycles < 2510
+
+    # Runs stop at breakpoints and budgets as usual, with the events still to come kept for the
+    # next run
+    hack = executor(instructions)
+    hack.script_keyboard([(1000, 'right'), (2500, 0)])
+    result = hack.run(breakpoints=[5])
+    assert (result.halt_reason, result.pc, hack.ram[KBD]) == (HaltReason.BREAKPOINT, 5, 132)
+    result = hack.run(max_cycles=100)
+    assert (result.halt_reason, result.cycles) == (HaltReason.MAX_CYCLES, 100)
+    assert list(hack.key_events) == [(2500, 0)]
+    hack.run()
+    assert (hack.cycles, hack.ram[0], hack.ram[1]) == (stepped.cycles, 132, stepped.ram[1])
+
+    # Snapshots and forks keep the key presses still to come, so restoring replays the same run
+    hack = executor(instructions)
+    hack.script_keyboard([(1000, 'a'), (2500, None)])
+    snapshot = hack.snapshot()
+    fork = hack.fork()
+    hack.run()
+    hack.restore(snapshot)
+    assert list(hack.key_events) == [(1000, 97), (2500, 0)]
+    for machine in (hack, fork):
+        result = machine.run()
+        assert result.halt_reason == HaltReason.END
+        assert (machine.cycles, machine.ram[0]) == (stepped.cycles, 97)
+        assert machine.ram[1] == stepped.ram[1]
@@ -1,24 +1,21 @@
-import sys
-import os.path
-from HackAsmSimulator import HackExecutor, AsmParser, CT
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
-from VMtranslator import VMtranslator
+from HackAsmSimulator import translate_and_run, HaltReason
+
+# Cycle budget for each test program, so that a bad translation fails instead of running forever
+MAX_CYCLES = 100000
 
 
 def test_BasicTest():
-    # Run the VMtranslator
-    VMtranslator('test/BasicTest.vm').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/BasicTest.asm').run())
     # Initialize LCL, ARG, THIS, and THAT to testing values
-    hack.ram[1] = 300
-    hack.ram[2] = 400
-    hack.ram[3] = 3000
-    hack.ram[4] = 3010
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    ram = {
+        1: 300,
+        2: 400,
+        3: 3000,
+        4: 3010,
+    }
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/BasicTest.vm', ram=ram, max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
+
     assert hack.ram[11] == 510
     assert hack.ram[3015] == 45
     assert hack.ram[3012] == 42
@@ -32,14 +29,9 @@ def test_BasicTest():
 
 
 def test_PointerTest():
-    # Run the VMtranslator
-    VMtranslator('test/PointerTest.vm').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/PointerTest.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/PointerTest.vm', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[256] == 6084
     assert hack.ram[3] == 3030
@@ -49,16 +41,12 @@ def test_PointerTest():
 
 
 def test_StaticTest():
-    # Run the VMtranslator
-    VMtranslator('test/StaticTest.vm').run()
-    # Load the resulting asm file into the HackExecutor
-    hack = HackExecutor(AsmParser('test/StaticTest.asm').run())
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/StaticTest.vm', max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[256] == 1110
-    assert hack.ram[17] == 888
-    assert hack.ram[18] == 333
-    assert hack.ram[19] == 111
+    # The static variables take the addresses from 16 on, the forward reference to Sys.init is a label
+    assert hack.ram[16] == 888
+    assert hack.ram[17] == 333
+    assert hack.ram[18] == 111
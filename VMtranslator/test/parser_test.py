@@ -0,0 +1,38 @@
+import sys
+import pytest
+import os.path
+from HackAsmSimulator import translate_and_run, HaltReason
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from VMtranslator import Parser, CT
+
+
+def test_commands(tmp_path):
+    vm = tmp_path / 'Inline.vm'
+    vm.write_text('// full line comment\n'
+                  'function Sys.init 0\n'
+                  '\n'
+                  'push constant 7 // inline comment\n'
+                  '   push constant 8\t\n'
+                  'add//no space before it\n'
+                  'label END // and an infinite loop to end on\n'
+                  'goto END\n')
+    commands = list(Parser(str(vm)).commands())
+    assert [(c.command_type, c.tokens, c.line_number) for c in commands] == [
+        (CT.FUNCTION, ['function', 'Sys.init', '0'], 2),
+        (CT.PUSH, ['push', 'constant', '7'], 4),
+        (CT.PUSH, ['push', 'constant', '8'], 5),
+        (CT.ARITHMETIC, ['add'], 6),
+        (CT.LABEL, ['label', 'END'], 7),
+        (CT.GOTO, ['goto', 'END'], 8),
+    ]
+
+    hack, result = translate_and_run(str(vm), max_cycles=1000)
+    assert result.halt_reason == HaltReason.END
+    assert hack.ram[256] == 15
+
+
+def test_unknown_command(tmp_path):
+    vm = tmp_path / 'Unknown.vm'
+    vm.write_text('push constant 7\nfoo bar\n')
+    with pytest.raises(RuntimeError, match='line 2'):
+        list(Parser(str(vm)).commands())
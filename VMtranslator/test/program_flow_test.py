@@ -1,48 +1,33 @@
-import sys
-import os.path
-from HackAsmSimulator import HackExecutor, AsmParser, CT
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
-from VMtranslator import VMtranslator
+from HackAsmSimulator import translate_and_run, HaltReason
 
+# Cycle budget for each test program, so that a bad translation fails instead of running forever
+MAX_CYCLES = 100000
 
-def test_BasicLoop():
-    # Run the VMtranslator
-    VMtranslator('test/BasicLoop.vm').run()
-
-    # Load the resulting asm file into the HackExecutor
-    asmp = AsmParser('test/BasicLoop.asm')
-    hack = HackExecutor(asmp.run())
 
+def test_BasicLoop():
     # Manual setup for this test
-    hack.ram[int(asmp.symbol_table['LCL'])] = 300
-    hack.ram[int(asmp.symbol_table['ARG'])] = 400
-    hack.ram[400] = 10
-
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    ram = {
+        1: 300,  # LCL
+        2: 400,  # ARG
+        400: 10,
+    }
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/BasicLoop.vm', ram=ram, max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[256] == 55
 
 
 def test_FibonacciSeries():
-    # Run the VMtranslator
-    VMtranslator('test/FibonacciSeries.vm').run()
-
-    # Load the resulting asm file into the HackExecutor
-    asmp = AsmParser('test/FibonacciSeries.asm')
-    hack = HackExecutor(asmp.run())
-
     # Manual setup for this test
-    hack.ram[int(asmp.symbol_table['ARG'])] = 400
-    hack.ram[400] = 6  # 6 elements of the fibonacci series
-    hack.ram[401] = 3000  # Starting at address 3000
-
-    # Simulate program to the end
-    while True:
-        if hack.step().type == CT.END:
-            break
+    ram = {
+        2: 400,  # ARG
+        400: 6,  # 6 elements of the fibonacci series
+        401: 3000,  # Starting at address 3000
+    }
+    # Translate the program and simulate it to the end, all in memory
+    hack, result = translate_and_run('test/FibonacciSeries.vm', ram=ram, max_cycles=MAX_CYCLES)
+    assert result.halt_reason == HaltReason.END
 
     assert hack.ram[3000] == 0
     assert hack.ram[3001] == 1
@@ -0,0 +1,189 @@
+import io
+import sys
+import pytest
+import os.path
+from HackAsmSimulator import AsmParser, HackExecutor, HaltReason, SourceLocation
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from VMtranslator import VMtranslator, CodeWriter, AInstruction, CInstruction, Label, peephole
+
+# Cycle budget for each test program, so that a bad translation fails instead of running forever
+MAX_CYCLES = 100000
+
+# Every translator option at once
+ALL_OPTIONS = {'optimize': True, 'shared_compare': True, 'shared_call': True}
+
+# Every test program along with the RAM it needs seeded
+PROGRAMS = [
+    ('test/SimpleAdd.vm', {}),
+    ('test/SimpleEq.vm', {}),
+    ('test/SimpleGt.vm', {}),
+    ('test/SimpleLt.vm', {}),
+    ('test/SimpleNot.vm', {}),
+    ('test/BasicTest.vm', {
+        1: 300,
+        2: 400,
+        3: 3000,
+        4: 3010
+    }),
+    ('test/PointerTest.vm', {}),
+    ('test/StaticTest.vm', {}),
+    ('test/BasicLoop.vm', {
+        1: 300,
+        2: 400,
+        400: 10
+    }),
+    ('test/FibonacciSeries.vm', {
+        2: 400,
+        400: 6,
+        401: 3000
+    }),
+    ('test/FibonacciElement', {}),
+    ('test/SimpleFunction', {}),
+    ('test/NestedCall', {}),
+    ('test/StaticsTest', {}),
+]
+
+
+def run(program: str, ram: dict, translator_args: dict):
+    '''
+    Translates and runs program, returns the executor, the RunResult and the address of every return
+    address label
+    '''
+    asm = io.StringIO()
+    VMtranslator(program, output=asm, **translator_args).run()
+    parser = AsmParser.from_string(asm.getvalue())
+    hack = HackExecutor(parser.run())
+    for address, value in ram.items():
+        hack.ram[address] = value
+    return_addresses = {
+        symbol: int(address)
+        for symbol, address in parser.symbol_table.items()
+        if symbol.startswith('ra_')
+    }
+    return hack, hack.run(max_cycles=MAX_CYCLES), return_addresses
+
+
+@pytest.mark.parametrize('translator_args', [{
+    'optimize': True
+}, {
+    'comments': False
+}, {
+    'shared_compare': True
+}, {
+    'shared_call': True
+}, ALL_OPTIONS])
+@pytest.mark.parametrize('program, ram', PROGRAMS)
+def test_options_match_default(program, ram, translator_args):
+    reference, reference_result, reference_labels = run(program, ram, {})
+    translated, result, labels = run(program, ram, translator_args)
+
+    assert reference_result.halt_reason == result.halt_reason == HaltReason.END
+    if translator_args == {'optimize': True}:
+        assert result.cycles < reference_result.cycles
+
+    # The return addresses left behind in RAM moved along with their labels
+    moved = {reference_labels[symbol]: labels[symbol] for symbol in reference_labels}
+    expected = [
+        moved.get(value, value) for value in reference.ram.dump(slice(0, len(reference.ram)))
+    ]
+    actual = translated.ram.dump(slice(0, len(translated.ram)))
+    # R13-R15 are the translator's scratch registers, what's left in them differs between options
+    assert actual[:13] + actual[16:] == expected[:13] + expected[16:]
+
+
+def test_peephole_rules():
+    # push static 0, pop pointer 0: the SP round trip and the reloads of the pushed value all go
+    pushpop = [
+        '@Foo.0', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1', '// pop pointer 0', '@SP', 'M=M-1',
+        'A=M', 'D=M', '@THIS', 'M=D'
+    ]
+    assert peephole(pushpop) == [
+        '@Foo.0', 'D=M', '@SP', 'A=M', 'M=D', '// pop pointer 0', '@THIS', 'M=D'
+    ]
+
+    # A label in between is a jump target, so neither the SP round trip nor any knowledge of A and D
+    # survives it
+    with_label = pushpop[:7] + ['(LOOP)'] + pushpop[7:]
+    assert peephole(with_label) == with_label
+
+    # Neither does anything that reads M while A might still be SP
+    with_read = pushpop[:7] + ['D=M'] + pushpop[7:]
+    assert 'M=M+1' in peephole(with_read)
+
+    # Or that reads A before loading it, since A would no longer be SP without the round trip
+    for read_A in [['D=A'], ['A=A+1', 'D=M'], ['D=D+A']]:
+        with_A = pushpop[:7] + read_A + pushpop[7:]
+        assert 'M=M+1' in peephole(with_A)
+    # Once A is loaded again it's fine
+    with_load = pushpop[:7] + ['@5', 'D=D+A'] + pushpop[7:]
+    assert 'M=M+1' not in peephole(with_load)
+
+
+def test_records():
+    writer = CodeWriter(io.StringIO(), comments=False)
+    writer.set_reg('SP', 256)
+    writer.emit_label('LOOP')
+    writer.emit_comment('dropped')
+    writer.emit_blank()
+    # The records after the init code are typed, and serialize as the assembly code
+    records = writer.instructions[writer.routines_offset:]
+    assert records == ['@256', 'D=A', '@SP', 'M=D', '(LOOP)']
+    types = [type(record) for record in records]
+    assert types == [AInstruction, CInstruction, AInstruction, CInstruction, Label]
+    assert records[0].symbol == '256'
+    assert (records[1].dest, records[1].comp, records[1].jump) == ('D', 'A', '')
+
+
+@pytest.mark.parametrize('translator_args', [{}, ALL_OPTIONS])
+@pytest.mark.parametrize('program', ['test/FibonacciElement', 'test/StaticsTest'])
+def test_jobs_match_serial(program, translator_args):
+    # Translating the files in separate processes and linking them gives exactly the same assembly
+    serial, parallel = io.StringIO(), io.StringIO()
+    VMtranslator(program, output=serial, **translator_args).run()
+    VMtranslator(program, output=parallel, jobs=2, **translator_args).run()
+    assert parallel.getvalue() == serial.getvalue()
+
+
+@pytest.mark.parametrize('translator_args', [{}, ALL_OPTIONS])
+@pytest.mark.parametrize('jobs', [None, 2])
+def test_source_map(translator_args, jobs):
+    asm, mapped_asm, source_map = io.StringIO(), io.StringIO(), io.StringIO()
+    VMtranslator('test/FibonacciElement', output=asm, **translator_args).run()
+    VMtranslator('test/FibonacciElement',
+                 output=mapped_asm,
+                 source_map=source_map,
+                 jobs=jobs,
+                 **translator_args).run()
+    # Writing a source map doesn't change the assembly
+    assert mapped_asm.getvalue() == asm.getvalue()
+
+    parser = AsmParser.from_string(asm.getvalue(), source_map.getvalue())
+    instructions = parser.run()
+    # The body of Main.fibonacci starts with `push argument 0` on line 12 of Main.vm
+    location = parser.location(int(parser.symbol_table['Main.fibonacci']))
+    assert (location.file, location.line, location.function) == ('Main.vm', 12, 'Main.fibonacci')
+    # Every instruction is covered, and agrees with the functions going by the comments
+    assert [parser.location(address).function for address in range(len(instructions) - 1)] == \
+        [ins.function for ins in instructions[:-1]]
+    assert parser.location(len(instructions) - 1) is None
+
+
+def test_source_map_file(tmp_path):
+    with open('test/SimpleAdd.vm') as f:
+        (tmp_path / 'SimpleAdd.vm').write_text(f.read())
+    VMtranslator(str(tmp_path / 'SimpleAdd.vm'), source_map=True).run()
+
+    # The parser picks up the source map next to the .asm file
+    parser = AsmParser(str(tmp_path / 'SimpleAdd.asm'))
+    # Reading it before run would find no instructions to spread it over
+    with pytest.raises(RuntimeError):
+        parser.location(0)
+    instructions = parser.run()
+    assert parser.locations is None
+    lines = [parser.location(address).line for address in range(len(instructions) - 1)]
+    # The init code, then the pushes, add and goto, while `function Sys.init 0` and the label take
+    # no instructions
+    assert sorted(set(lines)) == [0, 8, 9, 10, 12]
+    assert parser.location(0) == SourceLocation('', 0, '')
+    assert AsmParser.from_string('@0\n').location(0) is None